@@ -3,6 +3,12 @@ import os
 import sys
 import json
 import getpass
+import socket
+import distutils.util
+from datetime import date, timedelta
+import threading
+from time import time, sleep
+from Queue import LifoQueue, Empty
 
 sys.path.append(os.getcwd() + '/keyring')  # Strange path issue, only appears when run from local console, not IDE
 sys.path.append(os.getcwd() + '/pg8000-master')
@@ -21,6 +27,7 @@ class db_settings():
     DB_HOST = '127.0.0.1'
     PORT = 5432
     DATABASE = 'player_stats'
+    PARTITION_BY_MONTH = False  # Only used when player_activity gets created, needs PostgreSQL 11+
 
 
 class SettingsHelper(db_settings):
@@ -74,6 +81,323 @@ class db_access(SettingsHelper, object):
         logging.debug('Closed DB Connection')
 
 
+class connection_pool(db_access):
+    """ Bounded pool of open connections, shared by everything in the process """
+    MAX_CONNECTIONS = 5
+    CHECKOUT_TIMEOUT = 30  # Seconds to wait for a free connection before giving up
+    HEALTH_CHECK_AGE = 60  # Idle connections older than this get pinged before reuse
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self, max_connections=MAX_CONNECTIONS):
+        super(connection_pool, self).__init__()  # Settings & keyring are only read once per pool
+        self.max_connections = max_connections
+        self.__idle = LifoQueue()  # LIFO keeps the warmest connections in use
+        self.__opened = 0
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def get_pool(cls):
+        """ Returns the process wide pool, creating it on first use """
+        with cls.__instance_lock:
+            if cls.__instance is None:
+                cls.__instance = cls()
+                logging.debug('Created DB connection pool')
+            return cls.__instance
+
+    def checkout(self, timeout=CHECKOUT_TIMEOUT):
+        """ Returns connection & cursor, reusing an idle connection when possible """
+        while True:
+            try:
+                connection, last_used = self.__idle.get_nowait()
+            except Empty:
+                connection = self.__open_if_allowed()
+                if connection is not None:
+                    return connection, connection.cursor()
+                try:
+                    connection, last_used = self.__idle.get(timeout=timeout)
+                except Empty:
+                    raise pg8000.errors.InterfaceError('Timed out waiting for a pooled DB connection')
+
+            if time() - last_used < self.HEALTH_CHECK_AGE or self.__is_healthy(connection):
+                return connection, connection.cursor()
+            self.__discard(connection)  # Stale, loop round and reconnect
+
+    def checkin(self, connection, cursor):
+        """ Ends the transaction and hands the connection back to the pool """
+        try:
+            cursor.close()
+            connection.commit()  # Postgres turns this into a rollback if the transaction failed
+        except (pg8000.errors.Error, socket.error):
+            logging.warning('Dropping broken pooled DB connection')
+            self.__discard(connection)
+        else:
+            self.__idle.put((connection, time()))
+
+    def close_all(self):
+        """ Closes every idle connection, used on shutdown """
+        while True:
+            try:
+                connection, last_used = self.__idle.get_nowait()
+            except Empty:
+                break
+            self.__discard(connection)
+
+    def __open_if_allowed(self):
+        with self.__lock:
+            if self.__opened >= self.max_connections:
+                return None
+            self.__opened += 1
+        try:
+            connection, cursor = self.open_connection()
+        except:
+            with self.__lock:
+                self.__opened -= 1
+            raise
+        return connection
+
+    def __discard(self, connection):
+        with self.__lock:
+            self.__opened -= 1
+        try:
+            connection.close()
+        except (pg8000.errors.Error, socket.error):
+            pass
+        logging.debug('Discarded pooled DB connection')
+
+    @staticmethod
+    def __is_healthy(connection):
+        try:
+            cursor = connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchall()
+            connection.commit()
+            return True
+        except (pg8000.errors.Error, socket.error):
+            logging.warning('Pooled DB connection failed health check')
+            return False
+
+
+class sample_writer(object):
+    """ Buffers player_activity rows and writes them as one binary COPY per flush """
+    MAX_ROWS = 500  # Flush early once this many samples are waiting
+    MAX_AGE = 300  # Flush early once the oldest waiting sample is this many seconds old
+    MAX_PENDING = 50000  # Oldest samples are dropped past this if the DB stays down
+    COPY_COLUMNS = ('"Time_Stamp"', '"Player_Count"', '"Player_Names"', '"Server_Name"')
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self, max_rows=MAX_ROWS, max_age=MAX_AGE):
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.__pending = []
+        self.__oldest = None
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def get_writer(cls):
+        """ Returns the process wide writer, creating it on first use """
+        with cls.__instance_lock:
+            if cls.__instance is None:
+                cls.__instance = cls()
+            return cls.__instance
+
+    def add(self, time_stamp, player_count, player_names, server_name):
+        """ Queues one sample, flushing if the size or time window has been reached """
+        with self.__lock:
+            if not self.__pending:
+                self.__oldest = time()
+            self.__pending.append((time_stamp, player_count, player_names, server_name))
+            window_full = len(self.__pending) >= self.max_rows or time() - self.__oldest >= self.max_age
+        if window_full:
+            self.flush()
+
+    def flush(self):
+        """ Writes every queued sample in a single transaction, keeps them queued on failure """
+        with self.__lock:
+            rows, self.__pending = self.__pending, []
+        if not rows:
+            return
+
+        unwritten = self.__write(rows)
+        if unwritten:
+            self.__requeue(unwritten)
+
+    def __write(self, rows):
+        """ COPYs rows in one transaction, returns the ones to retry later """
+        pool = connection_pool.get_pool()
+        try:
+            conn, cur = pool.checkout()
+            try:
+                usage_rollups.lock_for_write(cur)
+                cur.copy_rows_from(rows, 'player_activity', self.COPY_COLUMNS)
+                conn.commit()  # Here rather than in checkin, which only logs a failed commit
+            finally:
+                pool.checkin(conn, cur)
+        except (pg8000.errors.Error, socket.error) as e:
+            if not self.__is_bad_data(e):
+                logging.exception('Could not write {0} sample(s), will retry'.format(len(rows)))
+                return rows
+            if len(rows) == 1:
+                logging.exception('Dropping sample the DB rejects: {0!r}'.format(rows[0]))
+                return []
+            # Halve the batch until the bad rows are on their own, the rest still go in a few COPYs
+            half = len(rows) // 2
+            unwritten = self.__write(rows[:half])
+            if unwritten:
+                return unwritten + rows[half:]
+            return self.__write(rows[half:])
+        logging.debug('Wrote {0} sample(s)'.format(len(rows)))
+        return []
+
+    @staticmethod
+    def __is_bad_data(error):
+        """ True if retrying won't help, the rows can't be encoded or the DB raised a data exception """
+        if isinstance(error, pg8000.errors.DataError):
+            return True
+        return isinstance(error, pg8000.errors.ProgrammingError) and len(error.args) > 1 and \
+            str(error.args[1]).startswith('22')  # SQLSTATE class 22, data exception
+
+    def __requeue(self, rows):
+        with self.__lock:
+            self.__pending = rows + self.__pending
+            dropped = len(self.__pending) - self.MAX_PENDING
+            if dropped > 0:
+                logging.error('DB unreachable, dropping {0} oldest sample(s)'.format(dropped))
+                del self.__pending[:dropped]
+
+
+class usage_rollups(object):
+    """ Hourly & daily per server usage, kept up to date from the newest player_activity rows """
+    ROLLUP_TABLES = {'player_activity_hourly': 'hour', 'player_activity_daily': 'day'}
+    WATERMARK_NAME = 'player_activity'
+    # "Index" is handed out on insert but only seen on commit, so writes can land out of order. Writers hold
+    # this advisory lock shared until they commit, refresh() takes it exclusively to read a safe watermark.
+    WRITE_LOCK = 0x706c6179
+    PURGE_BATCH_SIZE = 5000  # Rows per DELETE, small enough that monitor inserts never wait long
+    PURGE_BATCH_PAUSE = 0.1  # Seconds between batches
+
+    DDL_QUERY = '''
+    CREATE TABLE IF NOT EXISTS {0} (
+    "Server_Name" TEXT NOT NULL,
+    "Bucket" TIMESTAMP(0) NOT NULL,
+    "Samples" INT4 NOT NULL,
+    "Peak_Players" INT4 NOT NULL,
+    "Player_Minutes" INT8 NOT NULL,
+    CONSTRAINT "{0}_pkey"
+    PRIMARY KEY ("Server_Name", "Bucket"))'''
+    WATERMARK_DDL_QUERY = '''
+    CREATE TABLE IF NOT EXISTS rollup_watermark (
+    "Rollup" TEXT NOT NULL,
+    "Last_Index" INT8 NOT NULL,
+    CONSTRAINT "rollup_watermark_pkey"
+    PRIMARY KEY ("Rollup"))'''
+    # Each sample stands for one minute, so player-minutes is just the sum of player counts
+    UPSERT_QUERY = '''
+    INSERT INTO {0} ("Server_Name", "Bucket", "Samples", "Peak_Players", "Player_Minutes")
+    SELECT "Server_Name", date_trunc('{1}', "Time_Stamp"), count(*), max("Player_Count"), sum("Player_Count")
+    FROM player_activity WHERE "Index" > %s AND "Index" <= %s
+    GROUP BY 1, 2
+    ON CONFLICT ("Server_Name", "Bucket") DO UPDATE SET
+    "Samples" = {0}."Samples" + EXCLUDED."Samples",
+    "Peak_Players" = GREATEST({0}."Peak_Players", EXCLUDED."Peak_Players"),
+    "Player_Minutes" = {0}."Player_Minutes" + EXCLUDED."Player_Minutes"'''
+
+    def create_tables(self):
+        pool = connection_pool.get_pool()
+        conn, cur = pool.checkout()
+        try:
+            for i in sorted(self.ROLLUP_TABLES):
+                cur.execute(self.DDL_QUERY.format(i))
+            cur.execute(self.WATERMARK_DDL_QUERY)
+        except pg8000.errors.ProgrammingError:
+            logging.exception('Could not create rollup tables')
+        finally:
+            pool.checkin(conn, cur)
+
+    def refresh(self):
+        """ Folds raw rows added since the last run into the rollups, returns the new watermark """
+        new_index = self.__committed_index()
+        pool = connection_pool.get_pool()
+        conn, cur = pool.checkout()
+        try:
+            cur.execute('''INSERT INTO rollup_watermark ("Rollup", "Last_Index") VALUES (%s, 0)
+            ON CONFLICT DO NOTHING''', (self.WATERMARK_NAME,))
+            # Row lock stops two refreshes from counting the same rows twice
+            cur.execute('''SELECT "Last_Index" FROM rollup_watermark WHERE "Rollup" = %s FOR UPDATE''',
+                        (self.WATERMARK_NAME,))
+            last_index = cur.fetchone()[0]
+            if new_index is None or new_index <= last_index:
+                return last_index
+
+            for table, bucket in sorted(self.ROLLUP_TABLES.items()):
+                cur.execute(self.UPSERT_QUERY.format(table, bucket), (last_index, new_index))
+            cur.execute('''UPDATE rollup_watermark SET "Last_Index" = %s WHERE "Rollup" = %s''',
+                        (new_index, self.WATERMARK_NAME))
+            logging.info('Rolled up player_activity rows {0} to {1}'.format(last_index + 1, new_index))
+            return new_index
+        finally:
+            pool.checkin(conn, cur)
+
+    @classmethod
+    def lock_for_write(cls, cursor):
+        """ Call before adding player_activity rows, holds off refresh() until the transaction ends """
+        cursor.execute('''SELECT pg_advisory_xact_lock_shared(%s)''', (cls.WRITE_LOCK,))
+
+    @classmethod
+    def lock_for_move(cls, cursor):
+        """ Call before moving player_activity rows between partitions, waits for & holds off every writer """
+        cursor.execute('''SELECT pg_advisory_xact_lock(%s)''', (cls.WRITE_LOCK,))
+
+    def __committed_index(self):
+        """ Newest "Index" once every in-flight write has committed or rolled back """
+        # Own transaction so the lock is let go straight away, later writes only get higher "Index" values
+        pool = connection_pool.get_pool()
+        conn, cur = pool.checkout()
+        try:
+            cur.execute('''SELECT pg_advisory_xact_lock(%s)''', (self.WRITE_LOCK,))
+            cur.execute('''SELECT max("Index") FROM player_activity''')
+            return cur.fetchone()[0]
+        finally:
+            pool.checkin(conn, cur)
+
+    def purge(self, raw_days, hourly_days, batch_size=PURGE_BATCH_SIZE):
+        """ Deletes raw rows older than raw_days and hourly rollups older than hourly_days, returns rows deleted """
+        # Only rows already rolled up get deleted, so no usage is lost. refresh() never moves the watermark past a
+        # row that is still being written, so a slow writer's rows are kept until a later purge
+        watermark = self.refresh()
+        deleted = self.__delete_in_batches('''DELETE FROM player_activity WHERE "Index" IN (
+            SELECT "Index" FROM player_activity
+            WHERE "Time_Stamp" < now() - CAST(%s AS INT4) * '1 day'::INTERVAL AND "Index" <= %s
+            LIMIT %s)''', (raw_days, watermark, batch_size), batch_size)
+        # Daily rollup still covers anything dropped from the hourly one. By primary key, a ctid can change under us
+        deleted += self.__delete_in_batches('''DELETE FROM player_activity_hourly WHERE ("Server_Name", "Bucket") IN (
+            SELECT "Server_Name", "Bucket" FROM player_activity_hourly
+            WHERE "Bucket" < now() - CAST(%s AS INT4) * '1 day'::INTERVAL
+            ORDER BY "Server_Name", "Bucket"
+            LIMIT %s)''', (hourly_days, batch_size), batch_size)
+        return deleted
+
+    def __delete_in_batches(self, query, args, batch_size):
+        """ Every batch is its own short transaction, so locks are held only briefly """
+        pool = connection_pool.get_pool()
+        deleted = 0
+        while True:
+            conn, cur = pool.checkout()
+            try:
+                cur.execute(query, args)
+                batch = cur.rowcount
+            finally:
+                pool.checkin(conn, cur)
+            deleted += batch
+            logging.debug('Purged {0} row(s)'.format(batch))
+            if batch < batch_size:
+                return deleted
+            sleep(self.PURGE_BATCH_PAUSE)
+
+
 class db_helper(db_access):
     """ Lets users send email messages """
     # db = postgresql.open(user = 'usename', database = 'datname', port = 5432)
@@ -113,14 +437,120 @@ class db_helper(db_access):
         "Server_Name" TEXT NOT NULL,
         CONSTRAINT "player_activity_pkey"
         PRIMARY KEY ("Index"))'''
-        conn, cur = self.open_connection()
+        if getattr(self, 'PARTITION_BY_MONTH', False):  # Older settings files won't have it
+            # Partition key has to be part of the primary key
+            DDL_Query = DDL_Query.replace('PRIMARY KEY ("Index"))', 'PRIMARY KEY ("Index", "Time_Stamp"))')
+            DDL_Query += ' PARTITION BY RANGE ("Time_Stamp")'
+        pool = connection_pool.get_pool()
+        conn, cur = pool.checkout()
         try:
             cur.execute(DDL_Query)
         except pg8000.errors.ProgrammingError:
             logging.warn('player_activity already exists')
-        db_access.close_connection(conn, cur)
+        pool.checkin(conn, cur)
+
+    INDEXES = [
+        # Tiny, and rows arrive in time order, so block ranges line up well
+        ('player_activity_time_stamp_brin', 'USING BRIN ("Time_Stamp")'),
+        ('player_activity_server_time_stamp', '("Server_Name", "Time_Stamp")')]
+    PARTITION_QUERY = '''CREATE TABLE IF NOT EXISTS "{0}" PARTITION OF player_activity
+    FOR VALUES FROM ('{1}') TO ('{2}')'''
+    PARTITION_MONTHS_AHEAD = 2
 
-        # TODO Execute on first run
+    def update_schema(self):
+        """ Adds the indexes reports filter on, the rollup tables, and any missing month partitions """
+        self.__create_indexes()
+        usage_rollups().create_tables()
+        self.ensure_partitions()
+
+    def __create_indexes(self):
+        """ Builds any missing index CONCURRENTLY, so the monitor can keep writing while a big table is indexed """
+        pool = connection_pool.get_pool()
+        conn, cur = pool.checkout()
+        conn.autocommit = True  # CONCURRENTLY can't run inside a transaction
+        try:
+            # Not supported on a partitioned table, which is only ever new and empty here (see __create_table)
+            concurrently = '' if self.__is_partitioned(cur) else 'CONCURRENTLY '
+            for name, columns in self.INDEXES:
+                cur.execute('''SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)''', (name,))
+                invalid = cur.fetchall()
+                if invalid and invalid[0][0]:  # Left behind by a build that failed part way
+                    logging.warning('Rebuilding invalid index {0}'.format(name))
+                    cur.execute('''DROP INDEX {0}"{1}"'''.format(concurrently, name))
+                cur.execute('''CREATE INDEX {0}IF NOT EXISTS "{1}" ON player_activity {2}'''.format(
+                    concurrently, name, columns))
+        except pg8000.errors.ProgrammingError:
+            logging.exception('Could not create player_activity indexes')
+        finally:
+            conn.autocommit = False
+            pool.checkin(conn, cur)
+
+    @staticmethod
+    def __is_partitioned(cur):
+        try:
+            cur.execute('''SELECT count(*) FROM pg_partitioned_table
+            WHERE partrelid = 'player_activity'::REGCLASS''')
+            return cur.fetchone()[0] > 0
+        except pg8000.errors.ProgrammingError:
+            return False  # Server is older than PostgreSQL 10
+
+    def ensure_partitions(self, months_ahead=PARTITION_MONTHS_AHEAD):
+        """ Creates this month's and the next few months' partitions, if the table is partitioned """
+        pool = connection_pool.get_pool()
+        conn, cur = pool.checkout()
+        try:
+            if not self.__is_partitioned(cur):
+                return
+
+            month = date.today().replace(day=1)
+            for i in range(months_ahead + 1):
+                next_month = (month + timedelta(days=32)).replace(day=1)
+                self.__create_partition(conn, cur, month, next_month)  # Each month commits on its own
+                month = next_month
+
+            # Created last, a month's partition can't be added while the default one holds rows for it
+            cur.execute('''CREATE TABLE IF NOT EXISTS "player_activity_default"
+            PARTITION OF player_activity DEFAULT''')  # Catches anything outside the created months
+            logging.debug('Partitions checked')
+        except pg8000.errors.ProgrammingError:
+            logging.exception('Could not create player_activity partitions')
+        finally:
+            pool.checkin(conn, cur)
+
+    MOVE_ROWS_QUERY = '''WITH moved AS (
+    DELETE FROM player_activity_default WHERE "Time_Stamp" >= %s AND "Time_Stamp" < %s RETURNING *)
+    INSERT INTO "{0}" SELECT * FROM moved'''
+
+    def __create_partition(self, conn, cur, month, next_month):
+        """ Adds one month's partition, moving any rows the default partition holds for that month into it """
+        name = month.strftime('player_activity_%Y_%m')
+        try:
+            cur.execute('''SELECT to_regclass(%s) IS NULL, to_regclass('player_activity_default') IS NOT NULL''',
+                        (name,))
+            missing, has_default = cur.fetchone()
+            if not missing:
+                return
+            if has_default:
+                usage_rollups.lock_for_move(cur)  # Holds off writers, so no new rows land in the default meanwhile
+                cur.execute('''SELECT count(*) FROM player_activity_default
+                WHERE "Time_Stamp" >= %s AND "Time_Stamp" < %s''', (month, next_month))
+                stray = cur.fetchone()[0]
+            else:
+                stray = 0
+
+            if stray:
+                # Filled as a plain table, then attached once the default partition no longer has its rows
+                cur.execute('''CREATE TABLE "{0}" (LIKE player_activity INCLUDING DEFAULTS)'''.format(name))
+                cur.execute(self.MOVE_ROWS_QUERY.format(name), (month, next_month))
+                cur.execute('''ALTER TABLE player_activity ATTACH PARTITION "{0}"
+                FOR VALUES FROM ('{1}') TO ('{2}')'''.format(name, month, next_month))
+                logging.warning('Moved {0} row(s) out of player_activity_default into {1}'.format(stray, name))
+            else:
+                cur.execute(self.PARTITION_QUERY.format(name, month, next_month))
+            conn.commit()
+        except pg8000.errors.ProgrammingError:
+            conn.rollback()
+            logging.exception('Could not create partition {0}, carrying on with the other months'.format(name))
 
     def test_db_setup(self):
         """ Gets run on startup """
@@ -129,14 +559,18 @@ class db_helper(db_access):
                       keyring.get_password(SettingsHelper.KEYRING_APP_ID, db_settings.USERNAME))
         try:
             logging.info('Testing Database Connection')
-            conn, cur = self.open_connection()
+            pool = connection_pool.get_pool()
+            conn, cur = pool.checkout()
             try:
-                cur.execute('SELECT * FROM player_activity')
-                db_access.close_connection(conn, cur)
+                cur.execute('SELECT 1 FROM player_activity LIMIT 1')
                 logging.info('Connection Successful')
             except pg8000.errors.ProgrammingError:
                 logging.error('Cannot find player_activity table')
+                pool.checkin(conn, cur)
                 self.__create_table()
+            else:
+                pool.checkin(conn, cur)
+            self.update_schema()
         except pg8000.errors.ProgrammingError:
             logging.error('Cannot find player_stats database')
             self.__create_database()
@@ -171,6 +605,13 @@ class db_helper(db_access):
         port = raw_input('({0})>'.format(str(self.PORT)))
         if port:
             db_settings.PORT = int(port)
+
+        print("Partition player_activity by month when it gets created? Needs PostgreSQL 11+ (yes/no)")
+        try:
+            db_settings.PARTITION_BY_MONTH = bool(distutils.util.strtobool(raw_input(
+                '({0})>'.format(['no', 'yes'][getattr(self, 'PARTITION_BY_MONTH', False)]))))
+        except ValueError:
+            pass
         self.saveSettings()
 
         print("Settings Updated")
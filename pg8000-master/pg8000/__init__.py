@@ -33,7 +33,7 @@ __author__ = "Mathieu Fenniak"
 exec("from struct import Struct")
 for fmt in (
         "i", "h", "q", "d", "f", "iii", "ii", "qii", "dii", "ihihih", "ci",
-        "bh", "cccc"):
+        "bh", "cccc", "hhHH"):
     exec(fmt + "_struct = Struct('!" + fmt + "')")
     exec(fmt + "_unpack = " + fmt + "_struct.unpack_from")
     exec(fmt + "_pack = " + fmt + "_struct.pack")
@@ -139,13 +139,19 @@ import pg8000.core
 #
 # @keyparam ssl     Use SSL encryption for TCP/IP socket.  Defaults to False.
 #
+# @keyparam max_prepared_statements  The number of prepared statements kept
+# on the server for reuse.  The least recently used are closed beyond this.
+# Defaults to 256.
+#
 # @return An instance of {@link #ConnectionWrapper ConnectionWrapper}.
 def connect(
         user=None, host='localhost', unix_sock=None, port=5432, database=None,
-        password=None, socket_timeout=60, ssl=False, **kwargs):
+        password=None, socket_timeout=60, ssl=False,
+        max_prepared_statements=None, **kwargs):
 
     return pg8000.core.Connection(
-        user, host, unix_sock, port, database, password, socket_timeout, ssl)
+        user, host, unix_sock, port, database, password, socket_timeout, ssl,
+        max_prepared_statements)
 
 ##
 # The DBAPI level supported.  Currently 2.0.  This property is part of the
@@ -231,13 +237,13 @@ from pg8000.core import utc
 from pg8000.errors import (
     Warning, DatabaseError, InterfaceError,
     ProgrammingError, CopyQueryOrTableRequiredError, Error, OperationalError,
-    IntegrityError, InternalError, NotSupportedError,
+    IntegrityError, InternalError, NotSupportedError, DataError,
     ArrayContentNotHomogenousError, ArrayContentEmptyError,
     ArrayDimensionsNotConsistentError, ArrayContentNotSupportedError)
 
 __all__ = [
     Warning, Bytea, DatabaseError, connect, InterfaceError, ProgrammingError,
     CopyQueryOrTableRequiredError, Error, OperationalError, IntegrityError,
-    InternalError, NotSupportedError, ArrayContentNotHomogenousError,
-    ArrayContentEmptyError, ArrayDimensionsNotConsistentError,
-    ArrayContentNotSupportedError, utc]
+    InternalError, NotSupportedError, DataError,
+    ArrayContentNotHomogenousError, ArrayContentEmptyError,
+    ArrayDimensionsNotConsistentError, ArrayContentNotSupportedError, utc]
@@ -0,0 +1,442 @@
+# An asyncio interface to PostgreSQL.  The connection drives the same
+# protocol code as pg8000.core.Connection (its message handlers, statement
+# cache and type maps) from an event loop, through a StreamReader and
+# StreamWriter.  Messages are queued in a buffer and sent when the protocol
+# code would have flushed, and every reply up to the server's ReadyForQuery
+# is read into the read buffer before the blocking handlers see it, so they
+# never wait on the socket.  Python 3.5 or later is needed.
+#
+#   conn = await pg8000.aio.connect(user="monitor", database="stats")
+#   cursor = conn.cursor()
+#   await cursor.execute("SELECT * FROM player_activity")
+#   async for row in cursor:
+#       ...
+#
+# Operations on a connection are serialised by an asyncio.Lock, so
+# concurrency comes from having a connection per task.  COPY and named
+# (server-side) cursors aren't supported.  An operation that's cancelled
+# part way through leaves the connection out of step with the server, so the
+# connection should be closed.
+
+import asyncio
+from pg8000 import core, i_pack, ii_pack, ci_unpack
+from pg8000.core import (
+    COPY_FAIL, COPY_IN_RESPONSE, NULL_BYTE, READ_BUFFER_SIZE, READY_FOR_QUERY,
+    SYNC_MSG, TERMINATE_MSG)
+from pg8000.errors import (
+    InterfaceError, InternalError, NotSupportedError, ProgrammingError)
+
+
+##
+# Connects to a PostgreSQL server, taking the same arguments as
+# pg8000.connect() apart from socket_timeout.  Timeouts are left to
+# asyncio.wait_for().
+# <p>
+# Stability: A pg8000 extension.
+async def connect(
+        user=None, host='localhost', unix_sock=None, port=5432, database=None,
+        password=None, ssl=False, max_prepared_statements=None, **kwargs):
+    conn = Connection(user, password, max_prepared_statements)
+    await conn._connect(host, unix_sock, port, database, ssl)
+    return conn
+
+
+class Cursor(core.Cursor):
+    def _connection(self):
+        if self._c is None:
+            raise InterfaceError("Cursor closed")
+        elif self._c._sock is None:
+            raise InterfaceError("Connection closed")
+        return self._c
+
+    ##
+    # Executes a database operation.  Parameters may be provided as a
+    # sequence or mapping and will be bound to variables in the operation.
+    # <p>
+    # Stability: A pg8000 extension.
+    async def execute(self, operation, args=None):
+        c = self._connection()
+        async with c._lock:
+            self.stream = None
+            if not c.in_transaction and not c.autocommit:
+                await c.execute(self, "begin transaction", None)
+            await c.execute(self, operation, args)
+
+    ##
+    # Prepares a database operation and then executes it against all
+    # parameter sequences or mappings provided, a batch at a time.
+    # <p>
+    # Stability: A pg8000 extension.
+    async def executemany(self, operation, param_sets):
+        c = self._connection()
+        async with c._lock:
+            self.stream = None
+            if not c.in_transaction and not c.autocommit:
+                await c.execute(self, "begin transaction", None)
+            await c.executemany(self, operation, param_sets)
+
+    # Makes sure there are rows cached, if there are any left to read, and
+    # returns whether there are.
+    async def _rows_ready(self):
+        if self._cached_rows:
+            return True
+        if self.ps is None:
+            raise ProgrammingError("A query hasn't been issued.")
+        elif len(self.ps['row_desc']) == 0:
+            raise ProgrammingError("no result set")
+        if self.portal_suspended:
+            c = self._connection()
+            async with c._lock:
+                c.send_EXECUTE(self)
+                c._write(SYNC_MSG)
+                await c._round_trip()
+                c.handle_messages(self)
+                if not self.portal_suspended:
+                    c.close_portal(self)
+        return len(self._cached_rows) > 0
+
+    ##
+    # Fetches the next row of a query result set, returning a single
+    # sequence, or None when no more data is available.
+    # <p>
+    # Stability: A pg8000 extension.
+    async def fetchone(self):
+        if await self._rows_ready():
+            return self._cached_rows.popleft()
+        return None
+
+    ##
+    # Fetches the next set of rows of a query result, returning a sequence
+    # of sequences.  An empty sequence is returned when no more rows are
+    # available.
+    # <p>
+    # Stability: A pg8000 extension.
+    async def fetchmany(self, num=None):
+        if num is None:
+            num = self.arraysize
+        rows = []
+        while len(rows) < num and await self._rows_ready():
+            rows.append(self._cached_rows.popleft())
+        return tuple(rows)
+
+    ##
+    # Fetches all remaining rows of a query result, returning them as a
+    # sequence of sequences.
+    # <p>
+    # Stability: A pg8000 extension.
+    async def fetchall(self):
+        rows = []
+        while await self._rows_ready():
+            rows.extend(self._cached_rows)
+            self._cached_rows.clear()
+        return tuple(rows)
+
+    ##
+    # Fetches all remaining rows of a query result as columns, like
+    # pg8000.core.Cursor.fetchcolumns().
+    # <p>
+    # Stability: A pg8000 extension.
+    async def fetchcolumns(self, numpy=False):
+        columns = self._start_columns()
+        if self.portal_suspended:
+            c = self._connection()
+            async with c._lock:
+                self.execute_msg = self.portal_name_bin + i_pack(0)
+                c.send_EXECUTE(self)
+                c._write(SYNC_MSG)
+                await c._round_trip()
+                try:
+                    self._columns = columns
+                    c.handle_messages(self)
+                finally:
+                    self._columns = None
+                c.close_portal(self)
+        return self._finish_columns(columns, numpy)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if await self._rows_ready():
+            return self._cached_rows.popleft()
+        raise StopAsyncIteration()
+
+    def __next__(self):
+        raise NotSupportedError(
+            "a pg8000.aio cursor is iterated over with async for")
+
+    def _copy_not_supported(self, *args, **kwargs):
+        raise NotSupportedError("COPY isn't supported by pg8000.aio")
+
+    copy_from = copy_to = copy_execute = copy_rows_from = copy_rows_to = \
+        copy_columns_to = _copy_not_supported
+
+
+class Connection(core.Connection):
+    def __init__(self, user, password, max_prepared_statements):
+        self.setup(user, password, max_prepared_statements)
+        self._lock = asyncio.Lock()
+        self._reader = self._writer = self._sock = None
+
+        # Messages wait here until _send()
+        self._out = bytearray()
+        self._write = self._out.extend
+
+    async def _connect(self, host, unix_sock, port, database, ssl):
+        try:
+            if unix_sock is not None:
+                self._reader, self._writer = \
+                    await asyncio.open_unix_connection(unix_sock)
+            elif host is not None:
+                self._reader, self._writer = await asyncio.open_connection(
+                    host, port)
+            else:
+                raise ProgrammingError(
+                    "one of host or unix_sock must be provided")
+        except OSError as e:
+            raise InterfaceError("communication error", e)
+        self._sock = self._writer
+
+        try:
+            async with self._lock:
+                if ssl:
+                    await self._start_ssl()
+                self._write(self.startup_message(database))
+                await self._send()
+
+                # One message at a time, since the server waits for a
+                # password if it asks for one.
+                message_code = None
+                while message_code != READY_FOR_QUERY:
+                    await self._receive(ready=False)
+                    message_code, start, end = self.read_message()
+                    try:
+                        handle = self.message_types[message_code]
+                    except KeyError:
+                        raise InternalError(
+                            "Unrecognised message code " + message_code)
+                    handle(self._view[start:end].tobytes(), None)
+                    await self._send()
+        except BaseException:
+            self._writer.close()
+            self._sock = None
+            raise
+
+    async def _start_ssl(self):
+        import ssl as sslmodule
+        # Int32(8) - Message length, including self.
+        # Int32(80877103) - The SSL request code.
+        self._writer.write(ii_pack(8, 80877103))
+        await self._writer.drain()
+        if await self._reader.readexactly(1) != b'S':
+            raise InterfaceError("Server refuses SSL")
+        try:
+            start_tls = self._writer.start_tls
+        except AttributeError:
+            raise InterfaceError(
+                "SSL with pg8000.aio needs Python 3.11 or later")
+        # Like pg8000.connect(), the server's certificate isn't checked
+        context = sslmodule.SSLContext(sslmodule.PROTOCOL_TLS_CLIENT)
+        context.check_hostname = False
+        context.verify_mode = sslmodule.CERT_NONE
+        await start_tls(context)
+
+    # The protocol code flushes after writing what the server needs to
+    # reply to.  Here that's done by _send(), once the handlers are done.
+    def _flush(self):
+        pass
+
+    async def _send(self):
+        if len(self._out) > 0:
+            self._writer.write(bytes(self._out))
+            del self._out[:]
+            try:
+                await self._writer.drain()
+            except OSError as e:
+                raise InterfaceError("network error on write", e)
+
+    # Reads from the server until the buffer holds a whole message or, if
+    # ready is set, every message up to the next ReadyForQuery.  A COPY FROM
+    # STDIN is failed as soon as it starts, as there's nothing to send.
+    async def _receive(self, ready=True):
+        if self._buf_start == self._buf_end:
+            if len(self._buffer) > READ_BUFFER_SIZE:
+                self._buffer = bytearray(READ_BUFFER_SIZE)
+                self._view = memoryview(self._buffer)
+            self._buf_start = self._buf_end = 0
+
+        # pos is the offset from _buf_start of the next message to look at
+        pos = 0
+        while True:
+            have = self._buf_end - self._buf_start
+            while have - pos >= 5:
+                message_code, data_len = ci_unpack(
+                    self._buffer, self._buf_start + pos)
+                if have - pos <= data_len:
+                    break
+                pos += data_len + 1
+                if message_code == READY_FOR_QUERY or not ready:
+                    return
+                elif message_code == COPY_IN_RESPONSE:
+                    self._send_message(
+                        COPY_FAIL,
+                        b"COPY FROM STDIN isn't supported by pg8000.aio" +
+                        NULL_BYTE)
+                    self._write(SYNC_MSG)
+                    await self._send()
+
+            try:
+                data = await self._reader.read(READ_BUFFER_SIZE)
+            except OSError as e:
+                raise InterfaceError("network error on read", e)
+            if len(data) == 0:
+                raise InterfaceError("network error on read")
+            self._append(data)
+
+    # Adds data to the end of the read buffer, moving what's left of it to
+    # the front, or into a buffer twice the size, if there isn't room.
+    def _append(self, data):
+        end = self._buf_end + len(data)
+        if end > len(self._buffer):
+            start = self._buf_start
+            have = self._buf_end - start
+            if have + len(data) > len(self._buffer):
+                buf = bytearray(max(2 * len(self._buffer), have + len(data)))
+                buf[:have] = self._view[start:self._buf_end]
+                self._buffer = buf
+                self._view = memoryview(buf)
+            else:
+                self._buffer[:have] = self._buffer[start:self._buf_end]
+            self._buf_start = 0
+            self._buf_end = have
+            end = have + len(data)
+        self._buffer[self._buf_end:end] = data
+        self._buf_end = end
+
+    # Everything the server sends is read by _receive() before the handlers
+    # run, so they shouldn't ever need more.
+    def _fill(self, size):
+        raise InternalError("pg8000.aio handler read past its messages")
+
+    async def _round_trip(self):
+        await self._send()
+        await self._receive()
+
+    def cursor(self):
+        return Cursor(self)
+
+    ##
+    # Commits the current database transaction.
+    # <p>
+    # Stability: A pg8000 extension.
+    async def commit(self):
+        async with self._lock:
+            await self.execute(self._cursor, "commit", None)
+
+    ##
+    # Rolls back the current database transaction.
+    # <p>
+    # Stability: A pg8000 extension.
+    async def rollback(self):
+        async with self._lock:
+            await self.execute(self._cursor, "rollback", None)
+
+    ##
+    # Closes the database connection.
+    # <p>
+    # Stability: A pg8000 extension.
+    async def close(self):
+        if self._sock is None:
+            raise InterfaceError("Connection is closed.")
+        async with self._lock:
+            writer = self._writer
+            self._sock = None
+            try:
+                # Byte1('X') - Identifies the message as a terminate
+                #   message.
+                # Int32(4) - Message length, including self.
+                self._write(TERMINATE_MSG)
+                await self._send()
+            finally:
+                writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    # The same steps as pg8000.core.Connection.execute(), with a round trip
+    # to the server where that one flushes and reads.
+    async def execute(self, cursor, operation, vals):
+        if self._sock is None:
+            raise InterfaceError("Connection closed")
+        self.send_closes()
+        statement, args, params, key = self.convert_operation(
+            operation, vals)
+        ps = await self.get_ps(cursor, statement, params, key, pipeline=True)
+        self.send_bind(cursor, ps, args)
+        await self._round_trip()
+        self.read_execute(cursor, ps, key)
+
+    async def executemany(self, cursor, operation, param_sets):
+        self.send_closes()
+        cursor._cached_rows.clear()
+        cursor._row_count = -1
+        cursor.portal_suspended = False
+        ps = None
+        batch = bytearray()
+        batch_start = 0
+        batch_len = 0
+        implicit_transaction = False
+        try:
+            for vals in param_sets:
+                statement, args, params, key = self.convert_operation(
+                    operation, vals)
+                if batch_len > 0 and (
+                        self.statement_cache.peek(key) is not ps or
+                        batch_len >= self._executemany_batch_size):
+                    if self.autocommit and not self.in_transaction:
+                        await self.execute(
+                            self._cursor, "begin transaction", None)
+                        implicit_transaction = True
+                    await self.sync_batch(cursor, batch, batch_start)
+                    batch = bytearray()
+                    batch_start += batch_len
+                    batch_len = 0
+                ps = await self.get_ps(cursor, statement, params, key)
+                self.add_to_batch(batch, ps, args)
+                batch_len += 1
+
+            if batch_len > 0:
+                await self.sync_batch(cursor, batch, batch_start)
+        except Exception:
+            if implicit_transaction:
+                await self.execute(self._cursor, "rollback", None)
+            raise
+        if implicit_transaction:
+            await self.execute(self._cursor, "commit", None)
+
+    async def sync_batch(self, cursor, batch, batch_start):
+        cursor._commands_completed = 0
+        batch.extend(SYNC_MSG)
+        self._write(batch)
+        await self._round_trip()
+        self.read_batch(cursor, batch_start)
+
+    async def get_ps(self, cursor, statement, params, key, pipeline=False):
+        try:
+            ps = self.statement_cache.get(key)
+            cursor.ps = ps
+            return ps
+        except KeyError:
+            pass
+
+        ps = self.send_parse(cursor, statement, params, pipeline)
+        if 'pipelined' in ps:
+            return ps
+
+        self._write(SYNC_MSG)
+        await self._round_trip()
+        self.handle_messages(cursor)
+        self.finish_ps(ps)
+        self.cache_ps(key, ps)
+        return ps
@@ -34,15 +34,17 @@ from pg8000 import (
     Bytea)
 from pg8000.errors import (
     NotSupportedError, ProgrammingError, InternalError, IntegrityError,
-    OperationalError, DatabaseError, InterfaceError, Error,
+    OperationalError, DatabaseError, InterfaceError, Error, DataError,
     CopyQueryOrTableRequiredError, QueryParameterParseError,
     ArrayContentNotHomogenousError, ArrayContentEmptyError,
     ArrayDimensionsNotConsistentError, ArrayContentNotSupportedError, Warning,
     CopyQueryWithoutStreamError)
 from warnings import warn
+import re
 import socket
 import threading
-from struct import pack
+from struct import (
+    pack, calcsize, unpack_from, Struct, error as struct_error)
 from hashlib import md5
 from decimal import Decimal
 import pg8000
@@ -51,8 +53,9 @@ from pg8000 import (
     i_unpack, ii_unpack, iii_unpack, h_pack, d_unpack, q_unpack, d_pack,
     f_unpack, q_pack, i_pack, h_unpack, dii_unpack, qii_unpack, ci_unpack,
     bh_unpack, ihihih_unpack, cccc_unpack, ii_pack, iii_pack, dii_pack,
-    qii_pack)
+    qii_pack, f_pack, hhHH_unpack, hhHH_pack)
 from collections import deque, defaultdict
+from array import array
 from itertools import count, islice
 from pg8000.six.moves import map
 from pg8000.six import (
@@ -90,169 +93,103 @@ BINARY_SPACE = b(" ")
 DDL_COMMANDS = b("ALTER"), b("CREATE")
 
 
+# Quoted strings and identifiers, where placeholders don't apply.  A quote
+# straight after an E starts an escaped string, E'...', in which \' doesn't
+# end the string.  Unterminated quotes run to the end of the query.
+QUOTED_PATTERN = \
+    r"""(?P<quoted>(?<=E)'(?:\\'|[^'])*'?|'(?:''|[^'])*'?|"[^"]*"?)"""
+PERCENT_PATTERN = r"|(?P<percent>%%|%s|%.?)"
+
+# The lookahead for the characters a match can start with lets the regex skip
+# over everything else quickly.
+PLACEHOLDER_PATTERNS = {
+    'qmark': ("?", r"|(?P<qmark>\?)"),
+    'numeric': (":", r"|(?P<numeric>:)"),
+    'named': (":", r"|:(?P<named>.\w*)?"),
+    'format': ("%", PERCENT_PATTERN),
+    'pyformat': ("%", r"|%\((?P<pyformat>.*?)\)s" + PERCENT_PATTERN)}
+PLACEHOLDER_RES = dict(
+    (style, re.compile(
+        "(?=['\"" + first + "])(?:" + QUOTED_PATTERN + pattern + ")",
+        re.DOTALL))
+    for style, (first, pattern) in PLACEHOLDER_PATTERNS.items())
+QUOTED_PERCENT_RE = re.compile(r"%.?", re.DOTALL)
+
+
+def quoted_percent(match):
+    if match.group() == '%%':
+        return '%'
+    raise QueryParameterParseError(
+        "'" + match.group() + "' not supported in quoted string")
+
+
+# Converts a query from the given DB-API paramstyle to PostgreSQL's $1, $2...
+# placeholders.  Returns the new query, and a function that turns the
+# parameters passed to execute() into a sequence in placeholder order.  A
+# pyformat query may use either %(name)s or %s placeholders, but not both.
 def convert_paramstyle(style, query):
-    # I don't see any way to avoid scanning the query string char by char,
-    # so we might as well take that careful approach and create a
-    # state-based scanner.  We'll use int variables for the state.
-    #  0 -- outside quoted string
-    #  1 -- inside single-quote string '...'
-    #  2 -- inside quoted identifier   "..."
-    #  3 -- inside escaped single-quote string, E'...'
-    #  4 -- inside parameter name eg. :name
-    OUTSIDE = 0
-    INSIDE_SQ = 1
-    INSIDE_QI = 2
-    INSIDE_ES = 3
-    INSIDE_PN = 4
-
-    in_quote_escape = False
-    in_param_escape = False
     placeholders = []
-    output_query = []
-    param_idx = map(lambda x: "$" + str(x), count(1))
-    state = OUTSIDE
-    prev_c = None
-    for i, c in enumerate(query):
-        if i + 1 < len(query):
-            next_c = query[i + 1]
+    positional = []
+
+    def replace(match):
+        kind = match.lastgroup
+        # Only a named placeholder's colon at the very end has no group
+        token = '' if kind is None else match.group(kind)
+        if kind == 'quoted':
+            if style in ('format', 'pyformat') and '%' in token:
+                return QUOTED_PERCENT_RE.sub(quoted_percent, token)
+            return token
+        elif kind == 'qmark':
+            positional.append(None)
+            return "$" + str(len(positional))
+        elif kind == 'numeric':
+            return "$"
+        elif kind == 'percent':
+            if token == '%%':
+                return '%'
+            elif token == '%s':
+                positional.append(None)
+                return "$" + str(len(positional))
+            raise QueryParameterParseError("Only %s and %% are supported")
         else:
-            next_c = None
-
-        if state == OUTSIDE:
-            if c == "'":
-                output_query.append(c)
-                if prev_c == 'E':
-                    state = INSIDE_ES
-                else:
-                    state = INSIDE_SQ
-            elif c == '"':
-                output_query.append(c)
-                state = INSIDE_QI
-            elif style == "qmark" and c == "?":
-                output_query.append(next(param_idx))
-            elif style == "numeric" and c == ":":
-                output_query.append("$")
-            elif style == "named" and c == ":":
-                state = INSIDE_PN
-                placeholders.append('')
-            elif style == "pyformat" and c == '%' and next_c == "(":
-                state = INSIDE_PN
-                placeholders.append('')
-            elif style in ("format", "pyformat") and c == "%":
-                style = "format"
-                if in_param_escape:
-                    in_param_escape = False
-                    output_query.append(c)
-                else:
-                    if next_c == "%":
-                        in_param_escape = True
-                    elif next_c == "s":
-                        state = INSIDE_PN
-                        output_query.append(next(param_idx))
-                    else:
-                        raise QueryParameterParseError(
-                            "Only %s and %% are supported")
-            else:
-                output_query.append(c)
-
-        elif state == INSIDE_SQ:
-            if c == "'":
-                output_query.append(c)
-                if in_quote_escape:
-                    in_quote_escape = False
-                else:
-                    if next_c == "'":
-                        in_quote_escape = True
-                    else:
-                        state = OUTSIDE
-            elif style in ("pyformat", "format") and c == "%":
-                # hm... we're only going to support an escaped percent sign
-                if in_param_escape:
-                    in_param_escape = False
-                    output_query.append(c)
-                else:
-                    if next_c == "%":
-                        in_param_escape = True
-                    else:
-                        raise QueryParameterParseError(
-                            "'%" + next_c + "' not supported in quoted string")
+            if kind == 'pyformat':
+                name = token.replace('(', '').replace(')', '')
             else:
-                output_query.append(c)
-
-        elif state == INSIDE_QI:
-            if c == '"':
-                state = OUTSIDE
-                output_query.append(c)
-            elif style in ("pyformat", "format") and c == "%":
-                # hm... we're only going to support an escaped percent sign
-                if in_param_escape:
-                    in_param_escape = False
-                    output_query.append(c)
-                else:
-                    if next_c == "%":
-                        in_param_escape = True
-                    else:
-                        raise QueryParameterParseError(
-                            "'%" + next_c + "' not supported in quoted string")
-            else:
-                output_query.append(c)
-
-        elif state == INSIDE_ES:
-            if c == "'" and prev_c != "\\":
-                # check for escaped single-quote
-                output_query.append(c)
-                state = OUTSIDE
-            elif style in ("pyformat", "format") and c == "%":
-                # hm... we're only going to support an escaped percent sign
-                if in_param_escape:
-                    in_param_escape = False
-                    output_query.append(c)
-                else:
-                    if next_c == "%":
-                        in_param_escape = True
-                    else:
-                        raise QueryParameterParseError(
-                            "'%" + next_c + "' not supported in quoted string")
-            else:
-                output_query.append(c)
-
-        elif state == INSIDE_PN:
-            if style == 'named':
-                placeholders[-1] += c
-                if next_c is None or (not next_c.isalnum() and next_c != '_'):
-                    state = OUTSIDE
-                    try:
-                        pidx = placeholders.index(placeholders[-1], 0, -1)
-                        output_query.append("$" + str(pidx + 1))
-                        del placeholders[-1]
-                    except ValueError:
-                        output_query.append("$" + str(len(placeholders)))
-            elif style == 'pyformat':
-                if prev_c == ')' and c == "s":
-                    state = OUTSIDE
-                    try:
-                        pidx = placeholders.index(placeholders[-1], 0, -1)
-                        output_query.append("$" + str(pidx + 1))
-                        del placeholders[-1]
-                    except ValueError:
-                        output_query.append("$" + str(len(placeholders)))
-                elif c in "()":
-                    pass
-                else:
-                    placeholders[-1] += c
-            elif style == 'format':
-                state = OUTSIDE
+                name = token
+            try:
+                return "$" + str(placeholders.index(name) + 1)
+            except ValueError:
+                placeholders.append(name)
+                return "$" + str(len(placeholders))
 
-        prev_c = c
+    output_query = PLACEHOLDER_RES[style].sub(replace, query)
 
-    if style in ('numeric', 'qmark', 'format'):
+    if placeholders and positional:
+        raise QueryParameterParseError(
+            "%s and %(name)s placeholders can't be mixed")
+    elif style == 'named' or (style == 'pyformat' and not positional):
         def make_args(vals):
-            return vals
+            return tuple(vals[p] for p in placeholders)
     else:
         def make_args(vals):
-            return tuple(vals[p] for p in placeholders)
+            return vals
+
+    return output_query, make_args
+
 
-    return ''.join(output_query), make_args
+# Commands that never return rows (barring RETURNING), so a new statement
+# doesn't need to be described before it is bound.
+NO_ROWS_COMMANDS = frozenset((
+    "INSERT", "UPDATE", "DELETE", "BEGIN", "START", "COMMIT", "END",
+    "ROLLBACK", "SAVEPOINT", "RELEASE", "CREATE", "ALTER", "DROP", "TRUNCATE",
+    "SET", "RESET", "LOCK", "GRANT", "REVOKE", "COMMENT", "LISTEN",
+    "UNLISTEN", "NOTIFY"))
+
+
+def returns_no_rows(statement):
+    words = statement.split(None, 1)
+    return len(words) > 0 and words[0].upper() in NO_ROWS_COMMANDS and \
+        'RETURNING' not in statement.upper()
 
 
 EPOCH = datetime.datetime(2000, 1, 1)
@@ -263,6 +200,20 @@ utcfromtimestamp = datetime.datetime.utcfromtimestamp
 INFINITY_MICROSECONDS = 2 ** 63 - 1
 MINUS_INFINITY_MICROSECONDS = -1 * INFINITY_MICROSECONDS - 1
 
+EPOCH_ORDINAL = EPOCH.toordinal()
+INFINITY_DAYS = 2 ** 31 - 1
+MINUS_INFINITY_DAYS = -1 * INFINITY_DAYS - 1
+
+NUMERIC_NEG = 0x4000
+NUMERIC_NAN = 0xC000
+NUMERIC_PINF = 0xD000
+NUMERIC_NINF = 0xF000
+NUMERIC_SPECIALS = {
+    NUMERIC_NAN: Decimal('NaN'),
+    NUMERIC_PINF: Decimal('Infinity'),
+    NUMERIC_NINF: Decimal('-Infinity'),
+}
+
 
 # data is 64-bit integer representing microseconds since 2000-01-01
 def timestamp_recv_integer(data, offset, length):
@@ -290,14 +241,17 @@ def timestamp_send_integer(v):
     elif v == datetime.datetime.min:
         micros = MINUS_INFINITY_MICROSECONDS
     else:
-        micros = int(
-            (timegm(v.timetuple()) - EPOCH_SECONDS) * 1e6) + v.microsecond
+        delta = v - EPOCH
+        micros = (delta.days * 86400 + delta.seconds) * 1000000 + \
+            delta.microseconds
     return q_pack(micros)
 
 
 # data is double-precision float representing seconds since 2000-01-01
 def timestamp_send_float(v):
-    return d_pack(timegm(v.timetuple) + v.microsecond / 1e6 - EPOCH_SECONDS)
+    delta = v - EPOCH
+    return d_pack(
+        delta.days * 86400 + delta.seconds + delta.microseconds / 1e6)
 
 
 def timestamptz_send_integer(v):
@@ -384,6 +338,106 @@ def interval_recv_float(data, offset, length):
         return Interval(int(seconds * 1000 * 1000), days, months)
 
 
+# data is 32-bit integer representing days since 2000-01-01
+def date_recv(data, offset, length):
+    days = i_unpack(data, offset)[0]
+    try:
+        return datetime.date.fromordinal(days + EPOCH_ORDINAL)
+    except (ValueError, OverflowError):
+        if days == INFINITY_DAYS:
+            return datetime.date.max
+        elif days == MINUS_INFINITY_DAYS:
+            return datetime.date.min
+        else:
+            raise exc_info()[1]
+
+
+def date_send(v):
+    if v == datetime.date.max:
+        return i_pack(INFINITY_DAYS)
+    elif v == datetime.date.min:
+        return i_pack(MINUS_INFINITY_DAYS)
+    else:
+        return i_pack(v.toordinal() - EPOCH_ORDINAL)
+
+
+# data is 64-bit integer representing microseconds since midnight
+def time_recv_integer(data, offset, length):
+    seconds, micros = divmod(q_unpack(data, offset)[0], 1000000)
+    minutes, second = divmod(seconds, 60)
+    hour, minute = divmod(minutes, 60)
+    return datetime.time(hour, minute, second, micros)
+
+
+# data is double-precision float representing seconds since midnight
+def time_recv_float(data, offset, length):
+    micros = int(round(d_unpack(data, offset)[0] * 1e6))
+    seconds, micros = divmod(micros, 1000000)
+    minutes, second = divmod(seconds, 60)
+    hour, minute = divmod(minutes, 60)
+    return datetime.time(hour, minute, second, micros)
+
+
+def time_send_integer(v):
+    return q_pack(
+        ((v.hour * 60 + v.minute) * 60 + v.second) * 1000000 +
+        v.microsecond)
+
+
+def time_send_float(v):
+    return d_pack(
+        (v.hour * 60 + v.minute) * 60 + v.second + v.microsecond / 1e6)
+
+
+# data is the number of base 10000 digits, the weight of the first digit,
+# the sign, the number of decimal digits after the point, and then the
+# digits as 16-bit integers.
+def numeric_recv(data, offset, length):
+    ndigits, weight, sign, dscale = hhHH_unpack(data, offset)
+    if sign > NUMERIC_NEG:
+        return NUMERIC_SPECIALS[sign]
+
+    n = 0
+    for digit in unpack_from("!%dh" % ndigits, data, offset + 8):
+        n = n * 10000 + digit
+
+    # Scale the digits so that the last decimal digit is the last one the
+    # server would show
+    shift = (weight + 1 - ndigits) * 4 + dscale
+    if shift >= 0:
+        n *= 10 ** shift
+    else:
+        n //= 10 ** -shift
+    return Decimal(('-%dE-%d' if sign else '%dE-%d') % (n, dscale))
+
+
+def numeric_send(v):
+    if not v.is_finite():
+        if v.is_nan():
+            return hhHH_pack(0, 0, NUMERIC_NAN, 0)
+        return hhHH_pack(0, 0, NUMERIC_NINF if v < 0 else NUMERIC_PINF, 0)
+
+    # Split the digits into base 10000 digits, lining them up so that the
+    # point falls between two of them.  Trailing zero digits are dropped.
+    text = '{0:f}'.format(v)
+    point = text.find('.')
+    dscale = 0 if point == -1 else len(text) - point - 1
+    pad = -dscale % 4
+    n = abs(int(text.replace('.', ''))) * 10 ** pad
+    weight = (-dscale - pad) // 4 - 1
+    base_digits = []
+    while n > 0:
+        n, digit = divmod(n, 10000)
+        weight += 1
+        if digit > 0 or len(base_digits) > 0:
+            base_digits.append(digit)
+    base_digits.reverse()
+    return hhHH_pack(
+        len(base_digits), weight if len(base_digits) > 0 else 0,
+        NUMERIC_NEG if v < 0 else 0, dscale) + \
+        pack("!%dh" % len(base_digits), *base_digits)
+
+
 def int8_recv(data, offset, length):
     return q_unpack(data, offset)[0]
 
@@ -404,6 +458,301 @@ def float8_recv(data, offset, length):
     return d_unpack(data, offset)[0]
 
 
+# The struct codes of binary receive functions that just unpack a fixed width
+# value, so that a run of such columns can be read with one Struct.
+FIXED_WIDTH_RECVS = {
+    int2_recv: 'h',
+    int4_recv: 'i',
+    int8_recv: 'q',
+    float4_recv: 'f',
+    float8_recv: 'd',
+}
+
+
+# Builds a function that decodes a DataRow into a list, given the receive
+# function of each column.  The function is called with the buffer holding
+# the message and the offsets of the start and end of its body, so that the
+# row can be read where it lies.  It's generated as straight-line code,
+# with each run of fixed width columns read by a single Struct covering both
+# the lengths and the values.  If one of those lengths isn't the expected
+# width, which is what a NULL looks like, the rest of the row is decoded a
+# column at a time instead.
+#
+# A tuple of binary COPY data is laid out just like a DataRow.  With copy
+# set, the function decodes one of those instead, and returns the row as a
+# tuple along with the offset of the end of the tuple, since COPY data isn't
+# framed by row.
+def make_row_decoder(
+        input_funcs, fixed_width_recvs=FIXED_WIDTH_RECVS, copy=False):
+    input_funcs = tuple(input_funcs)
+    namespace = {'i_unpack': i_unpack}
+    lines = ["def decode(data, idx, end):", "    idx += 2"]
+    col = 0
+    while col < len(input_funcs):
+        code = fixed_width_recvs.get(input_funcs[col])
+        if code is None:
+            namespace['recv_%d' % col] = input_funcs[col]
+            lines.extend((
+                "    vlen = i_unpack(data, idx)[0]",
+                "    idx += 4",
+                "    if vlen == -1:",
+                "        v%d = None" % col,
+                "    else:",
+                "        v%d = recv_%d(data, idx, vlen)" % (col, col),
+                "        idx += vlen"))
+            col += 1
+            continue
+
+        codes = []
+        for func in input_funcs[col:]:
+            code = fixed_width_recvs.get(func)
+            if code is None:
+                break
+            codes.append(code)
+        run = range(col, col + len(codes))
+        st = Struct("!" + "".join("i" + code for code in codes))
+        namespace['unpack_%d' % col] = st.unpack_from
+        namespace['funcs_%d' % col] = input_funcs[col:]
+        lines.extend((
+            "    if idx + %d <= end:" % st.size,
+            "        %s = unpack_%d(data, idx)" % (
+                ", ".join("l%d, v%d" % (i, i) for i in run), col),
+            "    if idx + %d > end or %s:" % (st.size, " or ".join(
+                "l%d != %d" % (i, calcsize("!" + code))
+                for i, code in zip(run, codes))),
+            "        row = [%s]" % ", ".join("v%d" % i for i in range(col)),
+            "        for func in funcs_%d:" % col,
+            "            vlen = i_unpack(data, idx)[0]",
+            "            idx += 4",
+            "            if vlen == -1:",
+            "                row.append(None)",
+            "            else:",
+            "                row.append(func(data, idx, vlen))",
+            "                idx += vlen",
+            "        return tuple(row), idx" if copy else "        return row",
+            "    idx += %d" % st.size))
+        col += len(codes)
+    values = "".join("v%d, " % i for i in range(len(input_funcs)))
+    if copy:
+        lines.append("    return (%s), idx" % values)
+    else:
+        lines.append("    return [%s]" % values)
+
+    exec(compile("\n".join(lines), "<row decoder>", "exec"), namespace)
+    return namespace['decode']
+
+
+# The array typecode for a column of int8s, which Python 2 only has if a long
+# is 64 bits.
+try:
+    array('q')
+    INT8_TYPECODE = 'q'
+except ValueError:
+    INT8_TYPECODE = 'l' if array('l').itemsize == 8 else None
+
+
+# Seconds since the Unix epoch of a timestamp, as it goes into a column
+# array.
+def timestamp_epoch(v):
+    delta = v - (EPOCH if v.tzinfo is None else EPOCH_TZ)
+    return ((delta.days * 86400 + delta.seconds) * 1000000 +
+            delta.microseconds) / 1e6 + EPOCH_SECONDS
+
+
+# The columns that Cursor.fetchcolumns() reads into an array rather than a
+# list, by receive function.  Each has the array's typecode, the struct code
+# of the binary value, the expression that turns the value into an array
+# item, and the function that does the same for a value that's already been
+# received.
+COLUMN_ARRAYS = {
+    int2_recv: ('h', 'h', "%s", None),
+    int4_recv: ('i', 'i', "%s", None),
+    int8_recv: (INT8_TYPECODE, 'q', "%s", None),
+    float4_recv: ('f', 'f', "%s", None),
+    float8_recv: ('d', 'd', "%s", None),
+    timestamp_recv_integer: (
+        'd', 'q', "%s / 1e6 + EPOCH_SECONDS", timestamp_epoch),
+    timestamptz_recv_integer: (
+        'd', 'q', "%s / 1e6 + EPOCH_SECONDS", timestamp_epoch),
+    timestamp_recv_float: ('d', 'd', "%s + EPOCH_SECONDS", timestamp_epoch),
+    timestamptz_recv_float: ('d', 'd', "%s + EPOCH_SECONDS", timestamp_epoch),
+}
+
+
+# Reads the rest of a DataRow into the columns from col on, one value at a
+# time.  The generated column decoder falls back on this for a row that has
+# a NULL in a column being read into an array, which makes the column a list.
+def decode_columns(data, idx, columns, col, input_funcs, converts):
+    for i in range(col, len(input_funcs)):
+        vlen = i_unpack(data, idx)[0]
+        idx += 4
+        if vlen == -1:
+            if isinstance(columns[i], array):
+                columns[i] = columns[i].tolist()
+            columns[i].append(None)
+        else:
+            v = input_funcs[i](data, idx, vlen)
+            idx += vlen
+            columns[i].append(v if converts[i] is None else converts[i](v))
+
+
+# Builds a function that decodes a DataRow by appending each of its values to
+# the list or array for its column, given the receive function of each
+# column.  Returns the typecode of each column's array (None for a list), the
+# function that converts a value already received into an array item (or
+# None), and the decoder.  Like the row decoder, a run of fixed width columns
+# is read with one Struct.
+def make_column_decoder(input_funcs, column_arrays=COLUMN_ARRAYS):
+    input_funcs = tuple(input_funcs)
+    specs = []
+    for func in input_funcs:
+        spec = column_arrays.get(func)
+        specs.append(None if spec is None or spec[0] is None else spec)
+    typecodes = tuple(None if spec is None else spec[0] for spec in specs)
+    converts = tuple(None if spec is None else spec[3] for spec in specs)
+    namespace = {
+        'i_unpack': i_unpack, 'decode_columns': decode_columns,
+        'input_funcs': input_funcs, 'converts': converts,
+        'EPOCH_SECONDS': EPOCH_SECONDS}
+    lines = ["def decode(data, idx, end, columns):", "    idx += 2"]
+    col = 0
+    while col < len(input_funcs):
+        if specs[col] is None:
+            namespace['recv_%d' % col] = input_funcs[col]
+            lines.extend((
+                "    vlen = i_unpack(data, idx)[0]",
+                "    idx += 4",
+                "    if vlen == -1:",
+                "        columns[%d].append(None)" % col,
+                "    else:",
+                "        columns[%d].append(recv_%d(data, idx, vlen))" % (
+                    col, col),
+                "        idx += vlen"))
+            col += 1
+            continue
+
+        run = []
+        for i in range(col, len(input_funcs)):
+            if specs[i] is None:
+                break
+            run.append(i)
+        codes = [specs[i][1] for i in run]
+        st = Struct("!" + "".join("i" + code for code in codes))
+        namespace['unpack_%d' % col] = st.unpack_from
+        lines.extend((
+            "    if idx + %d <= end:" % st.size,
+            "        %s = unpack_%d(data, idx)" % (
+                ", ".join("l%d, v%d" % (i, i) for i in run), col),
+            "    if idx + %d > end or %s:" % (st.size, " or ".join(
+                "l%d != %d" % (i, calcsize("!" + code))
+                for i, code in zip(run, codes))),
+            "        return decode_columns(data, idx, columns, %d, "
+            "input_funcs, converts)" % col,
+            "    idx += %d" % st.size))
+        lines.extend(
+            "    columns[%d].append(%s)" % (i, specs[i][2] % ("v%d" % i))
+            for i in run)
+        col += len(run)
+
+    exec(compile("\n".join(lines), "<column decoder>", "exec"), namespace)
+    return typecodes, converts, namespace['decode']
+
+
+# The binary send functions that just pack a fixed width value, and their
+# struct codes.
+FIXED_WIDTH_SENDS = {
+    h_pack: 'h',
+    i_pack: 'i',
+    q_pack: 'q',
+    f_pack: 'f',
+    d_pack: 'd',
+}
+
+
+# Builds a function that appends a row to a bytearray as a tuple of binary
+# COPY data, given the send function of each column.  Like the row decoder
+# it's generated as straight-line code, with a fixed width value and its
+# length packed by a single Struct.
+def make_row_encoder(send_funcs, fixed_width_sends=FIXED_WIDTH_SENDS):
+    send_funcs = tuple(send_funcs)
+    namespace = {
+        'i_pack': i_pack, 'NULL': NULL, 'count': h_pack(len(send_funcs))}
+    lines = [
+        "def encode(row, buf):",
+        "    %s, = row" % ", ".join("v%d" % i for i in range(len(send_funcs))),
+        "    buf += count"]
+    for col, func in enumerate(send_funcs):
+        code = fixed_width_sends.get(func)
+        lines.extend((
+            "    if v%d is None:" % col,
+            "        buf += NULL",
+            "    else:"))
+        if code is None:
+            namespace['send_%d' % col] = func
+            lines.extend((
+                "        d = send_%d(v%d)" % (col, col),
+                "        buf += i_pack(len(d))",
+                "        buf += d"))
+        else:
+            namespace['pack_%d' % col] = Struct("!i" + code).pack
+            lines.append("        buf += pack_%d(%d, v%d)" % (
+                col, calcsize("!" + code), col))
+
+    exec(compile("\n".join(lines), "<row encoder>", "exec"), namespace)
+    return namespace['encode']
+
+
+# The signature, flags and header extension length that start binary COPY
+# data, and the tuple count of -1 that ends it.
+BINARY_COPY_SIGNATURE = b('PGCOPY\n\xff\r\n\x00')
+BINARY_COPY_HEADER = BINARY_COPY_SIGNATURE + ii_pack(0, 0)
+BINARY_COPY_TRAILER = h_pack(-1)
+
+
+##
+# The rows of a binary COPY FROM, encoded into CopyData messages of at least
+# size bytes as they're sent.
+class CopyRows(object):
+    def __init__(self, rows, encode):
+        self.rows = rows
+        self.encode = encode
+
+    def messages(self, size):
+        encode = self.encode
+        buf = bytearray(5)
+        buf += BINARY_COPY_HEADER
+        for row in self.rows:
+            encode(row, buf)
+            if len(buf) >= size:
+                buf[:5] = COPY_DATA + i_pack(len(buf) - 1)
+                yield buf
+                buf = bytearray(5)
+        buf += BINARY_COPY_TRAILER
+        buf[:5] = COPY_DATA + i_pack(len(buf) - 1)
+        yield buf
+
+
+# Reads a file object for a text COPY FROM, as CopyData messages of up to
+# size bytes of data.
+if PY2:
+    def copy_file_messages(stream, size):
+        while True:
+            data = stream.read(size)
+            if not data:
+                break
+            yield COPY_DATA + i_pack(len(data) + 4) + data
+else:
+    def copy_file_messages(stream, size):
+        bffr = bytearray(size + 5)
+        view = memoryview(bffr)
+        while True:
+            bytes_read = stream.readinto(view[5:])
+            if not bytes_read:
+                break
+            bffr[:5] = COPY_DATA + i_pack(bytes_read + 4)
+            yield view[:bytes_read + 5]
+
+
 def bytea_send(v):
     return v
 
@@ -413,7 +762,7 @@ if PY2:
         return Bytea(data[offset:offset + length])
 else:
     def bytea_recv(data, offset, length):
-        return data[offset:offset + length]
+        return bytes(data[offset:offset + length])
 
 
 def uuid_send(v):
@@ -421,7 +770,7 @@ def uuid_send(v):
 
 
 def uuid_recv(data, offset, length):
-    return UUID(bytes=data[offset:offset+length])
+    return UUID(bytes=bytes(data[offset:offset+length]))
 
 
 TRUE = b("\x01")
@@ -445,6 +794,50 @@ def int_in(data, offset, length):
     return int(data[offset: offset + length])
 
 
+# int2vector and oidvector, eg. '1 2 3'
+def vector_in(data, offset, length):
+    return [int(v) for v in data[offset:offset + length].split()]
+
+
+# The tokens of an array literal are braces and elements, which are either
+# quoted (with backslash escapes) or bare.  The delimiters between them are
+# skipped.
+ARRAY_TOKEN_RE = re.compile(r'(\{)|(\})|"((?:[^"\\]|\\.)*)"|([^{},"]+)')
+ARRAY_ESCAPE_RE = re.compile(r'\\(.)', re.DOTALL)
+
+
+##
+# Parses the text form of an array, eg. '{{1,NULL},{"a\"b",4}}', into nested
+# lists, converting each element string with convert.  The tokens are
+# consumed as they're matched, so no intermediate copy of the text is made.
+# Any dimension decoration, eg. '[0:1]=', in front of the outer brace is
+# skipped.
+def parse_array(text, convert):
+    stack = []
+    current = None
+    for m in ARRAY_TOKEN_RE.finditer(text, text.find('{')):
+        kind = m.lastindex
+        if kind == 1:
+            arr = []
+            if current is not None:
+                current.append(arr)
+                stack.append(current)
+            current = arr
+        elif kind == 2:
+            if len(stack) == 0:
+                break
+            current = stack.pop()
+        elif kind == 3:
+            v = m.group(3)
+            if '\\' in v:
+                v = ARRAY_ESCAPE_RE.sub(r'\1', v)
+            current.append(convert(v))
+        else:
+            v = m.group(4)
+            current.append(None if v == 'NULL' else convert(v))
+    return current
+
+
 ##
 # The class of object returned by the {@link #ConnectionWrapper.cursor cursor
 # method}.
@@ -461,7 +854,7 @@ def int_in(data, offset, length):
 #
 # @param connection     An instance of {@link Connection Connection}.
 class Cursor(Iterator):
-    def __init__(self, connection):
+    def __init__(self, connection, name=None):
         self._c = connection
         self.arraysize = 1
         self.ps = None
@@ -469,6 +862,36 @@ class Cursor(Iterator):
         self._cached_rows = deque()
         self.portal_name = None
         self.portal_suspended = False
+        self._commands_completed = 0
+        self.fetch_size = connection._row_cache_size
+        self.name = name
+        if name is not None:
+            self._quoted_name = '"' + name.replace('"', '""') + '"'
+            self._name_bin = name.encode(connection._client_encoding) + \
+                NULL_BYTE
+        self._server_cursor_open = False
+        self._server_row_count = 0
+        self._fetches = set()
+        self._columns = None
+
+    def _setFetchSize(self, value):
+        if value == 'all':
+            self._fetch_size_bin = i_pack(0)
+        elif isinstance(value, integer_types) and 0 < value <= max_int4:
+            self._fetch_size_bin = i_pack(value)
+        else:
+            raise ProgrammingError(
+                "fetch_size must be a positive integer or 'all'")
+        self._fetch_size = value
+
+    ##
+    # The number of rows read from the server at a time while iterating over
+    # the results, or 'all' to read them all at once.  Defaults to 100.  For
+    # an unnamed cursor in autocommit mode, all rows are read at once anyway,
+    # since the result set doesn't outlive the implicit transaction.
+    # <p>
+    # Stability: A pg8000 extension.
+    fetch_size = property(lambda self: self._fetch_size, _setFetchSize)
 
     ##
     # This read-only attribute returns a reference to the connection object on
@@ -529,7 +952,10 @@ class Cursor(Iterator):
 
             if not self._c.in_transaction and not self._c.autocommit:
                 self._c.execute(self, "begin transaction", None)
-            self._c.execute(self, operation, args)
+            if self.name is None:
+                self._c.execute(self, operation, args)
+            else:
+                self._declare(operation, args)
         except AttributeError:
             if self._c is None:
                 raise InterfaceError("Cursor closed")
@@ -546,9 +972,60 @@ class Cursor(Iterator):
     # <p>
     # Stability: Part of the DBAPI 2.0 specification.
     def executemany(self, operation, param_sets):
-        for parameters in param_sets:
-            self.execute(operation, parameters)
-        self._row_count = -1
+        try:
+            self._c._lock.acquire()
+            self.stream = None
+
+            if not self._c.in_transaction and not self._c.autocommit:
+                self._c.execute(self, "begin transaction", None)
+            self._c.executemany(self, operation, param_sets)
+        except AttributeError:
+            if self._c is None:
+                raise InterfaceError("Cursor closed")
+            elif self._c._sock is None:
+                raise InterfaceError("Connection closed")
+            else:
+                raise exc_info()[1]
+        finally:
+            self._c._lock.release()
+
+    # A named cursor runs its query as a server-side cursor, and fetches
+    # fetch_size rows at a time from it while iterating.  Outside a
+    # transaction (in autocommit mode) it's declared WITH HOLD, so that it
+    # outlives the implicit transaction.
+    def _declare(self, operation, args):
+        if self._server_cursor_open:
+            self._close_server_cursor()
+        hold = "WITH HOLD " if not self._c.in_transaction else ""
+        self._c.execute(
+            self, "DECLARE " + self._quoted_name + " NO SCROLL CURSOR " +
+            hold + "FOR " + operation, args)
+        self._server_cursor_open = True
+        self._server_row_count = 0
+        self._fetch_server_rows()
+
+    def _fetch_server_rows(self):
+        if self._fetch_size == 'all':
+            fetch = "FETCH ALL FROM " + self._quoted_name
+        else:
+            fetch = "FETCH FORWARD " + str(self._fetch_size) + " FROM " + \
+                self._quoted_name
+        self._fetches.add(fetch)
+        self._c.execute(self, fetch, None)
+        fetched = self._row_count
+        self._server_row_count += fetched
+        self._row_count = self._server_row_count
+        if self._fetch_size == 'all' or fetched < self._fetch_size:
+            self._close_server_cursor()
+
+    # A FETCH is described with the columns of the query the cursor was
+    # declared for, so the prepared FETCHes go with the server-side cursor.
+    def _close_server_cursor(self):
+        self._c.close_cursor(self._name_bin)
+        for fetch in self._fetches:
+            self._c.forget_ps(fetch)
+        self._fetches.clear()
+        self._server_cursor_open = False
 
     def copy_from(self, fileobj, table=None, sep='\t', null=None, query=None):
         if query is None:
@@ -571,6 +1048,108 @@ class Cursor(Iterator):
     def copy_execute(self, fileobj, query):
         self.execute(query, stream=fileobj)
 
+    ##
+    # Loads a sequence or iterator of rows into a table with a binary COPY
+    # FROM.  Each row is a sequence with a value for each of the given
+    # columns, or for every column of the table if none are given.  The
+    # values are encoded with the binary send function of their column's
+    # type, and streamed to the server as the rows are iterated over.
+    # <p>
+    # Stability: A pg8000 extension.
+    def copy_rows_from(self, rows, table, columns=None):
+        if columns is None:
+            select, column_list = "*", ""
+        else:
+            select = ", ".join(columns)
+            column_list = " (" + select + ")"
+        try:
+            self._c._lock.acquire()
+            self.stream = None
+
+            if not self._c.in_transaction and not self._c.autocommit:
+                self._c.execute(self, "begin transaction", None)
+            self.stream = CopyRows(
+                rows,
+                self._c.get_row_encoder(
+                    self, "SELECT " + select + " FROM " + table))
+            self._c.execute(
+                self, "COPY " + table + column_list +
+                " FROM STDIN WITH BINARY", None)
+        except AttributeError:
+            if self._c is None:
+                raise InterfaceError("Cursor closed")
+            elif self._c._sock is None:
+                raise InterfaceError("Connection closed")
+            else:
+                raise exc_info()[1]
+        finally:
+            self.stream = None
+            self._c._lock.release()
+
+    ##
+    # Reads the rows of a table, or of a query, with a binary COPY TO.
+    # Returns an iterator over the rows, each a tuple, which are decoded as
+    # they arrive.  The query can't have parameters.  The connection can't be
+    # used for anything else until the iterator is exhausted or closed.
+    # <p>
+    # Stability: A pg8000 extension.
+    def copy_rows_to(self, table=None, columns=None, query=None):
+        if query is not None:
+            return self._copy_out(query, "(" + query + ")")
+        elif table is None:
+            raise CopyQueryOrTableRequiredError()
+        elif columns is None:
+            return self._copy_out("SELECT * FROM " + table, table)
+        else:
+            select = ", ".join(columns)
+            return self._copy_out(
+                "SELECT " + select + " FROM " + table,
+                table + " (" + select + ")")
+
+    ##
+    # Like copy_rows_to, but returns the values of each column in a list of
+    # their own.
+    # <p>
+    # Stability: A pg8000 extension.
+    def copy_columns_to(self, table=None, columns=None, query=None):
+        rows = self.copy_rows_to(table, columns, query)
+        cols = None
+        for row in rows:
+            if cols is None:
+                cols = tuple([] for v in row)
+                appends = tuple(col.append for col in cols)
+            for append, v in zip(appends, row):
+                append(v)
+        if cols is None:
+            cols = tuple([] for f in self.ps['row_desc'])
+        return list(cols)
+
+    def _copy_out(self, query, target):
+        rows = None
+        try:
+            self._c._lock.acquire()
+            self.stream = None
+
+            if not self._c.in_transaction and not self._c.autocommit:
+                self._c.execute(self, "begin transaction", None)
+            statement, decode = self._c.get_copy_out(self, query, target)
+            rows = self._c.copy_out(self, statement, decode)
+            for row in rows:
+                yield row
+        except AttributeError:
+            if self._c is None:
+                raise InterfaceError("Cursor closed")
+            elif self._c._sock is None:
+                raise InterfaceError("Connection closed")
+            else:
+                raise exc_info()[1]
+        finally:
+            # If the rows weren't all read, this reads the rest of the
+            # messages before anything else can use the connection.
+            if rows is not None:
+                rows.close()
+            self._c._lock.release()
+
     ##
     # Fetch the next row of a query result set, returning a single sequence, or
     # None when no more data is available.
@@ -612,11 +1191,97 @@ class Cursor(Iterator):
         except TypeError:
             raise ProgrammingError("attempting to use unexecuted cursor")
 
+    ##
+    # Fetch all remaining rows of a query result as columns, returning a list
+    # holding a sequence of values for each column.  Integer, float and
+    # timestamp columns are decoded straight into an array.array, timestamps
+    # as seconds since the Unix epoch.  Other columns, and any column that
+    # holds a NULL, are lists.  If numpy is set, the arrays are returned as
+    # numpy arrays (sharing the array's memory).
+    # <p>
+    # The rows already read by execute() (up to fetch_size of them, or all of
+    # them for an unnamed cursor in autocommit mode) are moved across from
+    # rows, and the rest are read without ever becoming rows.
+    # <p>
+    # Stability: A pg8000 extension.
+    def fetchcolumns(self, numpy=False):
+        try:
+            self._c._lock.acquire()
+            columns = self._start_columns()
+            try:
+                self._columns = columns
+                if self.portal_suspended:
+                    # The rest of the rows are read in one go
+                    self.execute_msg = self.portal_name_bin + i_pack(0)
+                    self._c.send_EXECUTE(self)
+                    self._c._write(SYNC_MSG)
+                    self._c._flush()
+                    self._c.handle_messages(self)
+                    self._c.close_portal(self)
+                while self._server_cursor_open:
+                    self._fetch_server_rows()
+            finally:
+                self._columns = None
+            return self._finish_columns(columns, numpy)
+        except AttributeError:
+            if self._c is None:
+                raise InterfaceError("Cursor closed")
+            elif self._c._sock is None:
+                raise InterfaceError("Connection closed")
+            else:
+                raise exc_info()[1]
+        finally:
+            self._c._lock.release()
+
+    # The columns for fetchcolumns(), holding the rows read so far.
+    def _start_columns(self):
+        if self.ps is None:
+            raise ProgrammingError("A query hasn't been issued.")
+        elif len(self.ps['row_desc']) == 0:
+            raise ProgrammingError("no result set")
+        try:
+            typecodes, converts, decode = self.ps['column_decoder']
+        except KeyError:
+            typecodes, converts, decode = self.ps['column_decoder'] = \
+                make_column_decoder(self.ps['input_funcs'])
+
+        columns = []
+        for i, typecode in enumerate(typecodes):
+            values = [row[i] for row in self._cached_rows]
+            if converts[i] is not None:
+                values = [None if v is None else converts[i](v)
+                          for v in values]
+            if typecode is None or None in values:
+                columns.append(values)
+            else:
+                columns.append(array(typecode, values))
+        self._cached_rows.clear()
+        return columns
+
+    def _finish_columns(self, columns, numpy):
+        if numpy:
+            try:
+                from numpy import asarray
+            except ImportError:
+                raise InterfaceError(
+                    "numpy arrays requested but numpy is not available in "
+                    "this python installation")
+            columns = [
+                asarray(column) if isinstance(column, array) else column
+                for column in columns]
+        return columns
+
     ##
     # Close the cursor.
     # <p>
     # Stability: Part of the DBAPI 2.0 specification.
     def close(self):
+        if self._server_cursor_open and self._c is not None:
+            try:
+                self._c._lock.acquire()
+                self._close_server_cursor()
+            finally:
+                self._c._lock.release()
         self._c = None
 
     def __iter__(self):
@@ -640,6 +1305,8 @@ class Cursor(Iterator):
                 self._c.handle_messages(self)
                 if not self.portal_suspended:
                     self._c.close_portal(self)
+            elif self._server_cursor_open:
+                self._fetch_server_rows()
             try:
                 return self._cached_rows.popleft()
             except IndexError:
@@ -673,6 +1340,7 @@ COPY_DONE = b("c")
 COPY_DATA = b("d")
 COPY_IN_RESPONSE = b("G")
 COPY_OUT_RESPONSE = b("H")
+COPY_FAIL = b("f")
 
 BIND = b("B")
 PARSE = b("P")
@@ -685,10 +1353,18 @@ TERMINATE = b('X')
 CLOSE = b('C')
 
 FLUSH_MSG = FLUSH + i_pack(4)
+UNNAMED_EXECUTE_MSG = NULL_BYTE + i_pack(0)  # unnamed portal, all rows
 SYNC_MSG = SYNC + i_pack(4)
 TERMINATE_MSG = TERMINATE + i_pack(4)
 COPY_DONE_MSG = COPY_DONE + i_pack(4)
 
+# The least amount of data sent in each CopyData message of a COPY FROM.
+COPY_CHUNK_SIZE = 65536
+
+# The size of the buffer that messages from the server are read into.  A
+# message that won't fit gets a buffer of its own size while it's read.
+READ_BUFFER_SIZE = 65536
+
 # DESCRIBE constants
 STATEMENT = b('S')
 PORTAL = b('P')
@@ -712,6 +1388,115 @@ IDLE_IN_TRANSACTION = b("T")
 IDLE_IN_FAILED_TRANSACTION = b("E")
 
 
+# A least recently used cache, limited to capacity entries.  Entries are kept
+# in a circular doubly linked list, most recently used at the front, so that
+# lookups and evictions don't have to search.  put() returns the values pushed
+# out to make room, so that the caller can release them (closing prepared
+# statements on the server, say).  The hits, misses and evictions counters
+# can be reset at will.  It isn't thread-safe.
+class LRUCache(object):
+    PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._links = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+
+    def __len__(self):
+        return len(self._links)
+
+    def __contains__(self, key):
+        return key in self._links
+
+    def peek(self, key):
+        link = self._links.get(key)
+        return None if link is None else link[LRUCache.VALUE]
+
+    def get(self, key):
+        try:
+            link = self._links[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        self._unlink(link)
+        self._push(link)
+        return link[LRUCache.VALUE]
+
+    def put(self, key, value):
+        link = self._links.pop(key, None)
+        if link is not None:
+            self._unlink(link)
+        link = [None, None, key, value]
+        self._links[key] = link
+        self._push(link)
+
+        evicted = []
+        while len(self._links) > max(self.capacity, 1):
+            oldest = self._root[LRUCache.PREV]
+            self._unlink(oldest)
+            del self._links[oldest[LRUCache.KEY]]
+            evicted.append(oldest[LRUCache.VALUE])
+        self.evictions += len(evicted)
+        return evicted
+
+    def pop(self, key):
+        link = self._links.pop(key, None)
+        if link is None:
+            return None
+        self._unlink(link)
+        return link[LRUCache.VALUE]
+
+    def clear(self):
+        values = [link[LRUCache.VALUE] for link in self._links.values()]
+        self._links.clear()
+        self._root[:] = [self._root, self._root, None, None]
+        return values
+
+    def _push(self, link):
+        root = self._root
+        first = root[LRUCache.NEXT]
+        link[LRUCache.PREV] = root
+        link[LRUCache.NEXT] = first
+        first[LRUCache.PREV] = link
+        root[LRUCache.NEXT] = link
+
+    def _unlink(self, link):
+        prev_link, next_link = link[LRUCache.PREV], link[
+            LRUCache.NEXT]
+        prev_link[LRUCache.NEXT] = next_link
+        next_link[LRUCache.PREV] = prev_link
+
+
+# Converting a query only depends on the paramstyle and the query, so the
+# results are shared by all connections.
+converted_queries = LRUCache(1024)
+converted_queries_lock = threading.Lock()
+
+
+def convert_paramstyle_cached(style, query):
+    key = style, query
+    try:
+        converted_queries_lock.acquire()
+        return converted_queries.get(key)
+    except KeyError:
+        pass
+    finally:
+        converted_queries_lock.release()
+
+    converted = convert_paramstyle(style, query)
+    try:
+        converted_queries_lock.acquire()
+        converted_queries.put(key, converted)
+    finally:
+        converted_queries_lock.release()
+    return converted
+
+
 # Byte1('N') - Identifier
 # Int32 - Message length
 # Any number of these, followed by a zero byte:
@@ -787,7 +1572,15 @@ class Connection(object):
     # That is, the library reads more rows when the cache is empty
     # automatically.
     _row_cache_size = 100
-    _row_cache_size_bin = i_pack(_row_cache_size)
+
+    # The number of parameter sets executemany sends before waiting for the
+    # server's replies.  The replies are buffered by the server until we read
+    # them, so this is kept low enough for them to fit in the socket buffers.
+    _executemany_batch_size = 1000
+
+    # The number of prepared statements kept open on the server, by default.
+    # Beyond this the least recently used ones are closed.
+    _max_prepared_statements = 256
 
     def _getError(self, error):
         warn(
@@ -797,33 +1590,8 @@ class Connection(object):
 
     def __init__(
             self, user, host, unix_sock, port, database, password,
-            socket_timeout, ssl):
-        self._client_encoding = "ascii"
-        self._commands_with_count = (
-            b("INSERT"), b("DELETE"), b("UPDATE"), b("MOVE"),
-            b("FETCH"), b("COPY"), b("SELECT"))
-        self._lock = threading.Lock()
-
-        if user is None:
-            try:
-                self.user = os.environ['PGUSER']
-            except KeyError:
-                try:
-                    self.user = os.environ['USER']
-                except KeyError:
-                    raise InterfaceError(
-                        "The 'user' connection parameter was omitted, and "
-                        "neither the PGUSER or USER environment variables "
-                        "were set.")
-        else:
-            self.user = user
-
-        self.password = password
-        self.autocommit = False
-
-        self._caches = defaultdict(lambda: defaultdict(dict))
-        self.statement_number = 0
-        self.portal_number = 0
+            socket_timeout, ssl, max_prepared_statements=None):
+        self.setup(user, password, max_prepared_statements)
 
         try:
             if unix_sock is None and host is not None:
@@ -863,17 +1631,74 @@ class Connection(object):
 
             # settimeout causes ssl failure, on windows.  Python bug 1462352.
             self._usock.settimeout(socket_timeout)
-            self._sock = self._usock.makefile(mode="rwb")
+            self._sock = self._usock.makefile(mode="wb")
         except socket.error:
             self._usock.close()
             raise InterfaceError("communication error", exc_info()[1])
         self._flush = self._sock.flush
-        self._read = self._sock.read
 
         if PRE_26:
             self._write = self._sock.writelines
         else:
             self._write = self._sock.write
+
+        self._write(self.startup_message(database))
+        self._flush()
+
+        try:
+            try:
+                self._lock.acquire()
+                self.handle_messages(None)
+            finally:
+                self._lock.release()
+        except:
+            self.close()
+            raise exc_info()[1]
+
+    # Sets up everything about the connection but its socket: the type
+    # maps, the message handlers and an empty read buffer.  The asyncio
+    # connection in pg8000.aio is set up the same way.
+    def setup(self, user, password, max_prepared_statements):
+        self._client_encoding = "ascii"
+        self._commands_with_count = (
+            b("INSERT"), b("DELETE"), b("UPDATE"), b("MOVE"),
+            b("FETCH"), b("COPY"), b("SELECT"))
+        self._lock = threading.Lock()
+
+        if user is None:
+            try:
+                self.user = os.environ['PGUSER']
+            except KeyError:
+                try:
+                    self.user = os.environ['USER']
+                except KeyError:
+                    raise InterfaceError(
+                        "The 'user' connection parameter was omitted, and "
+                        "neither the PGUSER or USER environment variables "
+                        "were set.")
+        else:
+            self.user = user
+
+        self.password = password
+        self.autocommit = False
+
+        if max_prepared_statements is None:
+            max_prepared_statements = Connection._max_prepared_statements
+        self.statement_cache = LRUCache(max_prepared_statements)
+        self.statement_number = 0
+        self.portal_number = 0
+        self._portals_to_close = []
+        self._statements_to_close = []
+        self._cursors_to_close = []
+
+        # Messages from the server are read straight off the socket into this
+        # buffer, as many as will fit at a time, and handled where they lie.
+        # _buf_start is where the next message begins, and _buf_end is the
+        # end of what's been read so far.
+        self._buffer = bytearray(READ_BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        self._buf_start = self._buf_end = 0
+
         self._backend_key_data = None
 
         ##
@@ -917,37 +1742,12 @@ class Connection(object):
         def text_out(v):
             return v.encode(self._client_encoding)
 
-        def time_out(v):
-            return v.isoformat().encode(self._client_encoding)
-
-        def date_out(v):
-            if v == datetime.date.max:
-                return 'infinity'.encode(self._client_encoding)
-            elif v == datetime.date.min:
-                return '-infinity'.encode(self._client_encoding)
-            else:
-                return v.isoformat().encode(self._client_encoding)
-
         def unknown_out(v):
             return str(v).encode(self._client_encoding)
 
-        trans_tab = dict(zip(map(ord, u('{}')), u('[]')))
-        glbls = {'Decimal': Decimal}
-
         def array_in(data, idx, length):
-            arr = []
-            prev_c = None
-            for c in data[idx:idx+length].decode(
-                    self._client_encoding).translate(
-                    trans_tab).replace(u('NULL'), u('None')):
-                if c not in ('[', ']', ',', 'N') and prev_c in ('[', ','):
-                    arr.extend("Decimal('")
-                elif c in (']', ',') and prev_c not in ('[', ']', ',', 'e'):
-                    arr.extend("')")
-
-                arr.append(c)
-                prev_c = c
-            return eval(''.join(arr), glbls)
+            return parse_array(
+                data[idx:idx + length].decode(self._client_encoding), Decimal)
 
         def array_recv(data, idx, length):
             final_idx = idx + length
@@ -981,17 +1781,13 @@ class Connection(object):
                 values = list(map(list, zip(*[iter(values)] * length)))
             return values
 
-        def vector_in(data, idx, length):
-            return eval('[' + data[idx:idx+length].decode(
-                self._client_encoding).replace(' ', ',') + ']')
-
         if PY2:
             def text_recv(data, offset, length):
-                return unicode(  # noqa
-                    data[offset: offset + length], self._client_encoding)
+                return data[offset: offset + length].decode(
+                    self._client_encoding)
 
             def bool_recv(d, o, l):
-                return d[o] == "\x01"
+                return d[o:o + 1] == "\x01"
 
         else:
             def text_recv(data, offset, length):
@@ -1001,25 +1797,6 @@ class Connection(object):
             def bool_recv(data, offset, length):
                 return data[offset] == 1
 
-        def time_in(data, offset, length):
-            hour = int(data[offset:offset + 2])
-            minute = int(data[offset + 3:offset + 5])
-            sec = Decimal(
-                data[offset + 6:offset + length].decode(self._client_encoding))
-            return datetime.time(
-                hour, minute, int(sec), int((sec - int(sec)) * 1000000))
-
-        def date_in(data, offset, length):
-            year_str = data[offset:offset + 4].decode(self._client_encoding)
-            if year_str == 'infi':
-                return datetime.date.max
-            elif year_str == '-inf':
-                return datetime.date.min
-            else:
-                return datetime.date(
-                    int(year_str), int(data[offset + 5:offset + 7]),
-                    int(data[offset + 8:offset + 10]))
-
         def numeric_in(data, offset, length):
             return Decimal(
                 data[offset: offset + length].decode(self._client_encoding))
@@ -1039,6 +1816,7 @@ class Connection(object):
                 25: (FC_BINARY, text_recv),  # TEXT type
                 26: (FC_TEXT, int_in),  # oid
                 28: (FC_TEXT, int_in),  # xid
+                30: (FC_TEXT, vector_in),  # oidvector
                 700: (FC_BINARY, float4_recv),  # float4
                 701: (FC_BINARY, float8_recv),  # float8
                 705: (FC_BINARY, text_recv),  # unknown
@@ -1055,8 +1833,8 @@ class Connection(object):
                 1022: (FC_BINARY, array_recv),  # FLOAT8[]
                 1042: (FC_BINARY, text_recv),  # CHAR type
                 1043: (FC_BINARY, text_recv),  # VARCHAR type
-                1082: (FC_TEXT, date_in),  # date
-                1083: (FC_TEXT, time_in),
+                1082: (FC_BINARY, date_recv),  # date
+                1083: (FC_BINARY, time_recv_integer),  # time
                 1114: (FC_BINARY, timestamp_recv_float),  # timestamp w/ tz
                 1184: (FC_BINARY, timestamptz_recv_float),
                 1186: (FC_BINARY, interval_recv_integer),
@@ -1067,14 +1845,19 @@ class Connection(object):
                 2950: (FC_BINARY, uuid_recv),  # uuid
             })
 
+        self._fixed_width_recvs = dict(FIXED_WIDTH_RECVS)
+        self._fixed_width_recvs[bool_recv] = '?'
+        self._fixed_width_sends = dict(FIXED_WIDTH_SENDS)
+        self._fixed_width_sends[bool_send] = '?'
+
         self.py_types = {
             type(None): (-1, FC_BINARY, null_send),  # null
             bool: (16, FC_BINARY, bool_send),
             int: (705, FC_TEXT, unknown_out),
             float: (701, FC_BINARY, d_pack),  # float8
             str: (705, FC_TEXT, text_out),  # unknown
-            datetime.date: (1082, FC_TEXT, date_out),  # date
-            datetime.time: (1083, FC_TEXT, time_out),  # time
+            datetime.date: (1082, FC_BINARY, date_send),  # date
+            datetime.time: (1083, FC_BINARY, time_send_integer),  # time
             1114: (1114, FC_BINARY, timestamp_send_integer),  # timestamp
             # timestamp w/ tz
             1184: (1184, FC_BINARY, timestamptz_send_integer),
@@ -1084,6 +1867,35 @@ class Connection(object):
             UUID: (2950, FC_BINARY, uuid_send),  # uuid
         }
 
+        # The binary send function of each type oid that binary COPY FROM
+        # can write.
+        self.binary_send_funcs = {
+            16: bool_send,  # boolean
+            17: bytea_send,  # bytea
+            19: text_out,  # name type
+            20: q_pack,  # int8
+            21: h_pack,  # int2
+            23: i_pack,  # int4
+            25: text_out,  # TEXT type
+            700: f_pack,  # float4
+            701: d_pack,  # float8
+            1042: text_out,  # CHAR type
+            1043: text_out,  # VARCHAR type
+            1082: date_send,  # date
+            1083: time_send_integer,  # time
+            1114: timestamp_send_integer,  # timestamp
+            1184: timestamptz_send_integer,  # timestamp w/ tz
+            1186: interval_send_integer,  # interval
+            1700: numeric_send,  # NUMERIC
+            2950: uuid_send,  # uuid
+        }
+
+        # The binary receive function of each type oid that pg8000 reads as
+        # text, but that binary COPY TO can read without a cast.
+        self.binary_recv_funcs = {
+            1700: numeric_recv,  # NUMERIC
+        }
+
         self.inspect_funcs = {
             datetime.datetime: self.inspect_datetime,
             list: self.array_inspect,
@@ -1144,6 +1956,12 @@ class Connection(object):
             COPY_IN_RESPONSE: self.handle_COPY_IN_RESPONSE,
             COPY_OUT_RESPONSE: self.handle_COPY_OUT_RESPONSE}
 
+        self._cursor = self.cursor()
+        self.in_transaction = False
+        self.notifies = []
+        self.notifies_lock = threading.Lock()
+
+    def startup_message(self, database):
         # Int32 - Message length, including self.
         # Int32(196608) - Protocol version number.  Version 3.0.
         # Any number of key/value pairs, terminated by a zero byte:
@@ -1151,30 +1969,12 @@ class Connection(object):
         #   String - Parameter value
         protocol = 196608
         val = bytearray(i_pack(protocol) + b("user\x00"))
-        val.extend(user.encode("ascii") + NULL_BYTE)
+        val.extend(self.user.encode("ascii") + NULL_BYTE)
         if database is not None:
             val.extend(
                 b("database\x00") + database.encode("ascii") + NULL_BYTE)
         val.append(0)
-        self._write(i_pack(len(val) + 4))
-        self._write(val)
-        self._flush()
-
-        self._cursor = self.cursor()
-        try:
-            try:
-                self._lock.acquire()
-                self.handle_messages(None)
-            finally:
-                self._lock.release()
-        except:
-            self.close()
-            raise exc_info()[1]
-
-        self._cursor = self.cursor()
-        self.in_transaction = False
-        self.notifies = []
-        self.notifies_lock = threading.Lock()
+        return i_pack(len(val) + 4) + val
 
     def handle_ERROR_RESPONSE(self, data, ps):
         msg_dict = data_into_dict(data)
@@ -1188,10 +1988,10 @@ class Connection(object):
     def handle_CLOSE_COMPLETE(self, data, ps):
         pass
 
-    def handle_PARSE_COMPLETE(self, data, ps):
+    def handle_PARSE_COMPLETE(self, data, cursor):
         # Byte1('1') - Identifier.
         # Int32(4) - Message length, including self.
-        pass
+        cursor.ps['parsed'] = True
 
     def handle_BIND_COMPLETE(self, data, ps):
         pass
@@ -1232,23 +2032,36 @@ class Connection(object):
         if ps.stream is None:
             raise CopyQueryWithoutStreamError()
 
-        if PY2:
-            while True:
-                data = ps.stream.read(8192)
-                if not data:
-                    break
-                self._write(COPY_DATA + i_pack(len(data) + 4))
-                self._write(data)
-                self._flush()
+        if isinstance(ps.stream, CopyRows):
+            messages = ps.stream.messages(COPY_CHUNK_SIZE)
         else:
-            bffr = bytearray(8192)
-            while True:
-                bytes_read = ps.stream.readinto(bffr)
-                if bytes_read == 0:
-                    break
-                self._write(COPY_DATA + i_pack(bytes_read + 4))
-                self._write(bffr[:bytes_read])
+            messages = copy_file_messages(ps.stream, COPY_CHUNK_SIZE)
+
+        # The CopyData messages are large enough to go straight to the
+        # socket, so they aren't flushed one at a time.  If the data can't
+        # be read or encoded, the COPY is abandoned with a CopyFail, and the
+        # server's error that follows is read as usual.
+        while True:
+            try:
+                message = next(messages)
+            except StopIteration:
+                break
+            except Exception:
+                e = exc_info()[1]
+                # Byte1('f') - Identifies the message as a COPY-failure
+                #   indicator.
+                # Int32 - Message length, including self.
+                # String - An error message to report as the cause of
+                #   failure.
+                self._send_message(
+                    COPY_FAIL, str(e).encode(self._client_encoding) +
+                    NULL_BYTE)
+                self._write(SYNC_MSG)
                 self._flush()
+                if isinstance(e, Error):
+                    raise e
+                raise DataError("COPY FROM aborted: " + str(e), e)
+            self._write(message)
 
         # Send CopyDone
         # Byte1('c') - Identifier.
@@ -1283,11 +2096,14 @@ class Connection(object):
 
     ##
     # Creates a {@link #CursorWrapper CursorWrapper} object bound to this
-    # connection.
+    # connection.  If a name is given, queries are run as a server-side cursor
+    # of that name, and the rows are fetched fetch_size at a time as the
+    # cursor is iterated over, so a large result set needn't fit in memory.
     # <p>
-    # Stability: Part of the DBAPI 2.0 specification.
-    def cursor(self):
-        return Cursor(self)
+    # Stability: Part of the DBAPI 2.0 specification.  The name parameter is a
+    # pg8000 extension.
+    def cursor(self, name=None):
+        return Cursor(self, name)
 
     ##
     # Commits the current database transaction.
@@ -1387,6 +2203,9 @@ class Connection(object):
     def handle_READY_FOR_QUERY(self, data, ps):
         # Byte1 -   Status indicator.
         self.in_transaction = data != IDLE
+        if not self.in_transaction:
+            # Portals only last as long as their transaction
+            del self._portals_to_close[:]
 
     def handle_BACKEND_KEY_DATA(self, data, ps):
         self._backend_key_data = data
@@ -1432,112 +2251,402 @@ class Connection(object):
                 raise NotSupportedError(
                     "type oid " + exc_info()[1] + " not supported")
 
+        if 'pipelined' in cursor.ps:
+            # A statement we thought returned no rows does after all (an
+            # INSERT rewritten by a rule, say).  Its rows were asked for in
+            # text format, so columns normally read as binary come back as
+            # their text representation.
+            text_recv = self.pg_types[25][1]
+            cursor.ps['input_funcs'] = tuple(
+                f['func'] if f['pg8000_fc'] == FC_TEXT else text_recv
+                for f in cursor.ps['row_desc'])
+            cursor.ps['row_decoder'] = make_row_decoder(
+                cursor.ps['input_funcs'], self._fixed_width_recvs)
+
     def execute(self, cursor, operation, vals):
-        if vals is None:
-            vals = ()
-        paramstyle = pg8000.paramstyle
-        cache = self._caches[paramstyle]
+        self.send_closes()
+        statement, args, params, key = self.convert_operation(
+            operation, vals)
+        ps = self.get_ps(cursor, statement, params, key, pipeline=True)
+        self.send_bind(cursor, ps, args)
+        try:
+            self._flush()
+        except AttributeError:
+            if self._sock is None:
+                raise InterfaceError("Connection closed")
+            else:
+                raise exc_info()[1]
+        self.read_execute(cursor, ps, key)
 
+    # Sends the Bind, Execute and Sync for a statement, on a new portal.
+    def send_bind(self, cursor, ps, args):
+        cursor._cached_rows.clear()
+        cursor._row_count = -1
+        cursor.portal_name = "pg8000_portal_" + str(self.portal_number)
+        self.portal_number += 1
+        cursor.portal_name_bin = cursor.portal_name.encode('ascii') + NULL_BYTE
+        if cursor._server_cursor_open or (
+                self.autocommit and not self.in_transaction):
+            # Either this is a FETCH, which limits the rows itself, or the
+            # portal won't outlive the implicit transaction.
+            cursor.execute_msg = cursor.portal_name_bin + i_pack(0)
+        else:
+            cursor.execute_msg = cursor.portal_name_bin + \
+                cursor._fetch_size_bin
+
+        self._send_message(
+            BIND, self.make_bind(cursor.portal_name_bin, ps, args))
+        self.send_EXECUTE(cursor)
+        self._write(SYNC_MSG)
+
+    # Handles the replies to send_bind(), once they've been flushed.
+    def read_execute(self, cursor, ps, key):
+        if 'pipelined' in ps:
+            try:
+                self.handle_messages(cursor)
+            finally:
+                # Even if the Bind or Execute failed, a statement that parsed
+                # has been described and can be reused.
+                if ps.get('parsed'):
+                    self.finish_ps(ps)
+                    self.cache_ps(key, ps)
+        else:
+            self.handle_messages(cursor)
+        if not cursor.portal_suspended:
+            self.close_portal(cursor)
+
+    # Sends a Bind/Execute pair per parameter set without waiting for the
+    # replies, and only syncs once per batch (or when the parameter types
+    # change, and so the prepared statement changes).  This turns one round
+    # trip per row into one per batch.  The unnamed portal is used, so
+    # nothing needs closing afterwards.  If a row fails, the exception's
+    # param_set_index attribute gives the position of the offending row.  In
+    # autocommit mode a single batch is committed by its Sync, and more than
+    # one are wrapped in a transaction, so that either every row goes in or
+    # none do.
+    def executemany(self, cursor, operation, param_sets):
+        self.send_closes()
+        cursor._cached_rows.clear()
+        cursor._row_count = -1
+        cursor.portal_suspended = False
+        ps = None
+        batch = bytearray()
+        batch_start = 0
+        batch_len = 0
+        implicit_transaction = False
         try:
-            statement, make_args = cache['statement'][operation]
-        except KeyError:
-            statement, make_args = convert_paramstyle(paramstyle, operation)
-            cache['statement'][operation] = statement, make_args
+            for vals in param_sets:
+                statement, args, params, key = self.convert_operation(
+                    operation, vals)
+                if batch_len > 0 and (
+                        self.statement_cache.peek(key) is not ps or
+                        batch_len >= self._executemany_batch_size):
+                    if self.autocommit and not self.in_transaction:
+                        self.execute(self._cursor, "begin transaction", None)
+                        implicit_transaction = True
+                    self.sync_batch(cursor, batch, batch_start)
+                    batch = bytearray()
+                    batch_start += batch_len
+                    batch_len = 0
+                ps = self.get_ps(cursor, statement, params, key)
+                self.add_to_batch(batch, ps, args)
+                batch_len += 1
+
+            if batch_len > 0:
+                self.sync_batch(cursor, batch, batch_start)
+        except Exception:
+            e = exc_info()[1]
+            if implicit_transaction:
+                self.execute(self._cursor, "rollback", None)
+            raise e
+        if implicit_transaction:
+            self.execute(self._cursor, "commit", None)
 
+    # The Bind/Execute pairs of a batch are kept out of the socket's write
+    # buffer until sync_batch(), so that if a later parameter set can't be
+    # converted, the rows before it are dropped rather than going out with
+    # whatever is sent next.
+    def add_to_batch(self, batch, ps, args):
+        bind = self.make_bind(NULL_BYTE, ps, args)
+        batch.extend(BIND)
+        batch.extend(i_pack(len(bind) + 4))
+        batch.extend(bind)
+        batch.extend(EXECUTE)
+        batch.extend(i_pack(len(UNNAMED_EXECUTE_MSG) + 4))
+        batch.extend(UNNAMED_EXECUTE_MSG)
+
+    def sync_batch(self, cursor, batch, batch_start):
+        cursor._commands_completed = 0
+        batch.extend(SYNC_MSG)
+        self._write(batch)
+        self._flush()
+        self.read_batch(cursor, batch_start)
+
+    def read_batch(self, cursor, batch_start):
+        try:
+            self.handle_messages(cursor)
+        except pg8000.errors.Error:
+            e = exc_info()[1]
+            # Every parameter set before the failing one got a CommandComplete
+            e.param_set_index = batch_start + cursor._commands_completed
+            raise e
+
+    def convert_operation(self, operation, vals):
+        if vals is None:
+            vals = ()
+        paramstyle = pg8000.paramstyle
+        statement, make_args = convert_paramstyle_cached(
+            paramstyle, operation)
         args = make_args(vals)
         params = self.make_params(args)
 
-        key = tuple(oid for oid, x, y in params), operation
+        key = paramstyle, tuple(oid for oid, x, y in params), operation
+        return statement, args, params, key
 
+    # If pipeline is set and the statement can't return rows, the Parse and
+    # Describe aren't synced here, and the caller's Bind and Execute go out in
+    # the same batch.  The ps is then left for the caller to finish_ps() and
+    # cache once the replies are in.
+    def get_ps(self, cursor, statement, params, key, pipeline=False):
         try:
-            ps = cache['ps'][key]
+            ps = self.statement_cache.get(key)
             cursor.ps = ps
+            return ps
         except KeyError:
-            statement_name = "pg8000_statement_" + str(self.statement_number)
-            self.statement_number += 1
-            statement_name_bin = statement_name.encode('ascii') + NULL_BYTE
-            ps = {
-                'row_desc': [],
-                'param_funcs': tuple(x[2] for x in params),
-            }
-            cursor.ps = ps
+            pass
 
-            param_fcs = tuple(x[1] for x in params)
-
-            # Byte1('P') - Identifies the message as a Parse command.
-            # Int32 -   Message length, including self.
-            # String -  Prepared statement name. An empty string selects the
-            #           unnamed prepared statement.
-            # String -  The query string.
-            # Int16 -   Number of parameter data types specified (can be zero).
-            # For each parameter:
-            #   Int32 - The OID of the parameter data type.
-            val = bytearray(statement_name_bin)
-            val.extend(statement.encode(self._client_encoding) + NULL_BYTE)
-            val.extend(h_pack(len(params)))
-            for oid, fc, send_func in params:
-                # Parse message doesn't seem to handle the -1 type_oid for NULL
-                # values that other messages handle.  So we'll provide type_oid
-                # 705, the PG "unknown" type.
-                val.extend(i_pack(705 if oid == -1 else oid))
-
-            # Byte1('D') - Identifies the message as a describe command.
-            # Int32 - Message length, including self.
-            # Byte1 - 'S' for prepared statement, 'P' for portal.
-            # String - The name of the item to describe.
-            self._send_message(PARSE, val)
-            self._send_message(DESCRIBE, STATEMENT + statement_name_bin)
-            self._write(SYNC_MSG)
+        ps = self.send_parse(cursor, statement, params, pipeline)
+        if 'pipelined' in ps:
+            return ps
 
-            try:
-                self._flush()
-            except AttributeError:
-                if self._sock is None:
-                    raise InterfaceError("Connection closed")
-                else:
-                    raise exc_info()[1]
+        self._write(SYNC_MSG)
+        try:
+            self._flush()
+        except AttributeError:
+            if self._sock is None:
+                raise InterfaceError("Connection closed")
+            else:
+                raise exc_info()[1]
 
-            self.handle_messages(cursor)
+        self.handle_messages(cursor)
+        self.finish_ps(ps)
+        self.cache_ps(key, ps)
+        return ps
+
+    # Sends the Parse and Describe for a new prepared statement, returning
+    # its ps.  The caller syncs and reads the replies, unless the ps comes
+    # back pipelined.
+    def send_parse(self, cursor, statement, params, pipeline):
+        statement_name = "pg8000_statement_" + str(self.statement_number)
+        self.statement_number += 1
+        statement_name_bin = statement_name.encode('ascii') + NULL_BYTE
+        ps = {
+            'statement_name_bin': statement_name_bin,
+            'row_desc': [],
+            'param_funcs': tuple(x[2] for x in params),
+        }
+        cursor.ps = ps
+
+        param_fcs = tuple(x[1] for x in params)
 
-            # We've got row_desc that allows us to identify what we're
-            # going to get back from this statement.
-            output_fc = tuple(
-                self.pg_types[f['type_oid']][0] for f in ps['row_desc'])
-
-            ps['input_funcs'] = tuple(f['func'] for f in ps['row_desc'])
-            # Byte1('B') - Identifies the Bind command.
-            # Int32 - Message length, including self.
-            # String - Name of the destination portal.
-            # String - Name of the source prepared statement.
-            # Int16 - Number of parameter format codes.
-            # For each parameter format code:
-            #   Int16 - The parameter format code.
-            # Int16 - Number of parameter values.
-            # For each parameter value:
-            #   Int32 - The length of the parameter value, in bytes, not
-            #           including this length.  -1 indicates a NULL parameter
-            #           value, in which no value bytes follow.
-            #   Byte[n] - Value of the parameter.
-            # Int16 - The number of result-column format codes.
-            # For each result-column format code:
-            #   Int16 - The format code.
-            ps['bind_1'] = statement_name_bin + h_pack(len(params)) + \
-                pack("!" + "h" * len(param_fcs), *param_fcs) + \
-                h_pack(len(params))
-
-            ps['bind_2'] = h_pack(len(output_fc)) + \
-                pack("!" + "h" * len(output_fc), *output_fc)
-
-            cache['ps'][key] = ps
+        # Byte1('P') - Identifies the message as a Parse command.
+        # Int32 -   Message length, including self.
+        # String -  Prepared statement name. An empty string selects the
+        #           unnamed prepared statement.
+        # String -  The query string.
+        # Int16 -   Number of parameter data types specified (can be zero).
+        # For each parameter:
+        #   Int32 - The OID of the parameter data type.
+        val = bytearray(statement_name_bin)
+        val.extend(statement.encode(self._client_encoding) + NULL_BYTE)
+        val.extend(h_pack(len(params)))
+        for oid, fc, send_func in params:
+            # Parse message doesn't seem to handle the -1 type_oid for NULL
+            # values that other messages handle.  So we'll provide type_oid
+            # 705, the PG "unknown" type.
+            val.extend(i_pack(705 if oid == -1 else oid))
+
+        # Byte1('D') - Identifies the message as a describe command.
+        # Int32 - Message length, including self.
+        # Byte1 - 'S' for prepared statement, 'P' for portal.
+        # String - The name of the item to describe.
+        self._send_message(PARSE, val)
+        self._send_message(DESCRIBE, STATEMENT + statement_name_bin)
+
+        # Byte1('B') - Identifies the Bind command.
+        # Int32 - Message length, including self.
+        # String - Name of the destination portal.
+        # String - Name of the source prepared statement.
+        # Int16 - Number of parameter format codes.
+        # For each parameter format code:
+        #   Int16 - The parameter format code.
+        # Int16 - Number of parameter values.
+        # For each parameter value:
+        #   Int32 - The length of the parameter value, in bytes, not
+        #           including this length.  -1 indicates a NULL parameter
+        #           value, in which no value bytes follow.
+        #   Byte[n] - Value of the parameter.
+        # Int16 - The number of result-column format codes.
+        # For each result-column format code:
+        #   Int16 - The format code.
+        ps['bind_1'] = statement_name_bin + h_pack(len(params)) + \
+            pack("!" + "h" * len(param_fcs), *param_fcs) + \
+            h_pack(len(params))
+
+        if pipeline and returns_no_rows(statement):
+            # With no result columns there are no result formats to choose,
+            # so the Bind doesn't have to wait for the row description.
+            ps['pipelined'] = True
+            ps['bind_2'] = h_pack(0)
+        return ps
+
+    # The row encoder for a binary COPY FROM into the columns of the given
+    # query.  The query is only described, not run, and the encoder is kept
+    # with the prepared statement.
+    def get_row_encoder(self, cursor, query):
+        ps = self.get_ps(cursor, query, (), ("copy", (), query))
+        try:
+            return ps['row_encoder']
+        except KeyError:
+            pass
 
+        send_funcs = []
+        for field in ps['row_desc']:
+            try:
+                send_funcs.append(self.binary_send_funcs[field['type_oid']])
+            except KeyError:
+                raise NotSupportedError(
+                    "type oid " + str(field['type_oid']) +
+                    " not supported by binary COPY")
+        ps['row_encoder'] = make_row_encoder(
+            send_funcs, self._fixed_width_sends)
+        return ps['row_encoder']
+
+    # The binary COPY TO statement for the rows of the given query, and the
+    # decoder for its tuples.  Binary COPY can't choose a format for each
+    # column, so columns that pg8000 reads as text are read with their binary
+    # receive function if there is one, and otherwise cast to text, which is
+    # sent as is.  Target is what to COPY if there's no need for casts.
+    def get_copy_out(self, cursor, query, target):
+        ps = self.get_ps(cursor, query, (), ("copy", (), query))
+        casts = [
+            f['pg8000_fc'] == FC_TEXT and
+            f['type_oid'] not in self.binary_recv_funcs
+            for f in ps['row_desc']]
+        try:
+            decode = ps['copy_decoder']
+        except KeyError:
+            decode = ps['copy_decoder'] = make_row_decoder(
+                (
+                    f['func'] if f['pg8000_fc'] == FC_BINARY else
+                    self.binary_recv_funcs.get(f['type_oid'], f['func'])
+                    for f in ps['row_desc']),
+                self._fixed_width_recvs, copy=True)
+
+        if any(casts):
+            exprs = []
+            for f, cast in zip(ps['row_desc'], casts):
+                expr = '"' + f['name'].decode(self._client_encoding).replace(
+                    '"', '""') + '"'
+                if cast:
+                    expr += "::text"
+                exprs.append(expr)
+            target = "(SELECT " + ", ".join(exprs) + " FROM (" + query + \
+                ") AS pg8000_copy)"
+        return "COPY " + target + " TO STDOUT WITH BINARY", decode
+
+    # Runs a binary COPY TO, yielding each row as it's decoded from the read
+    # buffer.  The server sends a row per CopyData message (with the header
+    # in front of the first), but any number of whole rows to a message are
+    # read.  If the rows aren't all read, the rest of the messages are read
+    # and thrown away so that the connection stays in step.
+    def copy_out(self, cursor, statement, decode):
+        self.send_closes()
         cursor._cached_rows.clear()
         cursor._row_count = -1
-        cursor.portal_name = "pg8000_portal_" + str(self.portal_number)
-        self.portal_number += 1
-        cursor.portal_name_bin = cursor.portal_name.encode('ascii') + NULL_BYTE
-        cursor.execute_msg = cursor.portal_name_bin + \
-            Connection._row_cache_size_bin
+        cursor.portal_suspended = False
 
+        self._send_message(
+            PARSE, NULL_BYTE + statement.encode(self._client_encoding) +
+            NULL_BYTE + h_pack(0))
+        self._send_message(BIND, NULL_BYTE + NULL_BYTE + h_pack(0) * 3)
+        self._send_message(EXECUTE, UNNAMED_EXECUTE_MSG)
+        self._write(SYNC_MSG)
+        self._flush()
+
+        message_code = None
+        error = None
+        header_read = False
+        read_message = self.read_message
+        try:
+            while message_code != READY_FOR_QUERY:
+                message_code, start, end = read_message()
+                if message_code == COPY_DATA and error is None:
+                    buf = self._buffer
+                    idx = start
+                    if not header_read:
+                        if buf[idx:idx + 11] != BINARY_COPY_SIGNATURE:
+                            raise InternalError(
+                                "Binary COPY data has an unknown signature")
+                        idx += 19 + i_unpack(buf, idx + 15)[0]
+                        header_read = True
+                    while idx < end:
+                        if h_unpack(buf, idx)[0] == -1:
+                            idx += 2
+                            break
+                        row, idx = decode(buf, idx, end)
+                        yield row
+                    if idx != end:
+                        raise InternalError(
+                            "Binary COPY data isn't split by row")
+                elif message_code != COPY_OUT_RESPONSE:
+                    try:
+                        self.message_types[message_code](
+                            self._view[start:end].tobytes(), cursor)
+                    except KeyError:
+                        raise InternalError(
+                            "Unrecognised message code " + message_code)
+                    except pg8000.errors.Error:
+                        if error is None:
+                            error = exc_info()[1]
+        finally:
+            while message_code != READY_FOR_QUERY and \
+                    self._sock is not None:
+                try:
+                    message_code = read_message()[0]
+                except InterfaceError:
+                    break
+
+        if error is not None:
+            raise error
+
+    # Drops the prepared statement for an operation without parameters from
+    # the cache, closing it on the server.
+    def forget_ps(self, operation):
+        key = self.convert_operation(operation, None)[3]
+        ps = self.statement_cache.pop(key)
+        if ps is not None:
+            self._statements_to_close.append(ps['statement_name_bin'])
+
+    def cache_ps(self, key, ps):
+        self._statements_to_close.extend(
+            evicted['statement_name_bin']
+            for evicted in self.statement_cache.put(key, ps))
+
+    def finish_ps(self, ps):
+        # We've got row_desc that allows us to identify what we're
+        # going to get back from this statement.
+        output_fc = tuple(
+            self.pg_types[f['type_oid']][0] for f in ps['row_desc'])
+
+        ps['input_funcs'] = tuple(f['func'] for f in ps['row_desc'])
+        ps['row_decoder'] = make_row_decoder(
+            ps['input_funcs'], self._fixed_width_recvs)
+        ps['bind_2'] = h_pack(len(output_fc)) + \
+            pack("!" + "h" * len(output_fc), *output_fc)
+        ps.pop('pipelined', None)
+
+    def make_bind(self, portal_name_bin, ps, args):
         # Byte1('B') - Identifies the Bind command.
         # Int32 - Message length, including self.
         # String - Name of the destination portal.
@@ -1554,7 +2663,7 @@ class Connection(object):
         # Int16 - The number of result-column format codes.
         # For each result-column format code:
         #   Int16 - The format code.
-        retval = bytearray(cursor.portal_name_bin + ps['bind_1'])
+        retval = bytearray(portal_name_bin + ps['bind_1'])
         for value, send_func in zip(args, ps['param_funcs']):
             if value is None:
                 val = NULL
@@ -1563,21 +2672,18 @@ class Connection(object):
                 retval.extend(i_pack(len(val)))
             retval.extend(val)
         retval.extend(ps['bind_2'])
+        return retval
 
-        self._send_message(BIND, retval)
-        self.send_EXECUTE(cursor)
-        self._write(SYNC_MSG)
-        self._flush()
-        self.handle_messages(cursor)
-        if not cursor.portal_suspended:
-            self.close_portal(cursor)
-
+    # Messages only go into the socket file's write buffer here.  Everything
+    # making up one operation is sent with a single _flush(), and as every
+    # operation ends in a Sync there's no need for the server to be sent a
+    # Flush message as well.  FLUSH_MSG is only for waiting on a reply without
+    # a Sync.
     def _send_message(self, code, data):
         try:
             self._write(code)
             self._write(i_pack(len(data) + 4))
             self._write(data)
-            self._write(FLUSH_MSG)
         except ValueError:
             if str(exc_info()[1]) == "write to closed file":
                 raise pg8000.InterfaceError("Connection is closed.")
@@ -1600,6 +2706,7 @@ class Connection(object):
         pass
 
     def handle_COMMAND_COMPLETE(self, data, cursor):
+        cursor._commands_completed += 1
         values = data[:-1].split(BINARY_SPACE)
         command = values[0]
         if command in self._commands_with_count:
@@ -1609,31 +2716,78 @@ class Connection(object):
             else:
                 cursor._row_count += row_count
         if command in DDL_COMMANDS:
-            for k in self._caches:
-                self._caches[k]['ps'].clear()
+            self._statements_to_close.extend(
+                ps['statement_name_bin']
+                for ps in self.statement_cache.clear())
 
     def handle_DATA_ROW(self, data, cursor):
-        data_idx = 2
-        row = []
-        for func in cursor.ps['input_funcs']:
-            vlen = i_unpack(data, data_idx)[0]
-            data_idx += 4
-            if vlen == -1:
-                row.append(None)
+        cursor._cached_rows.append(
+            cursor.ps['row_decoder'](data, 0, len(data)))
+
+    # Reads from the socket until at least size bytes from _buf_start are in
+    # the buffer.  What's left of the buffer is filled with as much as the
+    # server has sent, so that a result set comes in a few large reads rather
+    # than two per message.
+    def _fill(self, size):
+        start = self._buf_start
+        have = self._buf_end - start
+        if start + size > len(self._buffer):
+            if size > READ_BUFFER_SIZE:
+                buf = bytearray(size)
+            elif len(self._buffer) > READ_BUFFER_SIZE:
+                buf = bytearray(READ_BUFFER_SIZE)
             else:
-                row.append(func(data, data_idx, vlen))
-                data_idx += vlen
-        cursor._cached_rows.append(row)
+                buf = self._buffer
+            buf[:have] = self._view[start:self._buf_end].tobytes()
+            if buf is not self._buffer:
+                self._buffer = buf
+                self._view = memoryview(buf)
+            self._buf_start = 0
+            self._buf_end = have
+
+        recv_into = self._usock.recv_into
+        view = self._view
+        while self._buf_end - self._buf_start < size:
+            try:
+                received = recv_into(view[self._buf_end:])
+            except socket.error:
+                raise InterfaceError("network error on read", exc_info()[1])
+            if received == 0:
+                raise InterfaceError("network error on read")
+            self._buf_end += received
+
+    # Reads the next message into the buffer, returning its code and the
+    # offsets of the start and end of its body.
+    def read_message(self):
+        if self._buf_end - self._buf_start < 5:
+            self._fill(5)
+        message_code, data_len = ci_unpack(self._buffer, self._buf_start)
+        if self._buf_end - self._buf_start < data_len + 1:
+            self._fill(data_len + 1)
+        start = self._buf_start + 5
+        self._buf_start = start + data_len - 4
+        return message_code, start, self._buf_start
 
     def handle_messages(self, cursor):
         message_code = None
         error = None
+        read_message = self.read_message
 
         while message_code != READY_FOR_QUERY:
-            message_code, data_len = ci_unpack(self._read(5))
+            message_code, start, end = read_message()
             try:
-                self.message_types[message_code](
-                    self._read(data_len - 4), cursor)
+                # DataRows are decoded straight from the buffer, the rest
+                # are handed a copy of their body.
+                if message_code == DATA_ROW:
+                    if cursor._columns is None:
+                        cursor._cached_rows.append(cursor.ps['row_decoder'](
+                            self._buffer, start, end))
+                    else:
+                        cursor.ps['column_decoder'][2](
+                            self._buffer, start, end, cursor._columns)
+                else:
+                    self.message_types[message_code](
+                        self._view[start:end].tobytes(), cursor)
             except KeyError:
                 raise InternalError(
                     "Unrecognised message code " + message_code)
@@ -1641,7 +2795,8 @@ class Connection(object):
                 e = exc_info()[1]
                 if cursor is None:
                     raise e
-                else:
+                elif error is None:
+                    # Anything after the first error is a consequence of it
                     error = e
 
         if error is not None:
@@ -1651,11 +2806,31 @@ class Connection(object):
     # Int32 - Message length, including self.
     # Byte1 - 'S' for prepared statement, 'P' for portal.
     # String - The name of the item to close.
+    #
+    # Rather than a round trip of its own, the Close goes out with the next
+    # batch of messages.  If the transaction ends first, the server drops the
+    # portal itself, so there's nothing left to close.
     def close_portal(self, cursor):
-        self._send_message(CLOSE, PORTAL + cursor.portal_name_bin)
-        self._write(SYNC_MSG)
-        self._flush()
-        self.handle_messages(cursor)
+        self._portals_to_close.append(cursor.portal_name_bin)
+
+    # A declared cursor is a portal too, but one declared WITH HOLD outlives
+    # its transaction, so these aren't forgotten when the transaction ends.
+    def close_cursor(self, name_bin):
+        self._cursors_to_close.append(name_bin)
+
+    # Closing a statement also closes any portals made from it, so statements
+    # are only closed outside a transaction, when there can't be any.
+    def send_closes(self):
+        for portal_name_bin in self._portals_to_close:
+            self._send_message(CLOSE, PORTAL + portal_name_bin)
+        del self._portals_to_close[:]
+        for name_bin in self._cursors_to_close:
+            self._send_message(CLOSE, PORTAL + name_bin)
+        del self._cursors_to_close[:]
+        if not self.in_transaction:
+            for statement_name_bin in self._statements_to_close:
+                self._send_message(CLOSE, STATEMENT + statement_name_bin)
+            del self._statements_to_close[:]
 
     def handle_NOTICE_RESPONSE(self, data, ps):
         resp = data_into_dict(data)
@@ -1683,6 +2858,15 @@ class Connection(object):
                 self.py_types[datetime.timedelta] = (
                     1186, FC_BINARY, interval_send_integer)
                 self.pg_types[1186] = (FC_BINARY, interval_recv_integer)
+
+                self.py_types[datetime.time] = (
+                    1083, FC_BINARY, time_send_integer)
+                self.pg_types[1083] = (FC_BINARY, time_recv_integer)
+
+                self.binary_send_funcs[1083] = time_send_integer
+                self.binary_send_funcs[1114] = timestamp_send_integer
+                self.binary_send_funcs[1184] = timestamptz_send_integer
+                self.binary_send_funcs[1186] = interval_send_integer
             else:
                 self.py_types[1114] = (1114, FC_BINARY, timestamp_send_float)
                 self.pg_types[1114] = (FC_BINARY, timestamp_recv_float)
@@ -1695,6 +2879,15 @@ class Connection(object):
                     1186, FC_BINARY, interval_send_float)
                 self.pg_types[1186] = (FC_BINARY, interval_recv_float)
 
+                self.py_types[datetime.time] = (
+                    1083, FC_BINARY, time_send_float)
+                self.pg_types[1083] = (FC_BINARY, time_recv_float)
+
+                self.binary_send_funcs[1083] = time_send_float
+                self.binary_send_funcs[1114] = timestamp_send_float
+                self.binary_send_funcs[1184] = timestamptz_send_float
+                self.binary_send_funcs[1186] = interval_send_float
+
         elif key == b("server_version"):
             self._server_version = tuple(
                 map(int, value.decode("ascii").split('.')[:2]))
@@ -0,0 +1,203 @@
+import unittest
+import asyncio
+import time
+from array import array
+import pg8000
+import pg8000.aio
+from pg8000.errors import CopyQueryWithoutStreamError
+from .connection_settings import db_connect
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+# The tests for pg8000.aio.  They're imported by test_aio on Pythons that
+# can parse them.
+class Tests(unittest.TestCase):
+    async def connect(self):
+        return await pg8000.aio.connect(**db_connect)
+
+    def testQuery(self):
+        async def query():
+            db = await self.connect()
+            try:
+                cursor = db.cursor()
+                await cursor.execute(
+                    "SELECT %s::int, %s, now()::date", (7, "seven"))
+                self.assertEqual(
+                    [d[0] for d in cursor.description],
+                    [b"int4", b"?column?", b"now"])
+                row = await cursor.fetchone()
+                self.assertEqual(row[:2], [7, "seven"])
+                self.assertEqual(await cursor.fetchone(), None)
+                await db.rollback()
+            finally:
+                await db.close()
+        run(query())
+
+    def testFetchSize(self):
+        async def fetch():
+            db = await self.connect()
+            try:
+                cursor = db.cursor()
+                cursor.fetch_size = 100
+                query = "SELECT x, repeat('x', 200) FROM " \
+                    "generate_series(1, %s) AS x"
+                await cursor.execute(query, (2500,))
+                rows = [row async for row in cursor]
+                self.assertEqual([r[0] for r in rows], list(range(1, 2501)))
+
+                await cursor.execute(query, (250,))
+                self.assertEqual(len(await cursor.fetchmany(150)), 150)
+                self.assertEqual(len(await cursor.fetchall()), 100)
+                self.assertEqual(await cursor.fetchall(), ())
+                await db.commit()
+            finally:
+                await db.close()
+        run(fetch())
+
+    def testFetchColumns(self):
+        async def fetch():
+            db = await self.connect()
+            try:
+                cursor = db.cursor()
+                cursor.fetch_size = 100
+                await cursor.execute(
+                    "SELECT x, x::text FROM generate_series(1, 250) AS x")
+                ints, texts = await cursor.fetchcolumns()
+                self.assertEqual(ints, array('i', range(1, 251)))
+                self.assertEqual(texts[-1], '250')
+                await db.rollback()
+            finally:
+                await db.close()
+        run(fetch())
+
+    def testExecuteMany(self):
+        async def executemany():
+            db = await self.connect()
+            try:
+                cursor = db.cursor()
+                await cursor.execute(
+                    "CREATE TEMPORARY TABLE t1 (f1 int primary key, f2 text)")
+                await cursor.executemany(
+                    "INSERT INTO t1 VALUES (%s, %s)",
+                    ((i, str(i)) for i in range(3000)))
+                await cursor.execute("SELECT count(*), max(f2) FROM t1")
+                self.assertEqual(await cursor.fetchone(), [3000, "999"])
+
+                with self.assertRaises(pg8000.ProgrammingError) as cm:
+                    await cursor.executemany(
+                        "INSERT INTO t1 VALUES (%s, %s)",
+                        ((5000, "a"), (5001, "b"), (5, "c")))
+                self.assertEqual(cm.exception.param_set_index, 2)
+                await db.rollback()
+
+                # The connection is still in step with the server
+                await cursor.execute("SELECT 1")
+                self.assertEqual(await cursor.fetchall(), ([1],))
+                await db.rollback()
+            finally:
+                await db.close()
+        run(executemany())
+
+    def testExecuteManyAutocommitAllOrNothing(self):
+        async def executemany():
+            db = await self.connect()
+            try:
+                db.autocommit = True
+                cursor = db.cursor()
+                await cursor.execute(
+                    "CREATE TEMPORARY TABLE t1 (f1 int primary key, f2 text)")
+                params = [(i, None) for i in range(2500)]
+                params[2200] = (5, None)
+                with self.assertRaises(pg8000.ProgrammingError) as cm:
+                    await cursor.executemany(
+                        "INSERT INTO t1 VALUES (%s, %s)", params)
+                self.assertEqual(cm.exception.param_set_index, 2200)
+                await cursor.execute("SELECT count(*) FROM t1")
+                self.assertEqual(await cursor.fetchone(), [0])
+
+                params[2200] = (2200, None)
+                await cursor.executemany(
+                    "INSERT INTO t1 VALUES (%s, %s)", params)
+                self.assertEqual(cursor.rowcount, 2500)
+                self.assertFalse(db.in_transaction)
+            finally:
+                await db.close()
+        run(executemany())
+
+    def testExecuteManyUnconvertibleRow(self):
+        async def executemany():
+            db = await self.connect()
+            try:
+                cursor = db.cursor()
+                await cursor.execute(
+                    "CREATE TEMPORARY TABLE t1 (f1 int primary key, f2 text)")
+                params = [(i, None) for i in range(5)]
+                params[3] = (3, object())
+                with self.assertRaises(pg8000.NotSupportedError):
+                    await cursor.executemany(
+                        "INSERT INTO t1 VALUES (%s, %s)", params)
+
+                # The rows before the bad one mustn't go out with the next
+                # query
+                await cursor.execute(
+                    "INSERT INTO t1 VALUES (%s, %s)", (10, None))
+                self.assertEqual(cursor.rowcount, 1)
+                await cursor.execute("SELECT f1 FROM t1")
+                self.assertEqual(await cursor.fetchall(), ([10],))
+                await db.rollback()
+            finally:
+                await db.close()
+        run(executemany())
+
+    def testCopyNotSupported(self):
+        async def copy():
+            db = await self.connect()
+            try:
+                cursor = db.cursor()
+                await cursor.execute("CREATE TEMPORARY TABLE t1 (f1 int)")
+                with self.assertRaises(CopyQueryWithoutStreamError):
+                    await cursor.execute("COPY t1 FROM STDIN")
+                await db.rollback()
+                await cursor.execute("SELECT 1")
+                self.assertEqual(await cursor.fetchone(), [1])
+                await db.rollback()
+            finally:
+                await db.close()
+        run(copy())
+
+    # A task's query doesn't hold up the others on the same event loop
+    def testConcurrent(self):
+        async def sleep(n):
+            db = await self.connect()
+            try:
+                db.autocommit = True
+                cursor = db.cursor()
+                await cursor.execute("SELECT %s::int, pg_sleep(0.3)", (n,))
+                return (await cursor.fetchone())[0]
+            finally:
+                await db.close()
+
+        async def sleeps():
+            return await asyncio.gather(*(sleep(n) for n in range(5)))
+
+        start = time.time()
+        self.assertEqual(run(sleeps()), [0, 1, 2, 3, 4])
+        self.assertTrue(time.time() - start < 1.2)
+
+    def testClosed(self):
+        async def closed():
+            db = await self.connect()
+            cursor = db.cursor()
+            await db.close()
+            with self.assertRaises(pg8000.InterfaceError):
+                await cursor.execute("SELECT 1")
+            with self.assertRaises(pg8000.InterfaceError):
+                await db.close()
+        run(closed())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import pg8000
+from timeit import repeat
+
+
+# Times converting a typical INSERT in each paramstyle, both from scratch and
+# through the cache shared by all connections.  Doesn't need a database.  The
+# best of five runs is taken, to keep out noise from other processes.
+
+queries = (
+    ("qmark", "INSERT INTO player_activity (\"Time_Stamp\", "
+        "\"Player_Count\", \"Player_Names\", \"Server_Name\") "
+        "VALUES (?, ?, ?, ?) -- 'note'"),
+    ("numeric", "INSERT INTO player_activity (\"Time_Stamp\", "
+        "\"Player_Count\", \"Player_Names\", \"Server_Name\") "
+        "VALUES (:1, :2, :3, :4) -- 'note'"),
+    ("named", "INSERT INTO player_activity (\"Time_Stamp\", "
+        "\"Player_Count\", \"Player_Names\", \"Server_Name\") "
+        "VALUES (:ts, :count, :names, :server) -- 'note'"),
+    ("format", "INSERT INTO player_activity (\"Time_Stamp\", "
+        "\"Player_Count\", \"Player_Names\", \"Server_Name\") "
+        "VALUES (%s, %s, %s, %s) -- '100%%'"),
+    ("pyformat", "INSERT INTO player_activity (\"Time_Stamp\", "
+        "\"Player_Count\", \"Player_Names\", \"Server_Name\") "
+        "VALUES (%(ts)s, %(count)s, %(names)s, %(server)s) -- '100%%'"),
+)
+
+iterations = 20000
+for style, query in queries:
+    convert = min(repeat(
+        lambda: pg8000.core.convert_paramstyle(style, query),
+        repeat=5, number=iterations))
+    cached = min(repeat(
+        lambda: pg8000.core.convert_paramstyle_cached(style, query),
+        repeat=5, number=iterations))
+    print(
+        "{0:>8}: {1:.2f} us to convert, {2:.2f} us from the cache".format(
+            style, convert * 1e6 / iterations, cached * 1e6 / iterations))
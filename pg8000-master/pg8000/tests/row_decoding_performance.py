@@ -0,0 +1,61 @@
+import pg8000
+from pg8000 import h_pack, i_pack, i_unpack, q_pack, d_pack
+from timeit import repeat
+
+
+# Times decoding a synthetic stream of a million DataRow messages, once with
+# the column at a time loop and once with the row decoder built for the
+# columns.  Doesn't need a database.  The best of three runs is taken.
+
+core = pg8000.core
+int4_col = i_pack(4) + i_pack(1234)
+int8_col = i_pack(8) + q_pack(12345678)
+float8_col = i_pack(8) + d_pack(0.5)
+text_col = i_pack(8) + b"Zombie 7"
+null_col = i_pack(-1)
+
+layouts = (
+    ("fixed width", (core.int4_recv, core.int8_recv, core.float8_recv),
+        h_pack(3) + int4_col + int8_col + float8_col),
+    ("mixed", (core.int4_recv, core.bytea_recv, core.int8_recv,
+        core.float8_recv), h_pack(4) + int4_col + text_col + int8_col +
+        float8_col),
+    ("with nulls", (core.int4_recv, core.int8_recv, core.float8_recv),
+        h_pack(3) + int4_col + null_col + float8_col),
+)
+
+
+# How rows were decoded before row decoders.
+def decode_columns(input_funcs, data):
+    data_idx = 2
+    row = []
+    for func in input_funcs:
+        vlen = i_unpack(data, data_idx)[0]
+        data_idx += 4
+        if vlen == -1:
+            row.append(None)
+        else:
+            row.append(func(data, data_idx, vlen))
+            data_idx += vlen
+    return row
+
+
+rows = 1000000
+for name, input_funcs, data in layouts:
+    stream = [data] * rows
+    decoder = core.make_row_decoder(input_funcs)
+    assert decoder(data, 0, len(data)) == decode_columns(input_funcs, data)
+
+    def loop():
+        for d in stream:
+            decode_columns(input_funcs, d)
+
+    def decode():
+        for d in stream:
+            decoder(d, 0, len(d))
+
+    looped = min(repeat(loop, repeat=3, number=1))
+    decoded = min(repeat(decode, repeat=3, number=1))
+    print(
+        "{0:>11}: {1:.2f} s column by column, {2:.2f} s with the row "
+        "decoder".format(name, looped, decoded))
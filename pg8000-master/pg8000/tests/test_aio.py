@@ -0,0 +1,9 @@
+import sys
+
+# pg8000.aio is written with async/await, which earlier Pythons can't parse
+if sys.version_info >= (3, 7):
+    from .aio_cases import Tests  # noqa
+
+if __name__ == "__main__":
+    import unittest
+    unittest.main()
@@ -3,6 +3,8 @@ import pg8000
 from .connection_settings import db_connect
 from pg8000.six import b, BytesIO
 from sys import exc_info
+from decimal import Decimal
+import datetime
 
 
 class Tests(unittest.TestCase):
@@ -91,6 +93,107 @@ class Tests(unittest.TestCase):
         finally:
             cursor.close()
 
+    def testCopyRowsFrom(self):
+        try:
+            cursor = self.db.cursor()
+            cursor.copy_rows_from(
+                ((i, i * 2, None if i % 3 else str(i))
+                    for i in range(1, 20001)), "t1")
+            self.assertEqual(cursor.rowcount, 20000)
+            cursor.copy_rows_from([[0, -1]], "t1", ("f1", "f2"))
+            self.assertEqual(cursor.rowcount, 1)
+
+            cursor.execute(
+                "SELECT count(*), sum(f2), count(f3) FROM t1 WHERE f1 > 0")
+            self.assertEqual(cursor.fetchone(), [20000, 400020000, 6666])
+            cursor.execute("SELECT * FROM t1 WHERE f1 IN (0, 3) ORDER BY f1")
+            self.assertEqual(cursor.fetchall(), ([0, -1, None], [3, 6, '3']))
+            self.db.rollback()
+        finally:
+            cursor.close()
+
+    def testCopyRowsFromBadValue(self):
+        try:
+            cursor = self.db.cursor()
+            self.assertRaises(
+                pg8000.DataError, cursor.copy_rows_from,
+                [(1, 1, "one"), (2, "two", "two")], "t1")
+            self.db.rollback()
+
+            # The connection is still in step with the server
+            cursor.execute("SELECT 1")
+            self.assertEqual(cursor.fetchone(), [1])
+            self.db.rollback()
+        finally:
+            cursor.close()
+
+    def testCopyRowsTo(self):
+        try:
+            cursor = self.db.cursor()
+            cursor.copy_rows_from(
+                ((i, i * 2, None if i % 3 else str(i))
+                    for i in range(1, 2001)), "t1")
+
+            rows = list(cursor.copy_rows_to("t1"))
+            self.assertEqual(cursor.rowcount, 2000)
+            self.assertEqual(
+                rows[:3], [(1, 2, None), (2, 4, None), (3, 6, '3')])
+            self.assertEqual(
+                cursor.copy_columns_to("t1", ("f3", "f1"))[1],
+                list(range(1, 2001)))
+
+            # Numeric is read as text, but has a binary receive function.
+            # Oid has neither, so it's cast for the binary COPY.
+            rows = cursor.copy_rows_to(
+                query="SELECT f1, f1 / 4.0, f1::oid AS f3 FROM t1 "
+                "WHERE f1 <= 2 ORDER BY f1")
+            self.assertEqual(
+                list(rows),
+                [(1, Decimal('0.250000000000000000'), 1),
+                 (2, Decimal('0.500000000000000000'), 2)])
+
+            # Rows that aren't read are skipped
+            rows = cursor.copy_rows_to("t1")
+            self.assertEqual(next(rows), (1, 2, None))
+            rows.close()
+            cursor.execute("SELECT count(*) FROM t1")
+            self.assertEqual(cursor.fetchone(), [2000])
+            self.db.rollback()
+        finally:
+            cursor.close()
+
+    def testCopyRowsNumericDateTime(self):
+        try:
+            cursor = self.db.cursor()
+            cursor.execute(
+                "CREATE TEMPORARY TABLE t2 (f1 numeric, f2 numeric(10, 3), "
+                "f3 date, f4 time)")
+            rows = [
+                (Decimal('-12345678901234567890.123'), Decimal('1.500'),
+                    datetime.date(2026, 10, 18),
+                    datetime.time(23, 59, 59, 999999)),
+                (Decimal('NaN'), None, datetime.date.max,
+                    datetime.time(0, 0)),
+                (Decimal('0.0001'), Decimal('-0.001'), datetime.date.min,
+                    None)]
+            cursor.copy_rows_from(rows, "t2")
+            self.assertEqual(cursor.rowcount, 3)
+
+            retval = list(cursor.copy_rows_to("t2"))
+            self.assertEqual(str(retval[1][0]), 'NaN')
+            self.assertEqual(retval[0], rows[0])
+            self.assertEqual(retval[1][1:], rows[1][1:])
+            self.assertEqual(retval[2], rows[2])
+
+            cursor.execute("SELECT f2::text, f3::text FROM t2 ORDER BY f2")
+            self.assertEqual(
+                cursor.fetchall(),
+                (['-0.001', '-infinity'], ['1.500', '2026-10-18'],
+                 [None, 'infinity']))
+            self.db.rollback()
+        finally:
+            cursor.close()
+
     def testCopyWithoutTableOrQuery(self):
         try:
             cursor = self.db.cursor()
@@ -99,6 +202,8 @@ class Tests(unittest.TestCase):
                 pg8000.CopyQueryOrTableRequiredError, cursor.copy_from, stream)
             self.assertRaises(
                 pg8000.CopyQueryOrTableRequiredError, cursor.copy_to, stream)
+            self.assertRaises(
+                pg8000.CopyQueryOrTableRequiredError, cursor.copy_rows_to)
             self.db.rollback()
         finally:
             cursor.close()
@@ -60,5 +60,33 @@ class Tests(unittest.TestCase):
             "SELECT $1, $2, \"f1_%\", E'txt_%' FROM t WHERE a=$3 AND b='75%'")
         self.assertEqual(make_args((1, 2, 3)), (1, 2, 3))
 
+    def testPyformatPercentEscape(self):
+        new_query, make_args = pg8000.core.convert_paramstyle(
+            "pyformat", "SELECT f1 %% 2, %(f1)s FROM t")
+        self.assertEqual(new_query, "SELECT f1 % 2, $1 FROM t")
+        self.assertEqual(make_args({"f1": 1}), (1,))
+
+    def testPyformatMixed(self):
+        self.assertRaises(
+            pg8000.errors.QueryParameterParseError,
+            pg8000.core.convert_paramstyle, "pyformat",
+            "SELECT %(f1)s, %s")
+
+    def testQuotedPercent(self):
+        self.assertRaises(
+            pg8000.errors.QueryParameterParseError,
+            pg8000.core.convert_paramstyle, "format", "SELECT '%d'")
+
+    def testCached(self):
+        query = "SELECT ? FROM t WHERE a=?"
+        converted = pg8000.core.convert_paramstyle_cached("qmark", query)
+        self.assertEqual(converted[0], "SELECT $1 FROM t WHERE a=$2")
+        self.assertTrue(
+            pg8000.core.convert_paramstyle_cached("qmark", query) is
+            converted)
+        self.assertEqual(
+            pg8000.core.convert_paramstyle_cached("numeric", query)[0],
+            query)
+
 if __name__ == "__main__":
     unittest.main()
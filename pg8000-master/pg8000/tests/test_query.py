@@ -5,6 +5,7 @@ from .connection_settings import db_connect
 from pg8000.six import u, b
 from sys import exc_info
 import datetime
+from array import array
 
 
 from warnings import filterwarnings
@@ -302,6 +303,373 @@ class Tests(unittest.TestCase):
             cursor.close()
             self.db.commit()
 
+    def testExecutemanyBatches(self):
+        try:
+            cursor = self.db.cursor()
+            # More rows than one batch, and a change of parameter types
+            # part way through, which needs a second prepared statement.
+            params = [(i, i, 'row') for i in range(2500)]
+            params += [(i, i, None) for i in range(2500, 2600)]
+            cursor.executemany(
+                "INSERT INTO t1 (f1, f2, f3) VALUES (%s, %s, %s)", params)
+            self.assertEqual(cursor.rowcount, 2600)
+            cursor.execute("SELECT count(*), count(f3) FROM t1")
+            self.assertEqual(cursor.fetchone(), [2600, 2500])
+        finally:
+            cursor.close()
+            self.db.rollback()
+
+    def testExecutemanyErrorIndex(self):
+        try:
+            cursor = self.db.cursor()
+            try:
+                cursor.executemany(
+                    "INSERT INTO t1 (f1, f2, f3) VALUES (%s, %s, %s)",
+                    [(i % 7, i, None) for i in range(10)])
+                self.fail("expected a unique violation")
+            except pg8000.ProgrammingError:
+                e = exc_info()[1]
+                self.assertEqual(e.args[1], b('23505'))
+                self.assertEqual(e.param_set_index, 7)
+            self.db.rollback()
+
+            # The connection is still usable afterwards
+            cursor.execute("SELECT count(*) FROM t1")
+            self.assertEqual(cursor.fetchone(), [0])
+        finally:
+            cursor.close()
+            self.db.rollback()
+
+    def testExecutemanyAutocommitAllOrNothing(self):
+        self.db.autocommit = True
+        try:
+            cursor = self.db.cursor()
+            # The duplicate is in the third batch, after two have gone in
+            params = [(i, i, None) for i in range(2500)]
+            params[2200] = (5, 5, None)
+            try:
+                cursor.executemany(
+                    "INSERT INTO t1 (f1, f2, f3) VALUES (%s, %s, %s)", params)
+                self.fail("expected a unique violation")
+            except pg8000.ProgrammingError:
+                e = exc_info()[1]
+                self.assertEqual(e.args[1], b('23505'))
+                self.assertEqual(e.param_set_index, 2200)
+            cursor.execute("SELECT count(*) FROM t1")
+            self.assertEqual(cursor.fetchone(), [0])
+
+            params[2200] = (2200, 2200, None)
+            cursor.executemany(
+                "INSERT INTO t1 (f1, f2, f3) VALUES (%s, %s, %s)", params)
+            self.assertEqual(cursor.rowcount, 2500)
+            self.assertFalse(self.db.in_transaction)
+            cursor.execute("SELECT count(*) FROM t1")
+            self.assertEqual(cursor.fetchone(), [2500])
+        finally:
+            cursor.close()
+            self.db.autocommit = False
+
+    def testExecutemanyUnconvertibleRow(self):
+        try:
+            cursor = self.db.cursor()
+            params = [(i, i, None) for i in range(5)]
+            params[3] = (3, 3, object())
+            try:
+                cursor.executemany(
+                    "INSERT INTO t1 (f1, f2, f3) VALUES (%s, %s, %s)", params)
+                self.fail("expected NotSupportedError")
+            except pg8000.NotSupportedError:
+                pass
+
+            # The rows before the bad one mustn't go out with the next query
+            cursor.execute(
+                "INSERT INTO t1 (f1, f2, f3) VALUES (%s, %s, %s)",
+                (10, 10, None))
+            self.assertEqual(cursor.rowcount, 1)
+            cursor.execute("SELECT f1 FROM t1")
+            self.assertEqual(cursor.fetchall(), ([10],))
+        finally:
+            cursor.close()
+            self.db.rollback()
+
+    def testPortalsClosed(self):
+        try:
+            cursor = self.db.cursor()
+            for i in range(5):
+                cursor.execute("SELECT %s", (i,))
+                cursor.fetchall()
+
+            # Closes for the finished portals go out with this query, so
+            # only its own portal is left open.
+            cursor.execute(
+                "SELECT count(*) FROM pg_cursors "
+                "WHERE name LIKE 'pg8000_portal_%%'")
+            self.assertEqual(cursor.fetchone(), [1])
+        finally:
+            cursor.close()
+            self.db.rollback()
+
+    def testOneRoundTripPerExecute(self):
+        try:
+            cursor = self.db.cursor()
+            cursor.execute("SELECT CAST(%s AS INT4)", (1,))
+            flushes = []
+            flush = self.db._flush
+
+            def counting_flush():
+                flushes.append(None)
+                flush()
+            self.db._flush = counting_flush
+            cursor.execute("SELECT CAST(%s AS INT4)", (2,))
+            self.assertEqual(cursor.fetchall(), ([2],))
+            self.assertEqual(len(flushes), 1)
+        finally:
+            self.db._flush = flush
+            cursor.close()
+            self.db.rollback()
+
+    def testOneRoundTripFirstInsert(self):
+        flush = self.db._flush
+        try:
+            cursor = self.db.cursor()
+            cursor.execute("SELECT 1")  # opens the transaction
+            flushes = []
+
+            def counting_flush():
+                flushes.append(None)
+                flush()
+            self.db._flush = counting_flush
+            cursor.execute(
+                "INSERT INTO t1 (f1, f2, f3) VALUES (%s, %s, %s)",
+                (1, 1, "Zombie"))
+            self.assertEqual(len(flushes), 1)
+            self.assertEqual(cursor.rowcount, 1)
+            cursor.execute(
+                "INSERT INTO t1 (f1, f2, f3) VALUES (%s, %s, %s)",
+                (2, 2, "Ghoul"))
+            self.assertEqual(len(flushes), 2)
+            cursor.execute("SELECT f1, f3 FROM t1 ORDER BY f1")
+            self.assertEqual(cursor.fetchall(), ([1, "Zombie"], [2, "Ghoul"]))
+        finally:
+            self.db._flush = flush
+            cursor.close()
+            self.db.rollback()
+
+    def testStatementCacheBounded(self):
+        db = pg8000.connect(max_prepared_statements=2, **db_connect)
+        try:
+            db.autocommit = True
+            cursor = db.cursor()
+            for i in range(5):
+                cursor.execute("SELECT " + str(i))
+            cursor.execute("SELECT 4")
+            cache = db.statement_cache
+            self.assertEqual((cache.hits, cache.misses), (1, 5))
+            self.assertEqual(cache.evictions, 3)
+            self.assertEqual(len(cache), 2)
+
+            cursor.execute("SELECT name FROM pg_prepared_statements")
+            cursor.execute("SELECT name FROM pg_prepared_statements")
+            self.assertEqual(len(cursor.fetchall()), 2)
+        finally:
+            db.close()
+
+    def testRowDecoding(self):
+        try:
+            cursor = self.db.cursor()
+            cursor.execute(
+                "SELECT CAST(%s AS INT4), CAST(%s AS INT8), CAST(%s AS INT2), "
+                "CAST(%s AS FLOAT8), CAST(%s AS BOOL), CAST(%s AS TEXT), "
+                "CAST(%s AS FLOAT4) FROM generate_series(1, 2)",
+                (1, 2, None, 4.5, True, "five", 6.5))
+            self.assertEqual(
+                cursor.fetchall(),
+                ([1, 2, None, 4.5, True, "five", 6.5],) * 2)
+
+            query = "SELECT CAST(x AS INT4), CAST(x * 10 AS INT8) " \
+                "FROM (VALUES (1), (NULL), (3)) AS t (x)"
+            cursor.execute(query)
+            self.assertEqual(
+                cursor.fetchall(), ([1, 10], [None, None], [3, 30]))
+        finally:
+            cursor.close()
+            self.db.rollback()
+
+    def testReadBuffer(self):
+        try:
+            cursor = self.db.cursor()
+            cursor.fetch_size = 'all'
+
+            # Rows that straddle the ends of the read buffer, and one too big
+            # to fit in it at all.
+            cursor.execute(
+                "SELECT x, repeat('x', mod(x, 537)) "
+                "FROM generate_series(1, 3000) AS t (x) "
+                "UNION ALL SELECT 0, repeat('y', 200000)")
+            rows = cursor.fetchall()
+            self.assertEqual(len(rows), 3001)
+            for x, text in rows[:-1]:
+                self.assertEqual(text, 'x' * (x % 537))
+            self.assertEqual(rows[-1], [0, 'y' * 200000])
+
+            cursor.execute("SELECT 1")
+            self.assertEqual(cursor.fetchall(), ([1],))
+        finally:
+            cursor.close()
+            self.db.rollback()
+
+    def testFetchSize(self):
+        try:
+            cursor = self.db.cursor()
+            cursor.fetch_size = 3
+            cursor.execute("SELECT * FROM generate_series(1, 10)")
+            self.assertTrue(cursor.portal_suspended)
+            self.assertEqual(len(cursor.fetchmany(4)), 4)
+            self.assertEqual(len(cursor.fetchall()), 6)
+
+            cursor.fetch_size = 'all'
+            cursor.execute("SELECT * FROM generate_series(1, 10)")
+            self.assertFalse(cursor.portal_suspended)
+            self.assertEqual(len(cursor.fetchall()), 10)
+
+            for bad in (0, -1, 'some', None):
+                try:
+                    cursor.fetch_size = bad
+                    self.fail("fetch_size %r accepted" % (bad,))
+                except pg8000.ProgrammingError:
+                    pass
+        finally:
+            cursor.close()
+            self.db.rollback()
+
+    # The portal doesn't survive the implicit transaction, so all rows have
+    # to be read straight away.
+    def testAutocommitManyRows(self):
+        try:
+            self.db.autocommit = True
+            cursor = self.db.cursor()
+            cursor.execute(
+                "SELECT * FROM generate_series(1, %s)",
+                (self.db._row_cache_size * 2 + 1,))
+            self.assertEqual(
+                len(cursor.fetchall()), self.db._row_cache_size * 2 + 1)
+        finally:
+            cursor.close()
+            self.db.autocommit = False
+
+    def testNamedCursor(self):
+        try:
+            cursor = self.db.cursor(name="big report")
+            cursor.fetch_size = 4
+            cursor.execute(
+                "SELECT * FROM generate_series(1, %s) AS t (n)", (10,))
+            self.assertEqual(cursor.description[0][0], b("n"))
+            self.assertEqual(len(cursor._cached_rows), 4)
+            self.assertEqual([row[0] for row in cursor], list(range(1, 11)))
+            self.assertEqual(cursor.rowcount, 10)
+
+            # Running it again replaces the server-side cursor
+            cursor.execute(
+                "SELECT * FROM generate_series(1, %s) AS t (n)", (5,))
+            self.assertEqual(len(cursor.fetchall()), 5)
+
+            # or one with different columns
+            cursor.execute("SELECT 'a', 1.5::float8, 2")
+            self.assertEqual(cursor.fetchall(), (['a', 1.5, 2],))
+
+            other = self.db.cursor()
+            other.execute("SELECT name FROM pg_cursors WHERE name = %s",
+                          ("big report",))
+            self.assertEqual(other.fetchall(), ())
+        finally:
+            cursor.close()
+            self.db.rollback()
+
+    def testNamedCursorAutocommit(self):
+        try:
+            self.db.autocommit = True
+            cursor = self.db.cursor(name="held")
+            cursor.fetch_size = 3
+            cursor.execute("SELECT * FROM generate_series(1, 10)")
+            self.assertFalse(self.db.in_transaction)
+            self.assertEqual(len(cursor.fetchmany(5)), 5)
+            self.assertEqual(len(cursor.fetchall()), 5)
+        finally:
+            cursor.close()
+            self.db.autocommit = False
+
+    def testNamedCursorCloseTakesLock(self):
+        try:
+            cursor = self.db.cursor(name="shared")
+            cursor.fetch_size = 2
+            cursor.execute("SELECT * FROM generate_series(1, 10)")
+            closer = threading.Thread(target=cursor.close)
+            self.db._lock.acquire()
+            try:
+                closer.start()
+                closer.join(0.2)
+
+                # The server-side cursor's cleanup waits for the connection
+                self.assertTrue(closer.is_alive())
+            finally:
+                self.db._lock.release()
+            closer.join()
+            self.assertFalse(cursor._server_cursor_open)
+        finally:
+            cursor.close()
+            self.db.rollback()
+
+    def testFetchColumns(self):
+        try:
+            cursor = self.db.cursor()
+            cursor.fetch_size = 3
+            cursor.execute(
+                "SELECT x, x * 10000000000, x / 2.0::float8, "
+                "'2000-01-01 00:00:01.5'::timestamp + x * interval '1 day', "
+                "'2000-01-01 00:00:00+00'::timestamptz, x::text, "
+                "nullif(x, 5) FROM generate_series(1, 10) AS t (x)")
+            ints, int8s, floats, stamps, stamptzs, texts, nulls = \
+                cursor.fetchcolumns()
+            self.assertEqual(ints, array('i', range(1, 11)))
+            self.assertEqual(
+                int8s.tolist(), [x * 10000000000 for x in range(1, 11)])
+            self.assertEqual(
+                floats, array('d', [x / 2.0 for x in range(1, 11)]))
+            self.assertEqual(
+                stamps, array('d', [946684801.5 + 86400 * x
+                                    for x in range(1, 11)]))
+            self.assertEqual(stamptzs, array('d', [946684800.0] * 10))
+            self.assertEqual(texts, [str(x) for x in range(1, 11)])
+
+            # A NULL turns the column into a list
+            self.assertEqual(nulls, [1, 2, 3, 4, None, 6, 7, 8, 9, 10])
+            self.assertEqual(
+                [len(column) for column in cursor.fetchcolumns()], [0] * 7)
+
+            cursor = self.db.cursor(name="columns")
+            cursor.fetch_size = 4
+            cursor.execute("SELECT * FROM generate_series(1, 10)")
+            self.assertEqual(
+                cursor.fetchcolumns(), [array('i', range(1, 11))])
+            self.assertEqual(cursor.rowcount, 10)
+
+            try:
+                import numpy
+            except ImportError:
+                numpy = None
+            if numpy is not None:
+                cursor.execute("SELECT x, x::text, x / 2.0::float8 "
+                               "FROM generate_series(1, 10) AS t (x)")
+                ints, texts, floats = cursor.fetchcolumns(numpy=True)
+                self.assertTrue(isinstance(ints, numpy.ndarray))
+                self.assertEqual(ints.sum(), 55)
+                self.assertEqual(floats.tolist(),
+                                 [x / 2.0 for x in range(1, 11)])
+                self.assertEqual(texts[0], '1')
+        finally:
+            cursor.close()
+            self.db.rollback()
+
     # Check that autocommit stays off
     # We keep track of whether we're in a transaction or not by using the
     # READY_FOR_QUERY message.
@@ -30,11 +30,31 @@ class Tests(unittest.TestCase):
         retval = self.cursor.fetchall()
         self.assertEqual(retval[0][0], datetime.time(4, 5, 6))
 
+        for v in (
+                datetime.time(0, 0), datetime.time(23, 59, 59, 999999),
+                datetime.time(12, 0, 0, 1)):
+            self.cursor.execute("SELECT %s as f1", (v,))
+            self.assertEqual(self.cursor.fetchone()[0], v)
+
     def testDateRoundtrip(self):
         self.cursor.execute("SELECT %s as f1", (datetime.date(2001, 2, 3),))
         retval = self.cursor.fetchall()
         self.assertEqual(retval[0][0], datetime.date(2001, 2, 3))
 
+        for v in (
+                datetime.date(1999, 12, 31), datetime.date(2000, 1, 1),
+                datetime.date(9999, 12, 30), datetime.date.max,
+                datetime.date.min):
+            self.cursor.execute("SELECT %s as f1", (v,))
+            self.assertEqual(self.cursor.fetchone()[0], v)
+
+        self.cursor.execute(
+            "SELECT 'infinity'::date, '-infinity'::date, "
+            "%s::date = 'infinity'", (datetime.date.max,))
+        self.assertEqual(
+            self.cursor.fetchone(),
+            [datetime.date.max, datetime.date.min, True])
+
     def testBoolRoundtrip(self):
         self.cursor.execute("SELECT %s as f1", (True,))
         retval = self.cursor.fetchall()
@@ -257,6 +277,9 @@ class Tests(unittest.TestCase):
         self.cursor.execute("select indkey from pg_index")
         retval = self.cursor.fetchall()
 
+        self.cursor.execute("select cast('23 -1 25' as oidvector) as f1")
+        self.assertEqual(self.cursor.fetchone()[0], [23, 4294967295, 25])
+
     def testTimestampTzOut(self):
         self.cursor.execute(
             "SELECT '2001-02-03 04:05:06.17 America/Edmonton'"
@@ -415,13 +438,31 @@ class Tests(unittest.TestCase):
             ("float8send", 22.2),
             ("timestamp_send", datetime.datetime(2001, 2, 3, 4, 5, 6, 789)),
             ("byteasend", pg8000.Binary(b("\x01\x02"))),
-            ("interval_send", pg8000.Interval(1234567, 123, 123)),)
+            ("interval_send", pg8000.Interval(1234567, 123, 123)),
+            ("date_send", datetime.date(1969, 7, 20)),
+            ("time_send", datetime.time(4, 5, 6, 789)),)
         for method_out, value in methods:
             self.cursor.execute("SELECT %s(%%s) as f1" % method_out, (value,))
             retval = self.cursor.fetchall()
             self.assertEqual(
                 retval[0][0], self.db.make_params((value,))[0][2](value))
 
+    # NUMERIC is sent and read as text, but its binary codecs are used by
+    # binary COPY
+    def testNumericBinaryCodecs(self):
+        values = (
+            "0", "0.00", "1", "-1.50", "10000", "0.0001", "0.00001",
+            "9999.9999", "123456789.987654321", "1e-30", "1E+5",
+            "-12345678901234567890.123", "NaN")
+        for v in values:
+            d = decimal.Decimal(v)
+            self.cursor.execute(
+                "SELECT numeric_send(%s), %s::numeric::text", (d, d))
+            data, text = self.cursor.fetchone()
+            self.assertEqual(data, pg8000.core.numeric_send(d))
+            retval = pg8000.core.numeric_recv(data, 0, len(data))
+            self.assertEqual(str(retval), str(decimal.Decimal(text)))
+
     def testInt4ArrayOut(self):
         self.cursor.execute(
             "SELECT '{1,2,3,4}'::INT[] AS f1, "
@@ -554,6 +595,30 @@ class Tests(unittest.TestCase):
                 decimal.Decimal("1.1"), decimal.Decimal("2.2"),
                 decimal.Decimal("3.3")])
 
+        self.cursor.execute(
+            "SELECT '{{-1.50,NULL},{NaN,1e-30}}'::numeric[] AS f1, "
+            "'[0:1]={0,12345678901234567890.123}'::numeric[] AS f2, "
+            "'{}'::numeric[] AS f3")
+        f1, f2, f3 = self.cursor.fetchone()
+        self.assertEqual(str(f1[0][0]), "-1.50")
+        self.assertEqual(f1[0][1], None)
+        self.assertTrue(f1[1][0].is_nan())
+        self.assertEqual(f1[1][1], decimal.Decimal("1e-30"))
+        self.assertEqual(
+            f2, [
+                decimal.Decimal(0),
+                decimal.Decimal("12345678901234567890.123")])
+        self.assertEqual(f3, [])
+
+    def testParseArray(self):
+        parse_array = pg8000.core.parse_array
+        self.assertEqual(
+            parse_array('{{"a,b","{NULL}"},{NULL,"NULL"}}', text_type),
+            [["a,b", "{NULL}"], [None, "NULL"]])
+        self.assertEqual(
+            parse_array(r'{"say \"hi\"","back\\slash",x y}', text_type),
+            ['say "hi"', "back\\slash", "x y"])
+
     def testNumericArrayRoundtrip(self):
         v = [decimal.Decimal("1.1"), None, decimal.Decimal("3.3")]
         self.cursor.execute("SELECT %s as f1", (v,))
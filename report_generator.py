@@ -5,6 +5,7 @@ from datetime import datetime
 import getpass
 import json
 import smtplib
+import socket
 import sys
 import os
 import logging
@@ -39,6 +40,10 @@ def main():
                               "--report_scheduler",
                               help="Automatically Generate Weekly Report",
                               action="store_true")
+    report_group.add_argument("-k",
+                              "--purge",
+                              help="Delete raw samples (after rolling them up) older than --keep_days",
+                              action="store_true")
 
     email_group = parser.add_argument_group('E-mail Config')
     email_group.add_argument("-e",
@@ -67,6 +72,16 @@ def main():
                         default=60,
                         help="Wait x second between checks (ex. 60)")
 
+    parser.add_argument("--keep_days",
+                        action="store",
+                        type=int,
+                        default=35,
+                        help="Days of raw samples to keep when purging (ex. 35)")
+    parser.add_argument("--keep_hourly_days",
+                        action="store",
+                        type=int,
+                        default=400,
+                        help="Days of hourly usage to keep when purging, daily usage is kept forever (ex. 400)")
     parser.add_argument("--debug",
                         action="store_true",
                         help="Debug Mode Logging")
@@ -105,16 +120,30 @@ def main():
     # Magic starts here
     if args.generate_report:
         db_controller.db_helper().test_db_setup()
-        gmail().test_login()
-        mode.generate_report()
+        mailer = gmail()
+        mailer.test_login()  # Session is reused by the report, not opened twice
+        try:
+            mode.generate_report(mailer=mailer)
+        finally:
+            mailer.close()
+
+    if args.purge:
+        db_controller.db_helper().test_db_setup()
+        mode.purge(raw_days=args.keep_days, hourly_days=args.keep_hourly_days)
 
     if args.report_scheduler:
         db_controller.db_helper().test_db_setup()
-        gmail().test_login()
-        mode.report_scheduler()
+        mailer = gmail()
+        mailer.test_login()
+        try:
+            mode.report_scheduler(mailer=mailer)
+        finally:
+            mailer.close()
 
 
 class modes(object):  # Uses new style classes
+    REPORT_FETCH_SIZE = 2000  # Hourly rows pulled per round trip, bounds memory however many days are reported on
+
     def __init__(self, sleep_delay):
         self.sleep_delay = sleep_delay
 
@@ -125,47 +154,70 @@ class modes(object):  # Uses new style classes
             print("Bye Bye.")
             sys.exit(0)
 
-    def report_scheduler(self):
+    def report_scheduler(self, mailer=None):
         # TODO Interval should be in days or hours, NOT seconds
-        self.generate_report()
+        self.generate_report(mailer=mailer)
         self.sleep()
 
     @staticmethod
-    def generate_report(number_of_days=7):
-        conn, cur = db_controller.db_access().open_connection()
-        query = '''SELECT * FROM player_activity WHERE "Time_Stamp" >= (now() - '{0} day'::INTERVAL);'''
-        cur.execute(query.format(number_of_days))
-        data = cur.fetchall()
-        db_controller.db_access.close_connection(conn, cur)
-        logging.debug('DB dump')
-        logging.debug(data)
-
-        # Generate list of server names from query
-        server_names = set([x[4] for x in data])
-        server_data = []
-
-        # Individual Servers
-        for i in server_names:
-            minutes_used = len([x for x in data if x[4] == i])
-            server_data.append((i, minutes_used))
+    def purge(raw_days, hourly_days):
+        print("Purging raw samples older than {0} day(s) & hourly usage older than {1} day(s)".format(
+            raw_days, hourly_days))
+        deleted = db_controller.usage_rollups().purge(raw_days=raw_days, hourly_days=hourly_days)
+        print("Removed {0} row(s)".format(deleted))
+        logging.info("Purged {0} row(s)".format(deleted))
+
+    @staticmethod
+    def generate_report(number_of_days=7, mailer=None):
+        db_controller.usage_rollups().refresh()  # Only folds in rows added since the last report
+
+        # Hourly rollup already has the counts, we only get back one row per server & hour
+        query = '''SELECT "Server_Name", "Bucket"::DATE, EXTRACT(HOUR FROM "Bucket")::INT4, "Samples", "Peak_Players"
+        FROM player_activity_hourly WHERE "Bucket" >= date_trunc('hour', now() - CAST(%s AS INT4) * '1 day'::INTERVAL)'''
+        server_minutes = {}
+        server_peaks = {}
+        day_minutes = {}
+        hour_minutes = {}
+        pool = db_controller.connection_pool.get_pool()
+        conn, cur = pool.checkout()
+        report_cur = conn.cursor(name='usage_report')  # Server side cursor, rows are streamed in batches
+        report_cur.fetch_size = modes.REPORT_FETCH_SIZE
+        try:
+            report_cur.execute(query, (number_of_days,))
+            for server_name, day, hour, minutes, peak_players in report_cur:
+                server_minutes[server_name] = server_minutes.get(server_name, 0) + minutes
+                server_peaks[server_name] = max(server_peaks.get(server_name, 0), peak_players)
+                day_minutes[day] = day_minutes.get(day, 0) + minutes
+                hour_minutes[hour] = hour_minutes.get(hour, 0) + minutes
+            logging.debug('Aggregated {0} hourly row(s)'.format(report_cur.rowcount))
+        finally:
+            report_cur.close()
+            pool.checkin(conn, cur)
 
         # Total Usage for period
-        minutes_used = 0
-        for i in server_data:
-            minutes_used += i[1]
+        minutes_used = sum(server_minutes.values())
 
         msg = ['During the last ' + str(number_of_days) + ' days: \n\n']  # Email Message Body
-        for i in server_data:
-            msg.append(i[0])
+        for i in sorted(server_minutes):
+            msg.append(i)
             msg.append(' has used ')
-            msg.append(str(i[1]))
-            msg.append(' minute(s). \n')
+            msg.append(str(server_minutes[i]))
+            msg.append(' minute(s), with a peak of ')
+            msg.append(str(server_peaks[i]))
+            msg.append(' player(s). \n')
         msg.append('\nA total of ' + str(minutes_used) + ' minute(s) were used.')
 
+        if day_minutes:
+            msg.append('\n\nUsage by day: \n')
+            for i in sorted(day_minutes):
+                msg.append(i.strftime('%a %Y-%m-%d') + ': ' + str(day_minutes[i]) + ' minute(s) \n')
+            busiest_hour = max(hour_minutes, key=hour_minutes.get)
+            msg.append('\nBusiest hour of the day was {0:02d}:00 with {1} minute(s).'.format(
+                busiest_hour, hour_minutes[busiest_hour]))
+
         msg.append('\n\nReport Generated @ ' + str(datetime.now()))
         subj = "Minecraft Server Usage Report"
-        gmail().send(subject=subj, text=''.join(msg))
-        # Create gmail obj
+        (mailer or gmail()).send(subject=subj, text=''.join(msg))
 
 
 class gmailSettings():
@@ -198,19 +250,43 @@ class SettingsHelper(gmailSettings):
 
 
 class gmail(object, SettingsHelper):
-    """ Lets users send email messages """
+    """ Lets users send email messages over one logged in session """
     # TODO Maybe implement other mail providers
-    def __init__(self):
+    SMTP_HOST = "smtp.gmail.com"
+    SMTP_PORT = 587  # or port 465 doesn't seem to work!
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, use_tls=True):
         self.loadSettings()
         self.PASSWORD = keyring.get_password(self.KEYRING_APP_ID, self.USERNAME)  # Loads password from secure storage
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls  # Turn off to test against a plain local SMTP server
+        self.__server = None
+
+    def connect(self):
+        """ Opens & logs in the session every send() goes over """
+        self.close()
+        server = smtplib.SMTP(self.host, self.port)
+        server.ehlo()
+        if self.use_tls:
+            server.starttls()
+        if self.PASSWORD:
+            server.login(self.USERNAME, self.PASSWORD)
+        self.__server = server
+        logging.debug("SMTP session opened")
+
+    def close(self):
+        if self.__server is not None:
+            try:
+                self.__server.quit()
+            except (smtplib.SMTPException, socket.error):
+                pass  # Already gone, nothing to tidy up
+            self.__server = None
+            logging.debug("SMTP session closed")
 
     def test_login(self):
         try:
-            server = smtplib.SMTP("smtp.gmail.com", 587)  # or port 465 doesn't seem to work!
-            server.ehlo()
-            server.starttls()
-            server.login(self.USERNAME, self.PASSWORD)
-            server.close()
+            self.connect()  # Left open for the report to use
         except smtplib.SMTPAuthenticationError:
             print("Username password mismatch")
             sys.exit(1)
@@ -222,12 +298,14 @@ class gmail(object, SettingsHelper):
                                                                     text)
 
         logging.info("Sending email")
-        server = smtplib.SMTP("smtp.gmail.com", 587)  # or port 465 doesn't seem to work!
-        server.ehlo()
-        server.starttls()
-        server.login(self.USERNAME, self.PASSWORD)
-        server.sendmail(self.USERNAME, self.SEND_ALERT_TO, message)
-        server.close()
+        if self.__server is None:
+            self.connect()
+        try:
+            self.__server.sendmail(self.USERNAME, self.SEND_ALERT_TO, message)
+        except smtplib.SMTPServerDisconnected:  # Server hung up on an idle session
+            logging.info("SMTP session dropped, reconnecting")
+            self.connect()
+            self.__server.sendmail(self.USERNAME, self.SEND_ALERT_TO, message)
         logging.info("Message Sent")
 
     def configure(self):
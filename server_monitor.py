@@ -1,14 +1,17 @@
 #!/usr/bin/env python2.7
 """A python project for managing Minecraft servers hosted on MineOS (http://minecraft.codeemo.com)
 """
-from datetime import datetime
+from datetime import datetime, date
 import json
 import sys
 import os
 import logging
 import argparse
-from time import sleep
+import threading
+from time import sleep, time
+from Queue import Queue, Empty
 import subprocess
+import ctypes
 import db_controller
 
 sys.path.append('/usr/games/minecraft')  # Strange path issue, only appears when run from local console, not IDE
@@ -24,6 +27,23 @@ __email__ = "jelloeater@gmail.com"
 LOG_FILENAME = "serverMonitor.log"
 
 
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+try:
+    _clock_gettime = ctypes.CDLL('librt.so.1', use_errno=True).clock_gettime
+    _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+
+    def monotonic():
+        """ Seconds from a clock that never jumps when the wall clock is changed (Python 2.7 has no time.monotonic) """
+        t = _timespec()
+        if _clock_gettime(1, ctypes.byref(t)) != 0:  # 1 is CLOCK_MONOTONIC
+            raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+        return t.tv_sec + t.tv_nsec * 1e-9
+except (OSError, AttributeError):
+    monotonic = time  # Not Linux, best effort
+
+
 def main():
     """ Take arguments and direct program """
     parser = argparse.ArgumentParser(description="A MineOS Player Stats Monitor"
@@ -62,6 +82,17 @@ def main():
                         type=int,
                         default=60,
                         help="Wait x second between checks (ex. 60)")
+    parser.add_argument("-w",
+                        "--workers",
+                        action="store",
+                        type=int,
+                        default=8,
+                        help="Number of servers to check at the same time (ex. 8)")
+    parser.add_argument("--timeout",
+                        action="store",
+                        type=int,
+                        help="Give up on a server check after x seconds, never more than the delay "
+                             "(defaults to {0})".format(server_poller.DEFAULT_TIMEOUT))
     parser.add_argument('-b',
                         dest='base_directory',
                         default='/var/games/minecraft',
@@ -90,7 +121,8 @@ def main():
                             format="[%(asctime)s] [%(levelname)8s] --- %(message)s (%(filename)s:%(lineno)s)",
                             level=logging.WARNING)
 
-    mode = modes(base_directory=args.base_directory, owner=args.owner, sleep_delay=args.delay)
+    mode = modes(base_directory=args.base_directory, owner=args.owner, sleep_delay=args.delay,
+                 workers=args.workers, timeout=args.timeout)
     # Create new mode object for flow, I'll buy that :)
 
     if len(sys.argv) == 1:  # Displays help and lists servers (to help first time users)
@@ -118,18 +150,35 @@ def main():
 
 
 class modes(object):  # Uses new style classes
-    def __init__(self, base_directory, owner, sleep_delay):
+    def __init__(self, base_directory, owner, sleep_delay, workers=8, timeout=None):
         self.base_directory = base_directory
         self.sleep_delay = sleep_delay
         self.owner = owner  # We NEED to specify owner or we get a error in the webGUI during start/stop from there
+        self.scheduler = tick_scheduler(sleep_delay)
+        self.partitions_checked = date.today()  # test_db_setup() covers the first day
+        self.registry = server_registry(owner=owner, base_directory=base_directory)
+        timeout = min(timeout or server_poller.DEFAULT_TIMEOUT, sleep_delay)  # A sweep should never outlast a tick
+        self.poller = server_poller(registry=self.registry, workers=workers, timeout=timeout)
         logging.debug("Modes obj created" + str(self.base_directory) + '  ' + str(self.owner))
 
     def sleep(self):
+        db_controller.sample_writer.get_writer().flush()  # One COPY & commit per sweep
+        if self.partitions_checked != date.today():
+            db_controller.db_helper().ensure_partitions()
+            self.partitions_checked = date.today()
+        self.scheduler.wait()
+
+    def run(self, sweep):
+        """ Calls sweep once a tick until Ctrl-C, which can land anywhere in the sweep, flush or wait """
+        self.scheduler.start()
         try:
-            sleep(self.sleep_delay)
+            while True:
+                sweep()
+                self.sleep()
         except KeyboardInterrupt:
             print("Bye Bye.")
-            sys.exit(0)
+        finally:
+            db_controller.connection_pool.get_pool().close_all()
 
     def list_servers(self):
         print("Servers:")
@@ -154,32 +203,175 @@ class modes(object):  # Uses new style classes
 
         logging.info("Starting monitor")
 
-        while True:
-            for i in servers_to_monitor:
-                server_logger(server_name=i, owner=self.owner, base_directory=self.base_directory).check_server_status()
-            self.sleep()
+        self.run(lambda: self.poller.poll(servers_to_monitor))
 
     def multi_server(self):
         print("Multi Server mode")
         print("Press Ctrl-C to quit")
 
-        while True:
-            server_list = mc.list_servers(self.base_directory)
+        def sweep():
+            server_list = self.registry.server_names()
             logging.debug(server_list)
 
-            for i in server_list:
-                server_logger(server_name=i, owner=self.owner, base_directory=self.base_directory).check_server_status()
-            self.sleep()
+            self.poller.poll(server_list)
+        self.run(sweep)
 
     def single_server(self, server_name):
         print("Single Server Mode: " + server_name)
         print("Press Ctrl-C to quit")
 
-        while True:
+        def sweep():
             logging.debug(self.owner)
-            server_logger(server_name=server_name, owner=self.owner,
-                          base_directory=self.base_directory).check_server_status()
-            self.sleep()
+            self.registry.get(server_name).check_server_status()
+        self.run(sweep)
+
+
+class tick_scheduler(object):
+    """ Keeps sweeps on a fixed rate, so the sweep time does not add to the delay """
+    def __init__(self, period, clock=monotonic, sleep=sleep):
+        self.period = period
+        self.__clock = clock
+        self.__sleep = sleep
+        self.ticks = 0
+        self.missed_ticks = 0  # Ticks skipped because a sweep ran longer than the period
+        self.last_sweep = 0.0  # Seconds the last sweep took
+        self.last_lag = 0.0  # Seconds the last tick started after it was due
+        self.max_lag = 0.0
+        self.__next_tick = None
+
+    def start(self):
+        """ Marks the start of the first sweep """
+        self.__next_tick = self.__clock()
+
+    def wait(self):
+        """ Sleeps until the next tick is due """
+        now = self.__clock()
+        if self.__next_tick is None:
+            self.__next_tick = now
+        self.last_sweep = now - self.__next_tick
+        self.__next_tick += self.period
+
+        if now >= self.__next_tick:  # Sweep overran, skip the ticks we can't make instead of bunching them up
+            missed = int((now - self.__next_tick) // self.period) + 1
+            self.missed_ticks += missed
+            self.__next_tick += missed * self.period
+            logging.warning('Sweep took {0:.1f}s, missed {1} tick(s) ({2} total)'.format(
+                self.last_sweep, missed, self.missed_ticks))
+
+        self.__sleep(max(self.__next_tick - self.__clock(), 0))
+        self.ticks += 1
+        self.last_lag = self.__clock() - self.__next_tick
+        self.max_lag = max(self.max_lag, self.last_lag)
+        logging.debug('Tick {0}: sweep {1:.3f}s, lag {2:.3f}s (max {3:.3f}s)'.format(
+            self.ticks, self.last_sweep, self.last_lag, self.max_lag))
+
+
+class server_registry(object):
+    """ Keeps server_logger objects alive between ticks, rescans only when the server folders change """
+    CONFIG_FILES = ('server.properties', 'server.config')  # Read by mc when a server object is built
+
+    def __init__(self, owner, base_directory):
+        self.owner = owner
+        self.base_directory = base_directory
+        self.__watched = [base_directory] + [os.path.join(base_directory, mc.DEFAULT_PATHS[x])
+                                             for x in ('servers', 'backup')]  # Folders list_servers() reads
+        self.__mtimes = None
+        self.__servers = {}  # Name to (config mtimes, server_logger), or None until first use
+        self.__lock = threading.Lock()
+
+    def server_names(self):
+        """ Returns the current server names, only touching the disk when a watched folder has changed """
+        with self.__lock:
+            self.__rescan()
+            return sorted(self.__servers)
+
+    def get(self, server_name):
+        """ Returns the cached server_logger for a server, rebuilding it if its config files have changed """
+        config_mtimes = self.__config_mtimes(server_name)  # Read first, so a change made mid build is seen next time
+        with self.__lock:
+            self.__rescan()
+            if server_name not in self.__servers:  # Deleted or renamed, don't bring it back
+                raise KeyError('No server called {0}'.format(server_name))
+            cached = self.__servers[server_name]
+        if cached is None or cached[0] != config_mtimes:  # Built outside the lock, mc does a fair bit of disk work
+            if cached is not None:
+                logging.info('Config for server {0} changed, reloading'.format(server_name))
+            server = server_logger(server_name=server_name, owner=self.owner, base_directory=self.base_directory)
+            with self.__lock:
+                cached = self.__servers.get(server_name)
+                if cached is None or cached[0] != config_mtimes:
+                    cached = (config_mtimes, server)
+                    if server_name in self.__servers:  # Unless a rescan dropped it meanwhile
+                        self.__servers[server_name] = cached
+        return cached[1]
+
+    def __rescan(self):
+        """ Call with the lock held """
+        mtimes = [os.stat(x).st_mtime if os.path.isdir(x) else None for x in self.__watched]
+        if mtimes != self.__mtimes:
+            names = set(mc.list_servers(self.base_directory))
+            for i in set(self.__servers) - names:
+                logging.info('Server {0} has gone away'.format(i))
+                del self.__servers[i]
+            for i in names - set(self.__servers):
+                self.__servers[i] = None  # Created on first use
+            self.__mtimes = mtimes
+            logging.debug('Server list refreshed')
+
+    def __config_mtimes(self, server_name):
+        server_directory = os.path.join(self.base_directory, mc.DEFAULT_PATHS['servers'], server_name)
+        paths = [os.path.join(server_directory, x) for x in self.CONFIG_FILES]
+        return [os.stat(x).st_mtime if os.path.isfile(x) else None for x in paths]
+
+
+class server_poller(object):
+    """ Checks many servers at once with a fixed set of worker threads """
+    DEFAULT_TIMEOUT = 10  # Seconds, a healthy server answers its ping in well under this
+
+    def __init__(self, registry, workers, timeout):
+        self.registry = registry
+        self.timeout = timeout
+        self.__tasks = Queue()
+        self.__busy = set()  # Servers whose check has not come back yet, even from an earlier sweep
+        self.__lock = threading.Lock()
+        for i in range(max(workers, 1)):
+            worker = threading.Thread(target=self.__worker, name='poller-' + str(i))
+            worker.daemon = True  # A hung ping must not stop us from exiting
+            worker.start()
+        logging.debug('Started {0} poller thread(s)'.format(workers))
+
+    def poll(self, server_names):
+        """ Checks every server, returns when all are done or the timeout runs out """
+        done = Queue()
+        waiting = set()
+        for i in server_names:
+            with self.__lock:
+                if i in self.__busy:
+                    logging.warning('Previous check of {0} still running, skipping'.format(i))
+                    continue
+                self.__busy.add(i)
+            waiting.add(i)
+            self.__tasks.put((i, done))
+
+        deadline = time() + self.timeout
+        while waiting:
+            try:
+                waiting.discard(done.get(timeout=max(deadline - time(), 0)))
+            except Empty:
+                logging.warning('Timed out checking: {0}'.format(', '.join(sorted(waiting))))
+                break
+
+    def __worker(self):
+        while True:
+            server_name, done = self.__tasks.get()
+            try:
+                self.registry.get(server_name).check_server_status()
+            except Exception:
+                logging.exception('Error checking server {0}'.format(server_name))
+            finally:
+                with self.__lock:
+                    self.__busy.discard(server_name)
+                done.put(server_name)
 
 
 class server_logger(mc):
@@ -196,11 +388,7 @@ class server_logger(mc):
         players_list = json.dumps([])
         # players_list = json.dumps(self.get_player_list())
 
-        conn, cur = db_controller.db_access().open_connection()
-        cur.execute(
-            'INSERT INTO player_activity ("Time_Stamp","Player_Count","Player_Names","Server_Name") VALUES (%s, %s, %s,%s)',
-            (datetime.now(), self.ping[3], players_list, self.server_name))
-        db_controller.db_access.close_connection(conn, cur)
+        db_controller.sample_writer.get_writer().add(datetime.now(), int(self.ping[3]), players_list, self.server_name)
 
     def get_player_list(self):
         players_list = []
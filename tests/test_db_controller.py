@@ -0,0 +1,302 @@
+import json
+import logging
+import os
+import socket
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+import db_controller
+
+class FakeConnection(object):
+    """ Stands in for a pg8000 connection, COPY'd rows go into database once committed """
+
+    def __init__(self, database, fails=(), on_copy=None):
+        self.database = database
+        self.fails = set(fails)  # Calls that raise socket.error, out of 'execute', 'copy' & 'commit'
+        self.on_copy = on_copy
+        self.uncommitted = []
+        self.broken = False
+        self.closed = False
+
+    def check(self, call):
+        if self.broken or call in self.fails:
+            self.broken = True  # Like a real socket error, every call after fails too
+            raise socket.error('Connection reset by peer')
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.check('commit')
+        self.database.extend(self.uncommitted)
+        self.uncommitted = []
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query, args=()):
+        self.connection.check('execute')
+
+    def fetchall(self):
+        return ([1],)
+
+    def copy_rows_from(self, rows, table, columns):
+        if self.connection.on_copy:
+            self.connection.on_copy()
+        self.connection.check('copy')
+        self.connection.uncommitted.extend(rows)
+
+    def close(self):
+        pass
+
+
+class FakePool(db_controller.connection_pool):
+    """ A real pool, handing out FakeConnections that share one database """
+
+    def __init__(self, max_connections=2):
+        super(FakePool, self).__init__(max_connections)
+        self.database = []
+        self.fails = ()  # Passed on to new connections
+        self.on_copy = None
+        self.opened = []
+
+    def open_connection(self):
+        connection = FakeConnection(self.database, self.fails, self.on_copy)
+        self.opened.append(connection)
+        return connection, connection.cursor()
+
+
+class FakeDbTestCase(unittest.TestCase):
+    """ Runs against a FakePool, with a clock the test moves on by hand """
+
+    def setUp(self):
+        self.patched = []
+        self.patch(db_controller.keyring, 'get_password', lambda app_id, username: 'secret')
+        self.patch(db_controller.SettingsHelper, 'loadSettings', classmethod(lambda cls: None))
+        self.now = 1000.0
+        self.patch(db_controller, 'time', lambda: self.now)
+        self.pool = FakePool()
+        self.patch(db_controller.connection_pool, 'get_pool', staticmethod(lambda: self.pool))
+        logging.disable(logging.CRITICAL)  # Failed writes are expected
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        for obj, name, value in reversed(self.patched):
+            setattr(obj, name, value)
+
+    def patch(self, obj, name, value):
+        self.patched.append((obj, name, obj.__dict__[name]))
+        setattr(obj, name, value)
+
+
+class PoolTests(FakeDbTestCase):
+    def testCheckoutWaitsAtMaxConnections(self):
+        first = self.pool.checkout()
+        self.pool.checkout()
+        self.assertRaises(db_controller.pg8000.errors.InterfaceError, self.pool.checkout, 0.01)
+
+        self.pool.checkin(*first)
+        self.assertTrue(self.pool.checkout(0.01)[0] is first[0])
+        self.assertEqual(len(self.pool.opened), 2)
+
+    def testLastCheckedInIsReusedFirst(self):
+        first = self.pool.checkout()
+        second = self.pool.checkout()
+        self.pool.checkin(*first)
+        self.pool.checkin(*second)
+        self.assertTrue(self.pool.checkout()[0] is second[0])
+        self.assertTrue(self.pool.checkout()[0] is first[0])
+
+    def testStaleConnectionFailingHealthCheckIsReplaced(self):
+        stale = self.pool.checkout()
+        self.pool.checkin(*stale)
+        stale[0].fails.add('execute')
+
+        self.now += self.pool.HEALTH_CHECK_AGE - 1  # Recently used, so it isn't checked
+        connection, cursor = self.pool.checkout()
+        self.assertTrue(connection is stale[0])
+        self.pool.checkin(connection, cursor)
+
+        self.now += self.pool.HEALTH_CHECK_AGE
+        connection, cursor = self.pool.checkout()
+        self.assertTrue(stale[0].closed)
+        self.assertTrue(connection is self.pool.opened[1])
+
+    def testCheckinDiscardsConnectionFailingCommit(self):
+        broken = self.pool.checkout()
+        self.pool.checkout()
+        broken[0].fails.add('commit')
+        self.pool.checkin(*broken)
+        self.assertTrue(broken[0].closed)
+
+        # Its slot is free for a new connection
+        connection, cursor = self.pool.checkout(0.01)
+        self.assertTrue(connection is self.pool.opened[2])
+
+
+class WriterTests(FakeDbTestCase):
+    def setUp(self):
+        super(WriterTests, self).setUp()
+        self.writer = db_controller.sample_writer(max_rows=3, max_age=300)
+
+    def add(self, *server_names):
+        for server_name in server_names:
+            self.writer.add(self.now, 1, '[]', server_name)
+
+    def written(self):
+        return [row[3] for row in self.pool.database]
+
+    def testFlushesOnceMaxRowsAreWaiting(self):
+        self.add('a', 'b')
+        self.assertEqual(self.written(), [])
+        self.add('c')
+        self.assertEqual(self.written(), ['a', 'b', 'c'])
+
+    def testFlushesOnceOldestSampleIsMaxAgeOld(self):
+        self.add('a')
+        self.now += 299
+        self.add('b')
+        self.assertEqual(self.written(), [])
+        self.now += 1
+        self.writer.max_rows = 100
+        self.add('c')
+        self.assertEqual(self.written(), ['a', 'b', 'c'])
+
+    def testFailedWriteIsRetriedInOrder(self):
+        self.pool.fails = ('copy',)
+        self.pool.on_copy = lambda: self.add('d')  # Sampled while the write was under way
+        self.add('a', 'b', 'c')
+        self.assertEqual(self.written(), [])
+
+        self.pool.fails = ()
+        self.pool.on_copy = None
+        self.add('e')
+        self.writer.flush()
+        self.assertEqual(self.written(), ['a', 'b', 'c', 'd', 'e'])
+
+    def testFailedCommitIsRetried(self):
+        self.pool.fails = ('commit',)
+        self.add('a', 'b', 'c')
+        self.assertEqual(self.written(), [])
+
+        self.pool.fails = ()
+        self.writer.flush()
+        self.assertEqual(self.written(), ['a', 'b', 'c'])
+
+    def testOldestSamplesDroppedPastMaxPending(self):
+        self.patch(db_controller.sample_writer, 'MAX_PENDING', 4)
+        self.pool.fails = ('copy',)
+        self.add('a', 'b', 'c', 'd', 'e', 'f')
+
+        self.pool.fails = ()
+        self.writer.flush()
+        self.assertEqual(self.written(), ['c', 'd', 'e', 'f'])
+
+
+# Scratch database the tests can empty, as a JSON object of db_settings values plus PASSWORD, eg.
+# {"USERNAME": "postgres", "PASSWORD": "secret", "DB_HOST": "127.0.0.1", "PORT": 5432, "DATABASE": "player_stats_test"}
+TEST_DB = os.environ.get('PLAYER_STATS_TEST_DB')
+
+
+@unittest.skipUnless(TEST_DB, 'PLAYER_STATS_TEST_DB is not set')
+class Tests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        settings = json.loads(TEST_DB)
+        password = settings.pop('PASSWORD', None)
+        for key, value in settings.items():
+            setattr(db_controller.db_settings, key, value)
+        cls.get_password = db_controller.keyring.get_password
+        db_controller.keyring.get_password = lambda app_id, username: password
+        db_controller.db_helper().test_db_setup()
+
+    @classmethod
+    def tearDownClass(cls):
+        db_controller.connection_pool.get_pool().close_all()
+        db_controller.keyring.get_password = cls.get_password
+
+    def setUp(self):
+        self.execute('''TRUNCATE player_activity, player_activity_hourly, player_activity_daily, rollup_watermark
+        RESTART IDENTITY''')
+        self.slow_writer = db_controller.db_access().open_connection()
+
+    def tearDown(self):
+        self.slow_writer[0].close()
+
+    def execute(self, query, args=()):
+        pool = db_controller.connection_pool.get_pool()
+        conn, cur = pool.checkout()
+        try:
+            cur.execute(query, args)
+            return cur.fetchall() if cur.description else None
+        finally:
+            pool.checkin(conn, cur)
+
+    def write_out_of_order(self, time_stamp):
+        """ Leaves a row open on the slow writer, then commits a row with a higher "Index" ahead of it """
+        conn, cur = self.slow_writer
+        db_controller.usage_rollups.lock_for_write(cur)
+        cur.copy_rows_from([(time_stamp, 1, '[]', 'slow')], 'player_activity',
+                           db_controller.sample_writer.COPY_COLUMNS)
+
+        writer = db_controller.sample_writer()
+        writer.add(time_stamp, 2, '[]', 'fast')
+        writer.flush()
+        self.assertEqual(self.execute('''SELECT "Index", "Server_Name" FROM player_activity'''), ([2, 'fast'],))
+
+    def run_blocked(self, target):
+        """ Runs target in a thread, checks it waits for the slow writer, then commits the slow writer """
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join(1)
+        self.assertTrue(thread.is_alive())
+        self.slow_writer[0].commit()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+
+    def rolled_up(self):
+        return self.execute('''SELECT "Server_Name", "Samples", "Player_Minutes" FROM player_activity_daily
+        ORDER BY 1''')
+
+    def testRefreshWaitsForRowsCommittedOutOfOrder(self):
+        self.write_out_of_order(datetime.now())
+        watermarks = []
+        self.run_blocked(lambda: watermarks.append(db_controller.usage_rollups().refresh()))
+
+        self.assertEqual(watermarks, [2])
+        self.assertEqual(self.rolled_up(), (['fast', 1, 2], ['slow', 1, 1]))
+        self.assertEqual(db_controller.usage_rollups().refresh(), 2)
+        self.assertEqual(self.rolled_up(), (['fast', 1, 2], ['slow', 1, 1]))
+
+    def testPurgeKeepsRowsCommittedOutOfOrder(self):
+        self.write_out_of_order(datetime.now() - timedelta(days=3))
+        deleted = []
+        self.run_blocked(lambda: deleted.append(db_controller.usage_rollups().purge(raw_days=1, hourly_days=400)))
+
+        self.assertEqual(deleted, [2])
+        self.assertEqual(self.execute('''SELECT count(*) FROM player_activity'''), ([0],))
+        self.assertEqual(self.rolled_up(), (['fast', 1, 2], ['slow', 1, 1]))
+        self.assertEqual(db_controller.usage_rollups().purge(raw_days=1, hourly_days=400), 0)
+        self.assertEqual(self.rolled_up(), (['fast', 1, 2], ['slow', 1, 1]))
+
+    def testFlushDropsOnlyTheRowsTheDbRejects(self):
+        writer = db_controller.sample_writer()
+        now = datetime.now()
+        for name in ('a', 'b', 'caf\xe9', 'd', 'e'):  # Not ASCII, so it can't go in the binary COPY
+            writer.add(now, 1, '[]', name)
+        writer.flush()
+        self.assertEqual(self.execute('''SELECT "Server_Name" FROM player_activity ORDER BY 1'''),
+                         (['a'], ['b'], ['d'], ['e']))
+
+        writer.flush()  # Nothing was requeued
+        self.assertEqual(self.execute('''SELECT count(*) FROM player_activity'''), ([4],))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import logging
+import sys
+import unittest
+from datetime import date
+
+import db_controller
+import report_generator
+
+
+class FakeSMTP(object):
+    """ Stands in for smtplib.SMTP, records what each session was used for """
+    sessions = []
+
+    def __init__(self, host, port):
+        self.logins = 0
+        self.sent = 0
+        self.quit_called = False
+        FakeSMTP.sessions.append(self)
+
+    def ehlo(self):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, username, password):
+        self.logins += 1
+
+    def sendmail(self, from_addr, to_addrs, message):
+        self.sent += 1
+
+    def quit(self):
+        self.quit_called = True
+
+
+class FakeCursor(object):
+    rowcount = 1
+    fetch_size = None
+
+    def execute(self, query, args):
+        pass
+
+    def __iter__(self):
+        return iter([('srv0', date(2026, 10, 18), 10, 45, 3)])
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    def cursor(self, name=None):
+        return FakeCursor()
+
+
+class FakePool(object):
+    def checkout(self):
+        return FakeConnection(), FakeCursor()
+
+    def checkin(self, connection, cursor):
+        pass
+
+
+class FakeRollups(object):
+    def refresh(self):
+        return 0
+
+
+class FakeDbHelper(object):
+    def test_db_setup(self):
+        pass
+
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        self.patched = []
+        self.patch(report_generator.smtplib, 'SMTP', FakeSMTP)
+        self.patch(report_generator.keyring, 'get_password', lambda app_id, username: 'secret')
+        self.patch(db_controller, 'db_helper', FakeDbHelper)
+        self.patch(db_controller, 'usage_rollups', FakeRollups)
+        self.patch(db_controller.connection_pool, 'get_pool', staticmethod(lambda: FakePool()))
+        self.patch(report_generator.gmailSettings, 'SEND_ALERT_TO', ['admin@example.com'])
+        # Keeps main() from pointing logging at a file
+        self.handler = logging.NullHandler()
+        logging.getLogger().addHandler(self.handler)
+        FakeSMTP.sessions = []
+
+    def tearDown(self):
+        logging.getLogger().removeHandler(self.handler)
+        for obj, name, value in reversed(self.patched):
+            setattr(obj, name, value)
+
+    def patch(self, obj, name, value):
+        self.patched.append((obj, name, obj.__dict__[name]))
+        setattr(obj, name, value)
+
+    def run_main(self, *args):
+        self.patch(sys, 'argv', ['report_generator.py'] + list(args))
+        report_generator.main()
+
+    def assertOneSession(self):
+        self.assertEqual(len(FakeSMTP.sessions), 1)
+        session = FakeSMTP.sessions[0]
+        self.assertEqual(session.logins, 1)
+        self.assertEqual(session.sent, 1)
+        self.assertTrue(session.quit_called)
+
+    def testGenerateReportLogsInOnce(self):
+        self.run_main('-g')
+        self.assertOneSession()
+
+    def testReportSchedulerLogsInOnce(self):
+        self.run_main('-s', '-d', '0')
+        self.assertOneSession()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,231 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import types
+import unittest
+
+try:
+    import mineos
+    FAKE_MINEOS = False
+except ImportError:
+    FAKE_MINEOS = True
+
+
+class FakeMc(object):
+    """ Just enough of mineos.mc for the registry, reads server.properties when built like the real one """
+    DEFAULT_PATHS = {'servers': 'servers', 'backup': 'backup'}
+
+    def __init__(self, server_name, owner=None, base_directory=None):
+        self.server_name = server_name
+        with open(os.path.join(base_directory, 'servers', server_name, 'server.properties')) as fh:
+            self.properties = fh.read()
+
+    @staticmethod
+    def list_servers(base_directory):
+        return os.listdir(os.path.join(base_directory, 'servers'))
+
+
+if FAKE_MINEOS:
+    mineos = types.ModuleType('mineos')
+    mineos.mc = FakeMc
+    sys.modules['mineos'] = mineos
+
+import db_controller
+import server_monitor
+
+
+class FakeServer(object):
+    """ Stands in for a server_logger, its check blocks until release() when hung """
+
+    def __init__(self, hung=False):
+        self.checks = 0
+        self.__released = threading.Event()
+        if not hung:
+            self.release()
+
+    def check_server_status(self):
+        self.checks += 1
+        self.__released.wait()
+
+    def release(self):
+        self.__released.set()
+
+
+class FakeClock(object):
+    """ Time only moves on when the test or the scheduler's sleep moves it """
+
+    def __init__(self):
+        self.now = 100.0
+        self.oversleep = 0.0  # Added to every sleep, like a busy machine
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds + self.oversleep
+
+
+class FakePool(object):
+    def __init__(self):
+        self.closed = False
+
+    def close_all(self):
+        self.closed = True
+
+
+class FakeWriter(object):
+    def __init__(self, interrupt=False):
+        self.interrupt = interrupt
+
+    def flush(self):
+        if self.interrupt:
+            raise KeyboardInterrupt
+
+
+class FakeRegistry(object):
+    def __init__(self, servers):
+        self.servers = servers
+
+    def get(self, server_name):
+        return self.servers[server_name]
+
+
+@unittest.skipUnless(FAKE_MINEOS, 'Needs the stand-in mineos module')
+class Tests(unittest.TestCase):
+    def setUp(self):
+        self.base_directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.base_directory, 'servers', 'survival'))
+        self.write_properties('server-port=25565\n', 1000)
+        self.registry = server_monitor.server_registry(owner='mc', base_directory=self.base_directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.base_directory)
+
+    def write_properties(self, text, mtime):
+        path = os.path.join(self.base_directory, 'servers', 'survival', 'server.properties')
+        with open(path, 'w') as fh:
+            fh.write(text)
+        os.utime(path, (mtime, mtime))
+
+    def testServerKeptUntilConfigChanges(self):
+        self.assertEqual(self.registry.server_names(), ['survival'])
+        server = self.registry.get('survival')
+        self.assertTrue(self.registry.get('survival') is server)
+
+        self.write_properties('server-port=25566\n', 2000)
+        reloaded = self.registry.get('survival')
+        self.assertFalse(reloaded is server)
+        self.assertEqual(reloaded.properties, 'server-port=25566\n')
+        self.assertTrue(self.registry.get('survival') is reloaded)
+
+    def testRemovedServerIsNotBroughtBack(self):
+        self.registry.get('survival')
+        servers = os.path.join(self.base_directory, 'servers')
+        os.rename(os.path.join(servers, 'survival'), os.path.join(servers, 'creative'))
+        os.utime(servers, (3000, 3000))
+
+        self.assertRaises(KeyError, self.registry.get, 'survival')
+        self.assertEqual(self.registry.server_names(), ['creative'])
+        self.assertEqual(self.registry.get('creative').server_name, 'creative')
+
+
+
+class PollerTests(unittest.TestCase):
+    def setUp(self):
+        self.servers = {'hung': FakeServer(hung=True), 'up': FakeServer()}
+        self.poller = server_monitor.server_poller(FakeRegistry(self.servers), workers=2, timeout=0.2)
+
+    def tearDown(self):
+        self.servers['hung'].release()  # Lets the worker threads go
+
+    def testSweepGivesUpAtTimeout(self):
+        started = server_monitor.time()
+        self.poller.poll(['hung', 'up'])
+        self.assertTrue(0.2 <= server_monitor.time() - started < 2)
+        self.assertEqual(self.servers['up'].checks, 1)
+
+    def testServerStillBeingCheckedIsSkipped(self):
+        self.poller.poll(['hung', 'up'])
+        self.poller.poll(['hung', 'up'])
+        self.assertEqual(self.servers['hung'].checks, 1)
+        self.assertEqual(self.servers['up'].checks, 2)
+
+        self.servers['hung'].release()
+        deadline = server_monitor.time() + 2
+        while self.servers['hung'].checks < 2 and server_monitor.time() < deadline:
+            self.poller.poll(['hung'])  # Skipped until the worker has finished with the hung check
+        self.assertEqual(self.servers['hung'].checks, 2)
+
+
+class SchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = server_monitor.tick_scheduler(10, clock=self.clock, sleep=self.clock.sleep)
+        self.scheduler.start()
+
+    def testMissedTicksAreSkipped(self):
+        self.clock.now += 3
+        self.scheduler.wait()
+        self.assertEqual(self.clock.now, 110)
+        self.assertEqual(self.scheduler.missed_ticks, 0)
+
+        self.clock.now += 25  # Overruns the ticks at 120 & 130
+        self.scheduler.wait()
+        self.assertEqual(self.clock.now, 140)
+        self.assertEqual(self.scheduler.last_sweep, 25)
+        self.assertEqual(self.scheduler.missed_ticks, 2)
+        self.assertEqual(self.scheduler.ticks, 2)
+
+    def testLagIsTracked(self):
+        self.clock.oversleep = 0.5
+        self.scheduler.wait()
+        self.assertEqual(self.scheduler.last_lag, 0.5)
+
+        self.clock.oversleep = 0.25
+        self.scheduler.wait()
+        self.assertEqual(self.scheduler.last_lag, 0.25)
+        self.assertEqual(self.scheduler.max_lag, 0.5)
+        self.assertEqual(self.clock.now, 120.25)  # Lag doesn't push the ticks back
+
+
+class RunTests(unittest.TestCase):
+    def setUp(self):
+        self.patched = []
+        self.pool = FakePool()
+        self.writer = FakeWriter()
+        self.patch(db_controller.connection_pool, 'get_pool', staticmethod(lambda: self.pool))
+        self.patch(db_controller.sample_writer, 'get_writer', staticmethod(lambda: self.writer))
+        self.mode = server_monitor.modes(base_directory=tempfile.gettempdir(), owner='mc', sleep_delay=10,
+                                         workers=1)
+        clock = FakeClock()
+        self.mode.scheduler = server_monitor.tick_scheduler(10, clock=clock, sleep=clock.sleep)
+        self.sweeps = 0
+
+    def tearDown(self):
+        for obj, name, value in reversed(self.patched):
+            setattr(obj, name, value)
+
+    def patch(self, obj, name, value):
+        self.patched.append((obj, name, obj.__dict__[name]))
+        setattr(obj, name, value)
+
+    def sweep(self):
+        self.sweeps += 1
+        if self.sweeps == 3:
+            raise KeyboardInterrupt
+
+    def testCtrlCInSweepClosesConnections(self):
+        self.mode.run(self.sweep)
+        self.assertEqual(self.sweeps, 3)
+        self.assertTrue(self.pool.closed)
+
+    def testCtrlCInFlushClosesConnections(self):
+        self.writer.interrupt = True
+        self.mode.run(self.sweep)
+        self.assertEqual(self.sweeps, 1)
+        self.assertTrue(self.pool.closed)
+
+if __name__ == "__main__":
+    unittest.main()